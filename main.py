@@ -2,17 +2,23 @@ import os
 import json
 import tomllib
 import traceback
-import uuid
 import time
 import base64
 import re
+import string
 import random
+import mmap
+import hashlib
+import sqlite3
 import asyncio
-import copy
+import threading
 from io import BytesIO
 from pathlib import Path
+from urllib.parse import urlsplit
 from typing import Dict, Any, Optional, List, Tuple, Union
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 # 标准库导入
 import aiohttp
@@ -21,6 +27,18 @@ from PIL import Image
 # 第三方库导入
 from loguru import logger
 
+# 可选依赖：pybase64提供SIMD加速的Base64编码，未安装时回退到标准库
+try:
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+# 可选依赖：orjson提供更快的JSON序列化/解析，未安装时回退到标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 框架导入
 from WechatAPI import WechatAPIClient
 from database.XYBotDB import XYBotDB
@@ -46,14 +64,28 @@ class GeminiImage(PluginBase):
     author = "XYBot"
     version = "2.0.0"
 
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _load_config(config_path: str, mtime: float) -> dict:
+        """解析配置文件，结果按(路径, 修改时间)缓存
+
+        Args:
+            config_path: 配置文件路径
+            mtime: 配置文件修改时间，仅作为缓存键，文件修改后会重新解析
+
+        Returns:
+            dict: 解析后的配置（共享对象，调用方不应修改）
+        """
+        with open(config_path, "rb") as f:
+            return tomllib.load(f)
+
     def __init__(self):
         super().__init__()
 
         try:
-            # 读取配置
+            # 读取配置，文件未修改时插件重载直接复用已解析的结果
             config_path = os.path.join(os.path.dirname(__file__), "config.toml")
-            with open(config_path, "rb") as f:
-                config = tomllib.load(f)
+            config = self._load_config(config_path, os.path.getmtime(config_path))
 
             # 获取Gemini配置
             plugin_config = config.get("GeminiImage", {})
@@ -92,16 +124,17 @@ class GeminiImage(PluginBase):
             self.model = plugin_config.get("model", "gemini-2.0-flash-exp-image-generation")
 
             # 获取命令配置
-            self.commands = plugin_config.get("commands", ["#生成图片", "#画图", "#图片生成"])
-            self.edit_commands = plugin_config.get("edit_commands", ["#编辑图片", "#修改图片"])
-            self.exit_commands = plugin_config.get("exit_commands", ["#结束对话", "#退出对话", "#关闭对话", "#结束"])  # 从配置读取结束对话命令
+            # 命令列表取自共享的已缓存配置，转换为元组，避免后续代码原地修改而影响下次重载
+            self.commands = tuple(plugin_config.get("commands", ["#生成图片", "#画图", "#图片生成"]))
+            self.edit_commands = tuple(plugin_config.get("edit_commands", ["#编辑图片", "#修改图片"]))
+            self.exit_commands = tuple(plugin_config.get("exit_commands", ["#结束对话", "#退出对话", "#关闭对话", "#结束"]))  # 从配置读取结束对话命令
 
             # 获取新增命令配置
-            self.merge_commands = plugin_config.get("merge_commands", ["#融图", "#合成图片"])
-            self.start_merge_commands = plugin_config.get("start_merge_commands", ["#开始融合", "#生成融图"])
-            self.image_reverse_commands = plugin_config.get("image_reverse_commands", ["#反推提示", "#反推"])
-            self.prompt_enhance_commands = plugin_config.get("prompt_enhance_commands", ["#提示词", "#生成提示词"])
-            self.image_analysis_commands = plugin_config.get("image_analysis_commands", ["#分析图片", "#图片分析", "g分析"])
+            self.merge_commands = tuple(plugin_config.get("merge_commands", ["#融图", "#合成图片"]))
+            self.start_merge_commands = tuple(plugin_config.get("start_merge_commands", ["#开始融合", "#生成融图"]))
+            self.image_reverse_commands = tuple(plugin_config.get("image_reverse_commands", ["#反推提示", "#反推"]))
+            self.prompt_enhance_commands = tuple(plugin_config.get("prompt_enhance_commands", ["#提示词", "#生成提示词"]))
+            self.image_analysis_commands = tuple(plugin_config.get("image_analysis_commands", ["#分析图片", "#图片分析", "g分析"]))
 
             # 记录命令配置
             logger.info(f"GeminiImage插件编辑图片命令配置: {self.edit_commands}")
@@ -111,6 +144,23 @@ class GeminiImage(PluginBase):
             logger.info(f"GeminiImage插件提示词增强命令配置: {self.prompt_enhance_commands}")
             logger.info(f"GeminiImage插件图片分析命令配置: {self.image_analysis_commands}")
 
+            # 预编译命令匹配，避免每条消息都重新构建正则、逐个遍历命令列表
+            self._cmd_buckets, self._cmd_prefixes = self._build_command_table(
+                (("generate", self.commands), ("edit", self.edit_commands))
+            )
+            # 引用图片消息支持的命令，两个入口的命令类型优先级不同，各建一张表
+            self._quote_cmd_buckets, self._quote_cmd_prefixes = self._build_command_table(
+                (("reverse", self.image_reverse_commands), ("analyze", self.image_analysis_commands), ("edit", self.edit_commands))
+            )
+            self._reference_cmd_buckets, self._reference_cmd_prefixes = self._build_command_table(
+                (("edit", self.edit_commands), ("reverse", self.image_reverse_commands), ("analyze", self.image_analysis_commands))
+            )
+            self._merge_cmd_regex = self._compile_command_regex(self.merge_commands)
+            self._start_merge_cmd_regex = self._compile_command_regex(self.start_merge_commands)
+            self._reverse_cmd_regex = self._compile_command_regex(self.image_reverse_commands)
+            self._analysis_cmd_regex = self._compile_command_regex(self.image_analysis_commands)
+            self._prompt_cmd_regex = self._compile_command_regex(self.prompt_enhance_commands)
+
             # 获取积分配置
             self.enable_points = plugin_config.get("enable_points", True)
             self.show_points_message = plugin_config.get("show_points_message", True)
@@ -124,13 +174,52 @@ class GeminiImage(PluginBase):
             self.save_path = plugin_config.get("save_path", "temp")
             self.save_dir = os.path.join(os.path.dirname(__file__), self.save_path)
             os.makedirs(self.save_dir, exist_ok=True)
+            # 持久化缓存目录，与临时图片目录分开，清理临时文件时不会误删
+            self.cache_path = plugin_config.get("cache_path", "data")
+            self.cache_dir = os.path.join(os.path.dirname(__file__), self.cache_path)
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # 上传给API的图片限制，超出时先缩放/重新编码，减少请求体积
+            self.upload_max_edge = 1568  # 上传图片的最长边(像素)
+            self.upload_max_bytes = 1024 * 1024  # 超过该大小的图片会重新编码
 
-            # 获取管理员列表
-            self.admins = plugin_config.get("admins", [])
+            # 获取管理员列表，转换为集合，每次扣积分前的管理员判断只需一次哈希查找
+            self.admins = frozenset(plugin_config.get("admins", []))
 
             # 获取代理配置
             self.enable_proxy = plugin_config.get("enable_proxy", False)
             self.proxy_url = plugin_config.get("proxy_url", "")
+            # 请求时实际使用的代理地址，只在加载配置时计算一次
+            self._proxy = self.proxy_url if self.enable_proxy and self.proxy_url else None
+
+            # 共享的HTTP会话，复用TCP/TLS连接，首次请求时在事件循环中创建
+            self._http_session = None
+            # 请求超时配置只创建一次，所有请求共用
+            self._api_timeout = aiohttp.ClientTimeout(total=60)
+            self._edit_timeout = aiohttp.ClientTimeout(total=300)  # 编辑图片耗时较长
+
+            # 正在进行中的提示词增强请求，相同请求在同一时刻只发送一次
+            self._inflight_requests = {}  # 请求标识，例如(请求类型, 提示词摘要) -> asyncio.Task
+            # 后台发送中的“请稍候”提示消息，保留引用避免任务在完成前被回收
+            self._notice_tasks = set()
+            self._prewarm_task = None  # 启用插件时预热API连接的后台任务
+            # 分镜场景的单图请求并发上限：多个场景同时发出请求容易触发API限流，
+            # 限流后的重试又会一起再撞上限流，限制并发让请求平稳排队；首次使用时在事件循环中创建
+            self._scene_request_limit = None
+            self._scene_request_concurrency = 4
+            # 提示词增强结果的LRU缓存，重复的提示词直接复用结果，省去一次API往返
+            self._enhance_cache = OrderedDict()  # (请求类型, 提示词摘要) -> 增强后的提示词
+            self._enhance_cache_max_entries = 256
+            # 提示词增强结果同时持久化到SQLite，插件重启后常用提示词仍能命中，只在IO线程池中访问
+            self._enhance_db_path = os.path.join(self.cache_dir, "enhance_cache.sqlite")
+            self._enhance_db = None
+            self._enhance_db_lock = threading.Lock()
+            self._enhance_db_closed = False  # 插件禁用后置为True，之后排队的读写直接跳过，不再重新打开数据库
+            self._enhance_db_ttl = 30 * 24 * 3600  # 持久化结果保留30天
+
+            # 后台IO线程池，用于生成结果的落盘，避免阻塞事件循环
+            self._io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geminiimg-io")
+            self._io_closed = False  # 插件禁用后线程池已关闭，后续IO改用事件循环的默认线程池
 
             # 获取API基础URL配置
             self.base_url = plugin_config.get("base_url", "https://generativelanguage.googleapis.com")
@@ -138,10 +227,18 @@ class GeminiImage(PluginBase):
             if self.base_url and self.base_url.endswith("/"):
                 self.base_url = self.base_url.rstrip("/")
 
+            # 所有API请求共用的请求头（设置在共享会话上）和按模型缓存的请求URL，不在每次调用时重新构建
+            self._api_headers = {"Content-Type": "application/json"}
+            self._model_urls = {}  # 模型名 -> generateContent请求URL
+
             # 检查是否是标准Google AI URL
             if self.base_url and "generativelanguage.googleapis.com" not in self.base_url:
                 logger.warning(f"Base URL '{self.base_url}' doesn't look like standard Google AI URL. Ensure it's correct.")
 
+            # 图片生成/编辑请求中固定不变的部分只构建一次，所有请求共享（只读，不要就地修改）
+            self._image_model_url = self._model_url("gemini-2.0-flash-exp-image-generation")
+            self._image_generation_config = {"response_modalities": ["Text", "Image"]}
+
             # 获取提示词增强相关配置
             self.enhance_prompt = plugin_config.get("enhance_prompt", True)
             self.prompt_model = plugin_config.get("prompt_model", "gemini-2.0-flash")
@@ -149,13 +246,29 @@ class GeminiImage(PluginBase):
             self.analysis_model = plugin_config.get("analysis_model", "gemini-2.0-flash")
 
             # 获取对话前缀配置
-            self.conversation_prefixes = plugin_config.get("conversation_prefixes", ["@绘图", "@图片", "@Gemini"])
+            self.conversation_prefixes = tuple(plugin_config.get("conversation_prefixes", ["@绘图", "@图片", "@Gemini"]))
             self.require_prefix_for_conversation = plugin_config.get("require_prefix_for_conversation", True)
 
+            # 所有可能触发本插件的文本前缀，用于在分发前快速过滤无关消息
+            self._trigger_prefixes = tuple(
+                self.commands + self.edit_commands + self.exit_commands + self.merge_commands
+                + self.start_merge_commands + self.image_reverse_commands + self.prompt_enhance_commands
+                + self.image_analysis_commands + self.conversation_prefixes
+            )
+
             # 获取重试机制相关配置
             self.max_retries = plugin_config.get("max_retries", 3)
             self.initial_retry_delay = plugin_config.get("initial_retry_delay", 1)
             self.max_retry_delay = plugin_config.get("max_retry_delay", 10)
+            self._retry_status_codes = frozenset((429, 500, 502, 503, 504))  # 需要重试的状态码
+
+            # API错误状态码 -> 返回给用户的提示，所有调用处共用一张表
+            self._api_error_messages = {
+                400: "请求参数有误，请修改描述后再试",
+                401: "API密钥无效，请联系管理员检查配置",
+                403: "API密钥没有访问权限，请联系管理员检查配置",
+                429: "请求过于频繁，请稍后再试",
+            }
 
             # 获取融图相关配置
             self.max_merge_images = plugin_config.get("max_merge_images", 5)
@@ -168,18 +281,45 @@ class GeminiImage(PluginBase):
             self.db = XYBotDB()
 
             # 初始化会话状态，用于保存上下文
-            self.conversations = defaultdict(list)  # 用户ID -> 对话历史列表
+            self.conversation_max_length = 10  # 每个会话最多保留的消息条数
+            self.conversations = {}  # 用户ID -> 对话历史（deque，自动截断；仅在真正开始对话时创建）
             self.conversation_expiry = 600  # 会话过期时间(秒)
-            self.conversation_timestamps = {}  # 用户ID -> 最后活动时间
+            self.conversation_timestamps = {}  # 用户ID -> 最后活动时间（按活动时间先后排列，最早的在前）
 
             # 存储最后一次生成的图片路径
             self.last_images = {}  # 会话标识 -> 最后一次生成的图片路径
+            # 最近保存图片的原始数据，连续编辑时直接复用，无需再从磁盘读取刚写入的文件
+            self._recent_image_bytes = OrderedDict()  # 图片路径 -> 图片数据
+            self._recent_image_bytes_max_entries = 32  # 最近图片数据缓存最大条目数
 
             # 全局图片缓存，用于存储最近接收到的图片
             # 修改为使用(聊天ID, 用户ID)作为键，以区分群聊中不同用户
-            self.image_cache = {}  # (聊天ID, 用户ID) -> {content: bytes, timestamp: float}
+            # 使用OrderedDict实现LRU淘汰，限制缓存条目数，避免大量会话时图片数据占满内存
+            self.image_cache = OrderedDict()  # (聊天ID, 用户ID) -> {content: bytes, timestamp: float}
+            self.image_cache_max_entries = plugin_config.get("image_cache_max_entries", 64)  # 图片缓存最大条目数
+            self._image_cache_index = defaultdict(set)  # 聊天ID/用户ID -> 包含该ID的缓存键集合
+            # 按写入顺序记录(时间戳, 缓存键)，清理过期缓存时只需从队头弹出，无需扫描整个缓存
+            self._image_cache_expiry = deque()
+
+            # 会话历史图片的inlineData缓存，避免每轮对话都重新读取并编码全部历史图片
+            self._history_part_cache = OrderedDict()  # (图片路径, 修改时间) -> inlineData请求片段
+            self._history_part_cache_max_entries = 32  # 历史图片缓存最大条目数
+            # 待上传图片的inlineData缓存，同一张图片先后用于编辑、分析、反推或失败重试时不再重复压缩和编码
+            self._upload_part_cache = OrderedDict()  # 图片内容摘要 -> inlineData请求片段
+            self._upload_part_cache_max_entries = 16  # 待上传图片缓存最大条目数
+            # 图片分析结果的LRU缓存，同一张图片问同一个问题时直接返回上次的分析结果
+            self._analysis_cache = OrderedDict()  # (分析模型, 图片内容摘要, 分析提示) -> 分析结果
+            self._analysis_cache_max_entries = 128
             self.image_cache_timeout = 300  # 图片缓存过期时间(秒)
 
+            # 消息处理中的清理频率限制
+            self._cleanup_interval = 60  # 两次清理之间的最小间隔(秒)
+            self._last_cleanup = 0.0  # 上次清理时间
+
+            # base64字符处理表，用 str.translate / 预编译正则在C层一次扫描完成，避免逐字符的Python循环
+            self._base64_delete_table = str.maketrans('', '', string.ascii_letters + string.digits + '+/=')
+            self._non_base64_regex = re.compile(r'[^A-Za-z0-9+/=]+')
+
             # 融图相关状态变量
             self.waiting_for_merge_images = {}  # 用户ID -> {"提示词": 提示词, "图片列表": [图片数据], "开始时间": 时间戳}
 
@@ -202,6 +342,10 @@ class GeminiImage(PluginBase):
             # 保存配置对象，供其他方法使用
             self.config = plugin_config
 
+            # 群聊唤醒词和@机器人标记只在加载配置时计算一次，避免每条群消息重复读取配置、拼接字符串
+            self.wake_words = tuple(plugin_config.get("wake_words", []))
+            self._at_patterns = tuple(f"@{name}" for name in plugin_config.get("robot_names", ["bot", "机器人"]))
+
             # 验证关键配置
             if not any(self.api_keys) or all(not key for key in self.api_keys):
                 logger.warning("GeminiImage插件未配置有效的API密钥")
@@ -222,40 +366,23 @@ class GeminiImage(PluginBase):
     async def handle_quote(self, bot: WechatAPIClient, message: dict) -> bool:
         """处理引用消息"""
         # 添加更详细的日志，记录完整的消息内容
-        logger.info(f"GeminiImage.handle_quote被调用，消息: {message}")
+        logger.debug("GeminiImage.handle_quote被调用，消息: {}", message)
 
         if not self.enable:
-            logger.info("GeminiImage插件未启用，跳过处理")
+            logger.debug("GeminiImage插件未启用，跳过处理")
             return True  # 插件未启用，继续执行后续插件
 
         content = message.get("Content", "").strip()
-        logger.info(f"GeminiImage收到引用消息: {content}")
-        logger.info(f"当前反向提示词命令配置: {self.image_reverse_commands}")
-
-        # 检查是否是反向提示词命令
-        is_reverse_command = False
-        for cmd in self.image_reverse_commands:
-            logger.info(f"检查命令 '{cmd}' 是否匹配内容 '{content}'")
-            if content.startswith(cmd):
-                is_reverse_command = True
-                logger.info(f"匹配成功！命令 '{cmd}' 匹配内容 '{content}'")
-                break
+        logger.debug("GeminiImage收到引用消息: {}", content)
+        logger.debug("当前反向提示词命令配置: {}", self.image_reverse_commands)
 
-        # 检查是否是图片分析命令
-        is_analyze_command = False
-        if not is_reverse_command:
-            for cmd in self.image_analysis_commands:
-                if content.startswith(cmd):
-                    is_analyze_command = True
-                    break
-
-        # 检查是否是编辑图片命令
-        is_edit_command = False
-        if not is_reverse_command and not is_analyze_command:
-            for cmd in self.edit_commands:
-                if content.startswith(cmd):
-                    is_edit_command = True
-                    break
+        # 一次匹配反向提示词、图片分析和编辑图片命令
+        cmd_type, used_command = self._match_command(content, self._quote_cmd_buckets, self._quote_cmd_prefixes)
+        if used_command:
+            logger.info(f"匹配成功！命令 '{used_command}' 匹配内容 '{content}'")
+        is_reverse_command = cmd_type == "reverse"
+        is_analyze_command = cmd_type == "analyze"
+        is_edit_command = cmd_type == "edit"
 
         # 如果不是我们处理的命令，允许其他插件处理
         if not is_reverse_command and not is_analyze_command and not is_edit_command:
@@ -323,11 +450,10 @@ class GeminiImage(PluginBase):
 
             try:
                 # 发送处理中消息
-                await bot.send_at_message(from_wxid, "\n正在分析图片，生成提示词，请稍候...", [sender_wxid])
+                self._send_notice(bot.send_at_message(from_wxid, "\n正在分析图片，生成提示词，请稍候...", [sender_wxid]))
 
                 # 读取图片
-                with open(app_file_path, "rb") as f:
-                    image_data = f.read()
+                image_data = self._read_image_file(app_file_path)
 
                 # 扣除积分
                 if self.enable_points and sender_wxid not in self.admins:
@@ -361,12 +487,7 @@ class GeminiImage(PluginBase):
             logger.info(f"处理引用图片的分析命令: {content}")
 
             # 提取用户的分析问题（如果有）
-            cmd_length = 0
-            for cmd in self.image_analysis_commands:
-                if content.startswith(cmd):
-                    cmd_length = len(cmd)
-                    break
-            user_query = content[cmd_length:].strip()
+            user_query = content[len(used_command):].strip()
 
             # 检查积分
             if self.enable_points and sender_wxid not in self.admins:
@@ -378,13 +499,12 @@ class GeminiImage(PluginBase):
             try:
                 # 发送处理中消息
                 if user_query:
-                    await bot.send_at_message(from_wxid, f"\n正在分析图片，特别关注：{user_query}，请稍候...", [sender_wxid])
+                    self._send_notice(bot.send_at_message(from_wxid, f"\n正在分析图片，特别关注：{user_query}，请稍候...", [sender_wxid]))
                 else:
-                    await bot.send_at_message(from_wxid, "\n正在分析图片，请稍候...", [sender_wxid])
+                    self._send_notice(bot.send_at_message(from_wxid, "\n正在分析图片，请稍候...", [sender_wxid]))
 
                 # 读取图片
-                with open(app_file_path, "rb") as f:
-                    image_data = f.read()
+                image_data = self._read_image_file(app_file_path)
 
                 # 扣除积分
                 if self.enable_points and sender_wxid not in self.admins:
@@ -418,12 +538,7 @@ class GeminiImage(PluginBase):
             logger.info(f"处理引用图片的编辑命令: {content}")
 
             # 提取提示词
-            cmd_length = 0
-            for cmd in self.edit_commands:
-                if content.startswith(cmd):
-                    cmd_length = len(cmd)
-                    break
-            prompt = content[cmd_length:].strip()
+            prompt = content[len(used_command):].strip()
 
             if not prompt:
                 await bot.send_at_message(from_wxid, f"\n请提供编辑描述，格式：[命令] [描述]", [sender_wxid])
@@ -431,93 +546,15 @@ class GeminiImage(PluginBase):
 
             try:
                 # 发送处理中消息
-                await bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid])
+                self._send_notice(bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid]))
 
                 # 读取图片
-                with open(app_file_path, "rb") as f:
-                    image_data = f.read()
-
-                # 获取会话上下文
-                conversation_history = self.conversations.get(conversation_key, [])
+                image_data = self._read_image_file(app_file_path)
 
-                # 调用Gemini API编辑图片
+                # 调用Gemini API编辑图片，并保存、回复结果
                 logger.info(f"引用图片编辑，使用提示词: '{prompt}'")
-                edited_images, text_responses = await self._edit_image(prompt, image_data, conversation_history)
-
-                # 确保 edited_images 和 text_responses 不为 None
-                if edited_images is None:
-                    edited_images = []
-                if text_responses is None:
-                    text_responses = []
-
-                if len(edited_images) > 0 and edited_images[0]:
-                    # 保存编辑后的图片
-                    edited_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                    logger.info(f"保存编辑后的图片到: {edited_image_path}, 数据大小: {len(edited_images[0])} 字节")
-                    with open(edited_image_path, "wb") as f:
-                        f.write(edited_images[0])
-
-                    # 更新最后生成的图片路径
-                    self.last_images[conversation_key] = edited_image_path
-
-                    # 发送文本回复（如果有）
-                    first_valid_text = next((t for t in text_responses if t), None)
-                    if first_valid_text:
-                        # 清理文本，去除多余的空格和换行
-                        cleaned_text = first_valid_text.strip()
-                        # 将多个连续空格替换为单个空格
-                        cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-                        # 移除文本开头和结尾的引号
-                        if cleaned_text.startswith('"') and cleaned_text.endswith('"'):
-                            cleaned_text = cleaned_text[1:-1]
-                        await bot.send_text_message(from_wxid, cleaned_text)
-                    else:
-                        await bot.send_text_message(from_wxid, "图片编辑成功！")
-                    # 添加短暂延迟，确保文本发送完成
-                    await asyncio.sleep(0.5)
-
-                    # 发送图片
-                    logger.info(f"准备发送编辑后的图片: {edited_image_path}")
-                    with open(edited_image_path, "rb") as f:
-                        await bot.send_image_message(from_wxid, f.read())
-                    # 添加延迟，确保图片发送完成
-                    await asyncio.sleep(1.5)
-
-                    # 更新会话历史
-                    user_message = {
-                        "role": "user",
-                        "parts": [
-                            {"text": prompt},
-                            {"image_url": app_file_path}
-                        ]
-                    }
-                    conversation_history.append(user_message)
-
-                    assistant_message = {
-                        "role": "model",
-                        "parts": [
-                            {"text": first_valid_text if first_valid_text else "我已编辑完成图片"},
-                            {"image_url": edited_image_path}
-                        ]
-                    }
-                    conversation_history.append(assistant_message)
-
-                    # 更新会话历史
-                    self.conversations[conversation_key] = conversation_history
-
-                    # 更新会话时间戳
-                    self.conversation_timestamps[conversation_key] = time.time()
-                else:
-                    # 检查是否有文本响应，可能是内容被拒绝
-                    first_valid_text = next((t for t in text_responses if t), None)
-                    if first_valid_text:
-                        # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                        translated_response = self._translate_gemini_message(first_valid_text)
-                        await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
-                        logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
-                    else:
-                        logger.error(f"编辑图片失败，未获取到有效的图片数据")
-                        await bot.send_at_message(from_wxid, "\n图片编辑失败，请稍后再试或修改描述", [sender_wxid])
+                await self._do_edit_and_reply(bot, from_wxid, conversation_key, prompt, image_data, app_file_path,
+                                              at_user=sender_wxid, clean_text=True)
             except Exception as e:
                 logger.error(f"编辑图片失败: {str(e)}")
                 logger.error(traceback.format_exc())
@@ -533,54 +570,40 @@ class GeminiImage(PluginBase):
         if not self.enable:
             return True  # 插件未启用，继续执行后续插件
 
-        # 记录收到的消息详情，帮助调试
         content = message.get("Content", "").strip()
-        logger.info(f"GeminiImage收到文本消息: {content}")
-        logger.info(f"当前编辑命令列表: {self.edit_commands}")
+
+        # 快速过滤：需要前缀时，不以任何命令或对话前缀开头的消息与本插件无关，直接放行
+        if self.require_prefix_for_conversation:
+            text = message.get("content", content).strip()
+            if not text.startswith(self._trigger_prefixes) and not content.startswith(self._trigger_prefixes):
+                return True
+
+        # 获取会话信息，只读取一次消息字段
+        from_wxid = message.get("FromWxid", "")
+        sender_wxid = message.get("SenderWxid", "")
+        is_group = message.get("IsGroup", False)
+
+        # 记录收到的消息详情，帮助调试
+        logger.debug("GeminiImage收到文本消息: {}", content)
+        logger.debug("当前编辑命令列表: {}", self.edit_commands)
 
         # 检查是否是引用消息
         reference_id = message.get("ReferenceId", "")
         if reference_id:
-            logger.info(f"检测到引用消息，引用ID: {reference_id}")
-            logger.info(f"引用消息内容: {message.get('Quote', {})}")
-
-            # 特殊处理引用消息中的命令
-            is_edit_command = False
-            is_reverse_command = False
-            is_analyze_command = False
-            used_command = ""
-
-            # 检查是否是编辑图片命令
-            for cmd in self.edit_commands:
-                if content.startswith(cmd):
-                    is_edit_command = True
-                    used_command = cmd
-                    break
+            logger.debug("检测到引用消息，引用ID: {}", reference_id)
+            logger.debug("引用消息内容: {}", message.get("Quote", {}))
+            conversation_key = f"{from_wxid}_{sender_wxid}"
 
-            # 检查是否是反向提示词命令
-            if not is_edit_command:
-                for cmd in self.image_reverse_commands:
-                    if content.startswith(cmd):
-                        is_reverse_command = True
-                        used_command = cmd
-                        break
-
-            # 检查是否是图片分析命令
-            if not is_edit_command and not is_reverse_command:
-                for cmd in self.image_analysis_commands:
-                    if content.startswith(cmd):
-                        is_analyze_command = True
-                        used_command = cmd
-                        break
+            # 特殊处理引用消息中的命令：一次匹配编辑图片、反向提示词和图片分析命令
+            cmd_type, used_command = self._match_command(content, self._reference_cmd_buckets, self._reference_cmd_prefixes)
+            used_command = used_command or ""
+            is_edit_command = cmd_type == "edit"
+            is_reverse_command = cmd_type == "reverse"
+            is_analyze_command = cmd_type == "analyze"
 
             if is_edit_command:
                 logger.info(f"检测到引用图片的编辑命令: {content}，使用的命令: {used_command}")
 
-                # 获取会话信息
-                from_wxid = message.get("FromWxid", "")
-                sender_wxid = message.get("SenderWxid", "")
-                conversation_key = f"{from_wxid}_{sender_wxid}"
-
                 # 提取提示词
                 prompt = content[len(used_command):].strip()
                 if not prompt:
@@ -619,92 +642,14 @@ class GeminiImage(PluginBase):
                                 # 编辑图片
                                 try:
                                     # 发送处理中消息
-                                    await bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid])
+                                    self._send_notice(bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid]))
 
                                     # 读取图片
-                                    with open(app_file_path, "rb") as f:
-                                        image_data = f.read()
-
-                                    # 获取会话上下文
-                                    conversation_history = self.conversations.get(conversation_key, [])
-
-                                    # 调用Gemini API编辑图片
-                                    edited_images, text_responses = await self._edit_image(prompt, image_data, conversation_history)
-
-                                    # 确保 edited_images 和 text_responses 不为 None
-                                    if edited_images is None:
-                                        edited_images = []
-                                    if text_responses is None:
-                                        text_responses = []
-
-                                    if len(edited_images) > 0 and edited_images[0]:
-                                        # 保存编辑后的图片
-                                        edited_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                        logger.info(f"保存编辑后的图片到: {edited_image_path}, 数据大小: {len(edited_images[0])} 字节")
-                                        with open(edited_image_path, "wb") as f:
-                                            f.write(edited_images[0])
-
-                                        # 更新最后生成的图片路径
-                                        self.last_images[conversation_key] = edited_image_path
-
-                                        # 发送文本回复（如果有）
-                                        first_valid_text = next((t for t in text_responses if t), None)
-                                        if first_valid_text:
-                                            # 清理文本，去除多余的空格和换行
-                                            cleaned_text = first_valid_text.strip()
-                                            # 将多个连续空格替换为单个空格
-                                            cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-                                            # 移除文本开头和结尾的引号
-                                            if cleaned_text.startswith('"') and cleaned_text.endswith('"'):
-                                                cleaned_text = cleaned_text[1:-1]
-                                            await bot.send_text_message(from_wxid, cleaned_text)
-                                        else:
-                                            await bot.send_text_message(from_wxid, "图片编辑成功！")
-                                        # 添加短暂延迟，确保文本发送完成
-                                        await asyncio.sleep(0.5)
-
-                                        # 发送图片
-                                        logger.info(f"准备发送编辑后的图片: {edited_image_path}")
-                                        with open(edited_image_path, "rb") as f:
-                                            await bot.send_image_message(from_wxid, f.read())
-                                        # 添加延迟，确保图片发送完成
-                                        await asyncio.sleep(1.5)
-
-                                        # 更新会话历史
-                                        user_message = {
-                                            "role": "user",
-                                            "parts": [
-                                                {"text": prompt},
-                                                {"image_url": app_file_path}
-                                            ]
-                                        }
-                                        conversation_history.append(user_message)
-
-                                        assistant_message = {
-                                            "role": "model",
-                                            "parts": [
-                                                {"text": first_valid_text if first_valid_text else "我已编辑完成图片"},
-                                                {"image_url": edited_image_path}
-                                            ]
-                                        }
-                                        conversation_history.append(assistant_message)
+                                    image_data = self._read_image_file(app_file_path)
 
-                                        # 更新会话历史
-                                        self.conversations[conversation_key] = conversation_history
-
-                                        # 更新会话时间戳
-                                        self.conversation_timestamps[conversation_key] = time.time()
-                                    else:
-                                        # 检查是否有文本响应，可能是内容被拒绝
-                                        first_valid_text = next((t for t in text_responses if t), None)
-                                        if first_valid_text:
-                                            # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                                            translated_response = self._translate_gemini_message(first_valid_text)
-                                            await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
-                                            logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
-                                        else:
-                                            logger.error(f"编辑图片失败，未获取到有效的图片数据")
-                                            await bot.send_at_message(from_wxid, "\n图片编辑失败，请稍后再试或修改描述", [sender_wxid])
+                                    # 调用Gemini API编辑图片，并保存、回复结果
+                                    await self._do_edit_and_reply(bot, from_wxid, conversation_key, prompt, image_data, app_file_path,
+                                                                  at_user=sender_wxid, clean_text=True)
                                 except Exception as e:
                                     logger.error(f"编辑图片失败: {str(e)}")
                                     logger.error(traceback.format_exc())
@@ -715,11 +660,6 @@ class GeminiImage(PluginBase):
             elif is_reverse_command:
                 logger.info(f"检测到引用图片的反向提示词命令: {content}，使用的命令: {used_command}")
 
-                # 获取会话信息
-                from_wxid = message.get("FromWxid", "")
-                sender_wxid = message.get("SenderWxid", "")
-                conversation_key = f"{from_wxid}_{sender_wxid}"
-
                 # 检查积分
                 if self.enable_points and sender_wxid not in self.admins:
                     points = self.db.get_points(sender_wxid)
@@ -764,11 +704,10 @@ class GeminiImage(PluginBase):
                                 # 反向提示词
                                 try:
                                     # 发送处理中消息
-                                    await bot.send_at_message(from_wxid, "\n正在分析图片，生成提示词，请稍候...", [sender_wxid])
+                                    self._send_notice(bot.send_at_message(from_wxid, "\n正在分析图片，生成提示词，请稍候...", [sender_wxid]))
 
                                     # 读取图片
-                                    with open(app_file_path, "rb") as f:
-                                        image_data = f.read()
+                                    image_data = self._read_image_file(app_file_path)
 
                                     # 扣除积分
                                     if self.enable_points and sender_wxid not in self.admins:
@@ -800,11 +739,6 @@ class GeminiImage(PluginBase):
             elif is_analyze_command:
                 logger.info(f"检测到引用图片的分析命令: {content}，使用的命令: {used_command}")
 
-                # 获取会话信息
-                from_wxid = message.get("FromWxid", "")
-                sender_wxid = message.get("SenderWxid", "")
-                conversation_key = f"{from_wxid}_{sender_wxid}"
-
                 # 提取用户的分析问题（如果有）
                 cmd_length = len(used_command)
                 user_query = content[cmd_length:].strip()
@@ -854,13 +788,12 @@ class GeminiImage(PluginBase):
                                 try:
                                     # 发送处理中消息
                                     if user_query:
-                                        await bot.send_at_message(from_wxid, f"\n正在分析图片，特别关注：{user_query}，请稍候...", [sender_wxid])
+                                        self._send_notice(bot.send_at_message(from_wxid, f"\n正在分析图片，特别关注：{user_query}，请稍候...", [sender_wxid]))
                                     else:
-                                        await bot.send_at_message(from_wxid, "\n正在分析图片，请稍候...", [sender_wxid])
+                                        self._send_notice(bot.send_at_message(from_wxid, "\n正在分析图片，请稍候...", [sender_wxid]))
 
                                     # 读取图片
-                                    with open(app_file_path, "rb") as f:
-                                        image_data = f.read()
+                                    image_data = self._read_image_file(app_file_path)
 
                                     # 扣除积分
                                     if self.enable_points and sender_wxid not in self.admins:
@@ -892,8 +825,8 @@ class GeminiImage(PluginBase):
         # 检查是否是融图命令
         # 尝试获取不同格式的消息内容
         text = message.get("content", message.get("Content", "")).strip()
-        chat_id = message.get("chat_id", message.get("FromWxid", ""))
-        user_id = message.get("user_id", message.get("SenderWxid", ""))
+        chat_id = message.get("chat_id", from_wxid)
+        user_id = message.get("user_id", sender_wxid)
         conversation_key = f"{chat_id}_{user_id}"
 
         logger.info(f"GeminiImage收到消息: {text[:20]}{'...' if len(text) > 20 else ''}")
@@ -909,14 +842,14 @@ class GeminiImage(PluginBase):
             if conversation_key not in self.conversations:
                 logger.info(f"没有找到活跃会话，但检测到前缀，为用户 {user_id} 创建新会话")
                 # 创建新会话
-                self.conversations[conversation_key] = []
-                self.conversation_timestamps[conversation_key] = time.time()
+                self.conversations[conversation_key] = deque(maxlen=self.conversation_max_length)
+                self._touch_conversation(conversation_key)
 
             # 更新content为处理后的内容（已移除前缀）
             content = processed_content
 
             # 在群聊中，检查是否包含唤醒词或@机器人
-            if message.get("IsGroup", False):
+            if is_group:
                 # 在群聊中必须包含唤醒词或@机器人才能继续对话
                 if not self.has_wake_word(content) and not self.is_at_message(message):
                     # 没有唤醒词，不处理
@@ -949,10 +882,10 @@ class GeminiImage(PluginBase):
                         return False  # 积分不足，阻止后续插件执行
 
                 # 发送处理中消息
-                await bot.send_at_message(chat_id, "\n正在处理您的请求，请稍候...", [user_id])
+                self._send_notice(bot.send_at_message(chat_id, "\n正在处理您的请求，请稍候...", [user_id]))
 
                 # 获取上下文历史
-                conversation_history = self.conversations[conversation_key]
+                conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
                 logger.info(f"对话历史长度: {len(conversation_history)}")
 
                 # 添加用户提示到会话
@@ -963,14 +896,18 @@ class GeminiImage(PluginBase):
                 logger.info(f"上一次图片路径: {last_image_path}")
 
                 # 如果没有找到图片路径，尝试从缓存获取
-                if not last_image_path or not os.path.exists(last_image_path):
+                if not last_image_path or not self._image_available(last_image_path):
                     logger.info("未找到上一次图片路径，尝试从缓存获取")
-                    image_data = await self._get_recent_image(chat_id, user_id)
-                    if image_data:
+                    path, image_data = await self._get_recent_image(chat_id, user_id)
+                    if path:
+                        # 如果找到图片路径，直接使用
+                        last_image_path = path
+                        self.last_images[conversation_key] = last_image_path
+                        logger.info(f"直接使用缓存的图片路径: {last_image_path}")
+                    elif image_data:
                         # 如果找到缓存的图片，保存到本地再处理
-                        image_path = os.path.join(self.save_dir, f"temp_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                        with open(image_path, "wb") as f:
-                            f.write(image_data)
+                        image_path = self._new_file_path("temp")
+                        self._atomic_write(image_path, image_data)
                         self.last_images[conversation_key] = image_path
                         last_image_path = image_path
                         logger.info(f"从缓存找到图片，保存到：{image_path}")
@@ -981,17 +918,16 @@ class GeminiImage(PluginBase):
                         # 尝试使用更宽松的条件查找图片路径
                         logger.info("未找到缓存图片，尝试使用更宽松的条件查找图片路径")
                         for key, value in self.last_images.items():
-                            if (chat_id in key or user_id in key) and os.path.exists(value):
+                            if (chat_id in key or user_id in key) and self._image_available(value):
                                 last_image_path = value
                                 logger.info(f"使用宽松条件找到图片路径: {last_image_path}, 键: {key}")
                                 break
 
-                if last_image_path and os.path.exists(last_image_path):
+                if last_image_path and self._image_available(last_image_path):
                     # 处理带图片的连续对话
                     logger.info(f"找到上一次图片，将使用该图片进行编辑")
-                    # 读取上一次生成的图片
-                    with open(last_image_path, "rb") as f:
-                        image_data = f.read()
+                    # 读取上一次生成的图片（刚生成的图片直接使用内存中的数据）
+                    image_data = self._read_image_file(last_image_path)
 
                     # 调用编辑图片API
                     logger.info(f"调用编辑图片API")
@@ -1010,9 +946,8 @@ class GeminiImage(PluginBase):
                     if len(edited_images) > 0 and edited_images[0]:
                         logger.info(f"成功获取编辑后的图片结果")
                         # 保存编辑后的图片
-                        new_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                        with open(new_image_path, "wb") as f:
-                            f.write(edited_images[0])
+                        new_image_path = self._new_file_path("edited")
+                        new_image_path = self._persist_image(new_image_path, edited_images[0])
 
                         # 更新最后生成的图片路径
                         self.last_images[conversation_key] = new_image_path
@@ -1027,59 +962,17 @@ class GeminiImage(PluginBase):
 
                         # 发送文本回复（如果有）
                         first_valid_text = next((t for t in text_responses if t), None)
-                        if first_valid_text:
-                            # 清理文本，去除多余的空格和换行
-                            cleaned_text = first_valid_text.strip()
-                            # 将多个连续空格替换为单个空格
-                            import re
-                            cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-                            # 移除文本开头和结尾的引号
-                            if cleaned_text.startswith('"') and cleaned_text.endswith('"'):
-                                cleaned_text = cleaned_text[1:-1]
-                            # 构建消息文本，避免在没有积分消息时添加多余的换行
-                            if points_msg:
-                                message_text = f"{cleaned_text}\n\n{points_msg}"
-                            else:
-                                message_text = cleaned_text
-                            await bot.send_text_message(chat_id, message_text)
-                        else:
-                            await bot.send_text_message(chat_id, f"图片编辑成功！{points_msg if points_msg else ''}")
-                        # 添加短暂延迟，确保文本发送完成
-                        await asyncio.sleep(0.5)
+                        message_text = self._format_edit_reply(first_valid_text, points_msg)
 
-                        # 发送图片
+                        # 发送文本（如果有）和图片
                         logger.info(f"发送编辑后的图片")
-                        with open(new_image_path, "rb") as f:
-                            await bot.send_image_message(chat_id, f.read())
+                        await self._send_text_and_image(bot, chat_id, message_text, edited_images[0])
                         # 添加延迟，确保图片发送完成
                         await asyncio.sleep(1.5)
 
-                        # 更新会话历史
-                        # 添加包含图片的用户消息
-                        user_message = {
-                            "role": "user",
-                            "parts": [
-                                {"text": content},
-                                {"image_url": last_image_path}
-                            ]
-                        }
-                        conversation_history.append(user_message)
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": [
-                                {"text": first_valid_text if first_valid_text else "我已编辑了图片"},
-                                {"image_url": new_image_path}
-                            ]
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 限制会话历史长度
-                        if len(conversation_history) > 10:
-                            conversation_history = conversation_history[-10:]
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
+                        # 更新会话历史和时间戳
+                        self._record_edit_turn(conversation_key, conversation_history, content, last_image_path,
+                                               first_valid_text, new_image_path, "我已编辑了图片")
                     else:
                         # 检查是否有文本响应，可能是内容被拒绝
                         first_valid_text = next((t for t in text_responses if t), None)
@@ -1087,7 +980,7 @@ class GeminiImage(PluginBase):
                             # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
                             # 检查是否是JSON格式的错误信息
                             try:
-                                error_data = json.loads(first_valid_text)
+                                error_data = self._json_loads(first_valid_text)
                                 # 构建友好的错误消息
                                 error_message = "图片编辑请求被拒绝。"
 
@@ -1163,11 +1056,12 @@ class GeminiImage(PluginBase):
 
                             # 保存图片到本地并准备发送
                             saved_images = []
+                            # 同一批图片共用一个时间戳和随机标识，避免循环内重复生成
+                            batch_token = self._file_token()
                             for i, image_data in enumerate(image_parts):
                                 # 保存图片到本地
-                                image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}_{i}.png")
-                                with open(image_path, "wb") as f:
-                                    f.write(image_data)
+                                image_path = self._new_file_path("gemini", f"{batch_token}_{i}")
+                                image_path = self._persist_image(image_path, image_data)
                                 saved_images.append(image_path)
                                 # 保存图片路径
                                 image_paths.append(image_path)
@@ -1189,8 +1083,7 @@ class GeminiImage(PluginBase):
 
                                 # 再发送图片
                                 if i < len(saved_images):
-                                    with open(saved_images[i], "rb") as f:
-                                        await bot.send_image_message(chat_id, f.read())
+                                    await self._send_image_reply(bot, chat_id, image_parts[i])
                                     # 添加延迟，确保图片发送完成
                                     await asyncio.sleep(1.5)
 
@@ -1203,8 +1096,7 @@ class GeminiImage(PluginBase):
 
                             # 如果还有剩余的图片，发送剩余图片
                             for i in range(pairs_count, len(saved_images)):
-                                with open(saved_images[i], "rb") as f:
-                                    await bot.send_image_message(chat_id, f.read())
+                                await self._send_image_reply(bot, chat_id, image_parts[i])
                                 # 添加延迟
                                 await asyncio.sleep(1.5)
                         else:
@@ -1225,13 +1117,11 @@ class GeminiImage(PluginBase):
                                         await asyncio.sleep(0.5)
 
                                     # 保存图片到本地
-                                    image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                    with open(image_path, "wb") as f:
-                                        f.write(part["content"])
+                                    image_path = self._new_file_path("gemini")
+                                    image_path = self._persist_image(image_path, part["content"])
 
                                     # 发送图片
-                                    with open(image_path, "rb") as f:
-                                        await bot.send_image_message(chat_id, f.read())
+                                    await self._send_image_reply(bot, chat_id, part["content"])
                                     # 添加延迟，确保图片发送完成
                                     await asyncio.sleep(1.5)
 
@@ -1249,37 +1139,8 @@ class GeminiImage(PluginBase):
 
                         logger.info(f"发送生成的图片完成")
 
-                        # 更新会话历史
-                        conversation_history.append(user_message)
-
-                        # 创建助手消息部分
-                        assistant_parts = []
-
-                        # 按照原始顺序添加文本和图片
-                        image_index = 0
-                        for part in parts_list:
-                            if part["type"] == "text":
-                                assistant_parts.append({"text": part["content"]})
-                            elif part["type"] == "image" and image_index < len(image_paths):
-                                assistant_parts.append({"image_url": image_paths[image_index]})
-                                image_index += 1
-
-                        # 如果没有文本，添加默认文本
-                        if not any("text" in p for p in assistant_parts):
-                            assistant_parts.insert(0, {"text": "我已基于您的提示生成了图片"})
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": assistant_parts
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 限制会话历史长度
-                        if len(conversation_history) > 10:
-                            conversation_history = conversation_history[-10:]
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
+                        # 更新会话历史和时间戳
+                        self._record_generate_turn(conversation_key, conversation_history, user_message, parts_list, image_paths)
                     else:
                         # 检查是否有文本响应，可能是内容被拒绝
                         # 尝试从 parts_list 中提取文本响应
@@ -1289,7 +1150,7 @@ class GeminiImage(PluginBase):
                             # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
                             # 检查是否是JSON格式的错误信息
                             try:
-                                error_data = json.loads(text_parts[0])
+                                error_data = self._json_loads(text_parts[0])
                                 # 构建友好的错误消息
                                 error_message = "图片生成请求被拒绝。"
 
@@ -1332,13 +1193,8 @@ class GeminiImage(PluginBase):
             # 更新text变量，用于后续处理（如果需要）
             text = processed_content
 
-        # 处理融图命令 - 使用正则表达式来检查命令
-        # 创建一个正则表达式模式，匹配任何以融图命令开头的文本
-        import re
-        merge_cmd_pattern = '|'.join(re.escape(cmd) for cmd in self.merge_commands)
-        merge_cmd_regex = re.compile(f'^({merge_cmd_pattern})(\\s|$)')
-
-        match = merge_cmd_regex.match(text)
+        # 处理融图命令 - 使用预编译的正则表达式来检查命令
+        match = self._merge_cmd_regex.match(text)
 
         # 如果匹配成功，处理融图命令
         if match:
@@ -1360,10 +1216,12 @@ class GeminiImage(PluginBase):
                 prompt = text[len(matched_cmd):].strip()
 
                 # 初始化等待融图状态
+                # 先删除再插入，保持等待融图状态按开始时间排序
+                self.waiting_for_merge_images.pop(user_id, None)
                 self.waiting_for_merge_images[user_id] = {
                     "提示词": prompt,
                     "图片列表": [],
-                    "开始时间": time.time()
+                    "开始时间": time.monotonic()
                 }
 
                 # 发送提示消息
@@ -1375,23 +1233,19 @@ class GeminiImage(PluginBase):
                 await bot.send_text_message(chat_id, f"处理融图命令失败: {str(e)}")
                 return False  # 阻断后续插件执行
 
-        # 处理开始融合命令 - 使用正则表达式来检查命令
-        start_merge_cmd_pattern = '|'.join(re.escape(cmd) for cmd in self.start_merge_commands)
-        start_merge_cmd_regex = re.compile(f'^({start_merge_cmd_pattern})(\\s|$)')
-        start_match = start_merge_cmd_regex.match(text)
+        # 处理开始融合命令 - 使用预编译的正则表达式来检查命令
+        start_match = self._start_merge_cmd_regex.match(text)
 
         if start_match:
             logger.info("匹配成功，开始处理开始融合命令")
 
             try:
                 # 检查所有可能的用户ID，确保能够找到等待融图状态
-                possible_user_ids = [user_id, chat_id, message.get("SenderWxid", ""), message.get("FromWxid", "")]
-
-                found_user_id = None
-                for possible_id in possible_user_ids:
-                    if possible_id in self.waiting_for_merge_images:
-                        found_user_id = possible_id
-                        break
+                found_user_id = next(
+                    (possible_id for possible_id in (user_id, chat_id, sender_wxid, from_wxid)
+                     if possible_id in self.waiting_for_merge_images),
+                    None
+                )
 
                 if found_user_id:
                     user_id = found_user_id
@@ -1432,10 +1286,8 @@ class GeminiImage(PluginBase):
                 await bot.send_text_message(chat_id, f"处理开始融合命令失败: {str(e)}")
                 return False  # 阻断后续插件执行
 
-        # 处理反向提示词命令 - 使用正则表达式来检查命令
-        reverse_cmd_pattern = '|'.join(re.escape(cmd) for cmd in self.image_reverse_commands)
-        reverse_cmd_regex = re.compile(f'^({reverse_cmd_pattern})(\\s|$)')
-        reverse_match = reverse_cmd_regex.match(text)
+        # 处理反向提示词命令 - 使用预编译的正则表达式来检查命令
+        reverse_match = self._reverse_cmd_regex.match(text)
 
         if reverse_match:
             # 检查是否有足够的积分
@@ -1485,8 +1337,7 @@ class GeminiImage(PluginBase):
                                 if app_file_path:
                                     # 读取图片数据
                                     try:
-                                        with open(app_file_path, "rb") as f:
-                                            image_data = f.read()
+                                        image_data = self._read_image_file(app_file_path)
                                         logger.info(f"从系统缓存读取引用图片数据: {app_file_path}, 大小: {len(image_data)} 字节")
 
                                         # 扣除积分
@@ -1516,8 +1367,7 @@ class GeminiImage(PluginBase):
                                     logger.info(f"找到引用图片路径: {ref_img_path}")
 
                                     # 读取图片数据
-                                    with open(ref_img_path, "rb") as f:
-                                        image_data = f.read()
+                                    image_data = self._read_image_file(ref_img_path)
                                     logger.info(f"从引用图片路径读取图片数据: {ref_img_path}, 大小: {len(image_data)} 字节")
 
                                     # 扣除积分
@@ -1545,14 +1395,12 @@ class GeminiImage(PluginBase):
 
             # 设置等待状态，等待用户上传图片
             self.waiting_for_reverse_image[user_id] = True
-            self.waiting_for_reverse_image_time[user_id] = time.time()
+            self._start_wait(self.waiting_for_reverse_image_time, user_id)
             await bot.send_text_message(chat_id, "请上传要生成提示词的图片")
             return False  # 阻断后续插件执行
 
-        # 处理图片分析命令 - 使用正则表达式来检查命令
-        analysis_cmd_pattern = '|'.join(re.escape(cmd) for cmd in self.image_analysis_commands)
-        analysis_cmd_regex = re.compile(f'^({analysis_cmd_pattern})(\\s|$)')
-        analysis_match = analysis_cmd_regex.match(text)
+        # 处理图片分析命令 - 使用预编译的正则表达式来检查命令
+        analysis_match = self._analysis_cmd_regex.match(text)
 
         if analysis_match:
             # 提取用户的分析问题（如果有）
@@ -1611,8 +1459,7 @@ class GeminiImage(PluginBase):
                                 if app_file_path:
                                     # 读取图片数据
                                     try:
-                                        with open(app_file_path, "rb") as f:
-                                            image_data = f.read()
+                                        image_data = self._read_image_file(app_file_path)
                                         logger.info(f"从系统缓存读取引用图片数据: {app_file_path}, 大小: {len(image_data)} 字节")
 
                                         # 扣除积分
@@ -1642,8 +1489,7 @@ class GeminiImage(PluginBase):
                                     logger.info(f"找到引用图片路径: {ref_img_path}")
 
                                     # 读取图片数据
-                                    with open(ref_img_path, "rb") as f:
-                                        image_data = f.read()
+                                    image_data = self._read_image_file(ref_img_path)
                                     logger.info(f"从引用图片路径读取图片数据: {ref_img_path}, 大小: {len(image_data)} 字节")
 
                                     # 扣除积分
@@ -1671,7 +1517,7 @@ class GeminiImage(PluginBase):
 
             # 设置等待状态，等待用户上传图片
             self.waiting_for_analyze_image[user_id] = True
-            self.waiting_for_analyze_image_time[user_id] = time.time()
+            self._start_wait(self.waiting_for_analyze_image_time, user_id)
 
             # 发送提示消息
             if user_query:
@@ -1681,28 +1527,22 @@ class GeminiImage(PluginBase):
 
             return False  # 阻断后续插件执行
 
-        # 处理提示词生成命令 - 使用正则表达式来检查命令
-        prompt_cmd_pattern = '|'.join(re.escape(cmd) for cmd in self.prompt_enhance_commands)
-        prompt_cmd_regex = re.compile(f'^({prompt_cmd_pattern})(\\s|$)')
-        prompt_match = prompt_cmd_regex.match(text)
+        # 处理提示词生成命令 - 使用预编译的正则表达式来检查命令
+        prompt_match = self._prompt_cmd_regex.match(text)
 
         if prompt_match:
-            # 提取提示词
-            prompt = text
-            for cmd in self.prompt_enhance_commands:
-                if text.startswith(cmd):
-                    prompt = text[len(cmd):].strip()
-                    break
+            # 提取提示词，正则的第一个分组就是匹配到的命令
+            prompt = text[len(prompt_match.group(1)):].strip()
 
             if not prompt:
                 await bot.send_text_message(chat_id, "请提供要增强的提示词")
                 return False  # 阻断后续插件执行
 
             # 发送提示消息
-            await bot.send_text_message(chat_id, "正在生成详细提示词，请稍候...")
+            self._send_notice(bot.send_text_message(chat_id, "正在生成详细提示词，请稍候..."))
 
             # 生成详细提示词
-            detailed_prompt = await self._enhance_prompt_direct(prompt, detailed_output=True)
+            detailed_prompt = await self._coalesce(("direct", prompt), lambda: self._enhance_prompt_direct(prompt, detailed_output=True))
             if detailed_prompt:
                 await bot.send_text_message(chat_id, detailed_prompt)
             else:
@@ -1715,22 +1555,15 @@ class GeminiImage(PluginBase):
         from_wxid = chat_id
         sender_wxid = user_id
 
-        # 清理过期的会话
-        self._cleanup_expired_conversations()
+        # 按间隔清理过期的会话和图片缓存
+        self._maybe_cleanup()
 
         # 会话标识 - 已经在前面定义了，这里保持一致
         # conversation_key = f"{from_wxid}_{sender_wxid}"
 
         # 检查是否是结束对话命令
         if content in self.exit_commands:
-            if conversation_key in self.conversations:
-                # 清除会话数据
-                del self.conversations[conversation_key]
-                if conversation_key in self.conversation_timestamps:
-                    del self.conversation_timestamps[conversation_key]
-                if conversation_key in self.last_images:
-                    del self.last_images[conversation_key]
-
+            if self._end_conversation(conversation_key):
                 await bot.send_at_message(from_wxid, "\n已结束Gemini图像生成对话，下次需要时请使用命令重新开始", [sender_wxid])
                 return False  # 阻止后续插件执行
             else:
@@ -1738,406 +1571,324 @@ class GeminiImage(PluginBase):
                 await bot.send_at_message(from_wxid, "\n您当前没有活跃的Gemini图像生成对话", [sender_wxid])
                 return False  # 阻止后续插件执行
 
-        # 检查是否是生成图片命令
-        for cmd in self.commands:
-            if content.startswith(cmd):
-                # 提取提示词
-                prompt = content[len(cmd):].strip()
-                if not prompt:
-                    await bot.send_at_message(from_wxid, "\n请提供描述内容，格式：#生成图片 [描述]", [sender_wxid])
-                    return False  # 命令格式错误，阻止后续插件执行
-
-                # 检查API密钥是否配置
-                if not self.api_key:
-                    await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
-                    return False
-
-                # 检查积分
-                if self.enable_points and sender_wxid not in self.admins:
-                    points = self.db.get_points(sender_wxid)
-                    if points < self.generate_cost:
-                        await bot.send_at_message(from_wxid, f"\n您的积分不足，生成图片需要{self.generate_cost}积分，您当前有{points}积分", [sender_wxid])
-                        return False  # 积分不足，阻止后续插件执行
-
-                # 生成图片
-                try:
-                    # 发送处理中消息
-                    await bot.send_at_message(from_wxid, "\n正在生成图片，请稍候...", [sender_wxid])
+        # 一次性匹配生成/编辑命令前缀，再按命令类型分发
+        cmd_type, cmd = self._match_command(content)
 
-                    # 获取上下文历史
-                    conversation_history = self.conversations[conversation_key]
+        # 检查是否是生成图片命令
+        if cmd_type == "generate":
+            # 提取提示词
+            prompt = content[len(cmd):].strip()
+            if not prompt:
+                await bot.send_at_message(from_wxid, "\n请提供描述内容，格式：#生成图片 [描述]", [sender_wxid])
+                return False  # 命令格式错误，阻止后续插件执行
 
-                    # 添加用户提示到会话
-                    user_message = {"role": "user", "parts": [{"text": prompt}]}
+            # 检查API密钥是否配置
+            if not self.api_key:
+                await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
+                return False
 
-                    # 调用Gemini API生成图片
-                    parts_list, image_count = await self._generate_image(prompt, conversation_history, is_continuous_dialogue=False)
+            # 检查积分
+            if self.enable_points and sender_wxid not in self.admins:
+                points = self.db.get_points(sender_wxid)
+                if points < self.generate_cost:
+                    await bot.send_at_message(from_wxid, f"\n您的积分不足，生成图片需要{self.generate_cost}积分，您当前有{points}积分", [sender_wxid])
+                    return False  # 积分不足，阻止后续插件执行
 
-                    if image_count > 0:
-                        # 扣除积分
-                        if self.enable_points and sender_wxid not in self.admins:
-                            self.db.add_points(sender_wxid, -self.generate_cost)
-                            points_msg = f"已扣除{self.generate_cost}积分，当前剩余{points - self.generate_cost}积分"
-                            # 先发送积分信息（如果启用了积分消息显示）
-                            if self.show_points_message:
-                                await bot.send_text_message(from_wxid, points_msg)
-                                # 添加短暂延迟
-                                await asyncio.sleep(0.5)
+            # 生成图片
+            try:
+                # 发送处理中消息
+                self._send_notice(bot.send_at_message(from_wxid, "\n正在生成图片，请稍候...", [sender_wxid]))
 
-                        # 保存图片路径列表，用于更新会话历史
-                        image_paths = []
-                        last_image_path = None
+                # 获取上下文历史，只读取不创建，生成成功后才写入会话
+                conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
 
-                        # 判断是否是多图文请求
-                        is_multi_image = self._is_multi_image_request(prompt)
+                # 添加用户提示到会话
+                user_message = {"role": "user", "parts": [{"text": prompt}]}
 
-                        if is_multi_image:
-                            # 多图文请求的处理方式
-                            logger.info("多图文请求，按照原版程序的方式处理")
+                # 调用Gemini API生成图片
+                parts_list, image_count = await self._generate_image(prompt, conversation_history, is_continuous_dialogue=False)
 
-                            # 提取所有文本部分（故事内容）
-                            story_contents = [part["content"] for part in parts_list if part["type"] == "text"]
+                if image_count > 0:
+                    # 扣除积分
+                    if self.enable_points and sender_wxid not in self.admins:
+                        self.db.add_points(sender_wxid, -self.generate_cost)
+                        points_msg = f"已扣除{self.generate_cost}积分，当前剩余{points - self.generate_cost}积分"
+                        # 先发送积分信息（如果启用了积分消息显示）
+                        if self.show_points_message:
+                            await bot.send_text_message(from_wxid, points_msg)
+                            # 添加短暂延迟
+                            await asyncio.sleep(0.5)
 
-                            # 提取所有图片部分
-                            image_parts = [part["content"] for part in parts_list if part["type"] == "image"]
+                    # 保存图片路径列表，用于更新会话历史
+                    image_paths = []
+                    last_image_path = None
+
+                    # 判断是否是多图文请求
+                    is_multi_image = self._is_multi_image_request(prompt)
+
+                    if is_multi_image:
+                        # 多图文请求的处理方式
+                        logger.info("多图文请求，按照原版程序的方式处理")
+
+                        # 提取所有文本部分（故事内容）
+                        story_contents = [part["content"] for part in parts_list if part["type"] == "text"]
+
+                        # 提取所有图片部分
+                        image_parts = [part["content"] for part in parts_list if part["type"] == "image"]
+
+                        # 确保我们有故事内容
+                        if not story_contents:
+                            logger.warning("没有找到故事内容，使用默认文本")
+                            story_contents = ["这是一个精彩的故事场景"]
+
+                        # 保存图片到本地并准备发送
+                        saved_images = []
+                        # 同一批图片共用一个时间戳和随机标识，避免循环内重复生成
+                        batch_token = self._file_token()
+                        for i, image_data in enumerate(image_parts):
+                            # 保存图片到本地
+                            image_path = self._new_file_path("gemini", f"{batch_token}_{i}")
+                            image_path = self._persist_image(image_path, image_data)
+                            saved_images.append(image_path)
+                            # 保存图片路径
+                            image_paths.append(image_path)
+                            last_image_path = image_path
 
-                            # 确保我们有故事内容
-                            if not story_contents:
-                                logger.warning("没有找到故事内容，使用默认文本")
-                                story_contents = ["这是一个精彩的故事场景"]
+                        # 如果没有图片或图片数量少于故事内容，可能需要为每个故事内容单独生成图片
+                        if len(saved_images) < len(story_contents):
+                            logger.info(f"图片数量({len(saved_images)})少于故事内容({len(story_contents)})，尝试为每个故事内容单独生成图片")
+
+                            # 提取中文提示词
+                            chinese_prompts = self._extract_chinese_prompt(prompt)
+                            if not chinese_prompts:
+                                logger.warning("没有找到中文提示词，使用故事内容作为提示词")
+                                chinese_prompts = story_contents
+
+                            # 确保中文提示词和故事内容数量一致
+                            while len(chinese_prompts) < len(story_contents):
+                                chinese_prompts.append(story_contents[len(chinese_prompts)])
+
+                            # 为每个缺少图片的故事内容单独生成图片，各场景请求互不依赖，并发发送
+                            missing_indexes = [i for i in range(len(saved_images), len(story_contents)) if i < len(chinese_prompts)]
+                            for i in missing_indexes:
+                                logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
+
+                            single_images = await asyncio.gather(*(
+                                self._request_single_image({
+                                    "contents": [{"parts": [{"text": chinese_prompts[i]}]}],
+                                    "generation_config": {
+                                        "response_modalities": ["Image"],
+                                        "temperature": 0.4,
+                                        "topP": 0.95,
+                                        "topK": 64
+                                    }
+                                })
+                                for i in missing_indexes
+                            ))
 
-                            # 保存图片到本地并准备发送
-                            saved_images = []
-                            for i, image_data in enumerate(image_parts):
+                            for i, single_image_data in zip(missing_indexes, single_images):
+                                if not single_image_data:
+                                    continue
                                 # 保存图片到本地
-                                image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}_{i}.png")
-                                with open(image_path, "wb") as f:
-                                    f.write(image_data)
+                                image_path = self._new_file_path("gemini", f"{self._file_token()}_{i}")
+                                image_path = self._persist_image(image_path, single_image_data)
                                 saved_images.append(image_path)
-                                # 保存图片路径
                                 image_paths.append(image_path)
+                                image_parts.append(single_image_data)
                                 last_image_path = image_path
+                                logger.info(f"为第 {i+1} 个故事内容单独生成图片成功，大小: {len(single_image_data)} 字节")
 
-                            # 如果没有图片或图片数量少于故事内容，可能需要为每个故事内容单独生成图片
-                            if len(saved_images) < len(story_contents):
-                                logger.info(f"图片数量({len(saved_images)})少于故事内容({len(story_contents)})，尝试为每个故事内容单独生成图片")
+                        # 按照一一对应的方式发送图片和文本
+                        logger.info(f"准备发送 {len(saved_images)} 张图片和 {len(story_contents)} 段文本")
 
-                                # 提取中文提示词
-                                chinese_prompts = self._extract_chinese_prompt(prompt)
-                                if not chinese_prompts:
-                                    logger.warning("没有找到中文提示词，使用故事内容作为提示词")
-                                    chinese_prompts = story_contents
+                        # 确定要发送的对数
+                        pairs_count = min(len(saved_images), len(story_contents))
 
-                                # 确保中文提示词和故事内容数量一致
-                                while len(chinese_prompts) < len(story_contents):
-                                    chinese_prompts.append(story_contents[len(chinese_prompts)])
+                        # 一一对应发送图片和文本，确保每次发送完成后再发送下一条
+                        for i in range(pairs_count):
+                            # 先发送文本
+                            if i < len(story_contents) and story_contents[i].strip():
+                                await bot.send_text_message(from_wxid, story_contents[i])
+                                # 添加短暂延迟，确保文本发送完成
+                                await asyncio.sleep(0.5)
 
-                                # 为每个缺少图片的故事内容单独生成图片
-                                for i in range(len(saved_images), len(story_contents)):
-                                    if i < len(chinese_prompts):
-                                        logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
-
-                                        # 单独调用API生成图片
-                                        try:
-                                            # 构建请求URL
-                                            single_url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-                                            single_headers = {
-                                                "Content-Type": "application/json",
-                                            }
-                                            single_params = {
-                                                "key": self.api_key
-                                            }
-
-                                            # 构建请求数据
-                                            single_data = {
-                                                "contents": [
-                                                    {
-                                                        "parts": [
-                                                            {
-                                                                "text": chinese_prompts[i]
-                                                            }
-                                                        ]
-                                                    }
-                                                ],
-                                                "generation_config": {
-                                                    "response_modalities": ["Image"],
-                                                    "temperature": 0.4,
-                                                    "topP": 0.95,
-                                                    "topK": 64
-                                                }
-                                            }
-
-                                            # 创建代理配置
-                                            single_proxy = None
-                                            if self.enable_proxy and self.proxy_url:
-                                                single_proxy = self.proxy_url
-
-                                            # 发送请求
-                                            async with aiohttp.ClientSession() as single_session:
-                                                async with single_session.post(
-                                                    single_url,
-                                                    headers=single_headers,
-                                                    params=single_params,
-                                                    json=single_data,
-                                                    proxy=single_proxy,
-                                                    timeout=aiohttp.ClientTimeout(total=60)
-                                                ) as single_response:
-                                                    single_response_text = await single_response.text()
-
-                                                    if single_response.status == 200:
-                                                        single_result = json.loads(single_response_text)
-                                                        single_candidates = single_result.get("candidates", [])
-
-                                                        if single_candidates and len(single_candidates) > 0:
-                                                            single_content = single_candidates[0].get("content", {})
-                                                            single_parts = single_content.get("parts", [])
-
-                                                            for single_part in single_parts:
-                                                                if "inlineData" in single_part:
-                                                                    single_inline_data = single_part.get("inlineData", {})
-                                                                    if single_inline_data and "data" in single_inline_data:
-                                                                        # 解码图片数据
-                                                                        single_image_data = base64.b64decode(single_inline_data["data"])
-                                                                        logger.info(f"单独生成图片成功，大小: {len(single_image_data)} 字节")
-
-                                                                        # 保存图片到本地
-                                                                        image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}_{i}.png")
-                                                                        with open(image_path, "wb") as f:
-                                                                            f.write(single_image_data)
-                                                                        saved_images.append(image_path)
-                                                                        image_paths.append(image_path)
-                                                                        last_image_path = image_path
-                                                                        logger.info(f"为第 {i+1} 个故事内容单独生成图片成功")
-                                                                        break
-                                        except Exception as e:
-                                            logger.error(f"单独生成图片失败: {str(e)}")
-                                            logger.error(traceback.format_exc())
+                            # 再发送图片
+                            if i < len(saved_images):
+                                await self._send_image_reply(bot, from_wxid, image_parts[i])
+                                # 添加延迟，确保图片发送完成
+                                await asyncio.sleep(1.5)
 
-                            # 按照一一对应的方式发送图片和文本
-                            logger.info(f"准备发送 {len(saved_images)} 张图片和 {len(story_contents)} 段文本")
+                        # 如果还有剩余的文本，发送剩余文本
+                        for i in range(pairs_count, len(story_contents)):
+                            if story_contents[i].strip():
+                                await bot.send_text_message(from_wxid, story_contents[i])
+                                # 添加短暂延迟
+                                await asyncio.sleep(0.5)
 
-                            # 确定要发送的对数
-                            pairs_count = min(len(saved_images), len(story_contents))
+                        # 如果还有剩余的图片，发送剩余图片
+                        for i in range(pairs_count, len(saved_images)):
+                            await self._send_image_reply(bot, from_wxid, image_parts[i])
+                            # 添加延迟
+                            await asyncio.sleep(1.5)
+                    else:
+                        # 常规请求的处理方式
+                        # 按照原始顺序发送文本和图片
+                        current_text = ""
 
-                            # 一一对应发送图片和文本，确保每次发送完成后再发送下一条
-                            for i in range(pairs_count):
-                                # 先发送文本
-                                if i < len(story_contents) and story_contents[i].strip():
-                                    await bot.send_text_message(from_wxid, story_contents[i])
+                        for part in parts_list:
+                            if part["type"] == "text":
+                                # 累积文本，直到遇到图片才发送
+                                current_text += part["content"]
+                            elif part["type"] == "image":
+                                # 如果有累积的文本，先发送文本
+                                if current_text.strip():
+                                    await bot.send_text_message(from_wxid, current_text)
+                                    current_text = ""
                                     # 添加短暂延迟，确保文本发送完成
                                     await asyncio.sleep(0.5)
 
-                                # 再发送图片
-                                if i < len(saved_images):
-                                    with open(saved_images[i], "rb") as f:
-                                        await bot.send_image_message(from_wxid, f.read())
-                                    # 添加延迟，确保图片发送完成
-                                    await asyncio.sleep(1.5)
-
-                            # 如果还有剩余的文本，发送剩余文本
-                            for i in range(pairs_count, len(story_contents)):
-                                if story_contents[i].strip():
-                                    await bot.send_text_message(from_wxid, story_contents[i])
-                                    # 添加短暂延迟
-                                    await asyncio.sleep(0.5)
+                                # 保存图片到本地
+                                image_path = self._new_file_path("gemini")
+                                image_path = self._persist_image(image_path, part["content"])
 
-                            # 如果还有剩余的图片，发送剩余图片
-                            for i in range(pairs_count, len(saved_images)):
-                                with open(saved_images[i], "rb") as f:
-                                    await bot.send_image_message(from_wxid, f.read())
-                                # 添加延迟
+                                # 发送图片
+                                await self._send_image_reply(bot, from_wxid, part["content"])
+                                # 添加延迟，确保图片发送完成
                                 await asyncio.sleep(1.5)
-                        else:
-                            # 常规请求的处理方式
-                            # 按照原始顺序发送文本和图片
-                            current_text = ""
 
-                            for part in parts_list:
-                                if part["type"] == "text":
-                                    # 累积文本，直到遇到图片才发送
-                                    current_text += part["content"]
-                                elif part["type"] == "image":
-                                    # 如果有累积的文本，先发送文本
-                                    if current_text.strip():
-                                        await bot.send_text_message(from_wxid, current_text)
-                                        current_text = ""
-                                        # 添加短暂延迟，确保文本发送完成
-                                        await asyncio.sleep(0.5)
+                                # 保存图片路径
+                                image_paths.append(image_path)
+                                last_image_path = image_path
 
-                                    # 保存图片到本地
-                                    image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                    with open(image_path, "wb") as f:
-                                        f.write(part["content"])
+                        # 发送剩余的文本（如果有）
+                        if current_text.strip():
+                            await bot.send_text_message(from_wxid, current_text)
+                            # 添加短暂延迟
+                            await asyncio.sleep(0.5)
 
-                                    # 发送图片
-                                    with open(image_path, "rb") as f:
-                                        await bot.send_image_message(from_wxid, f.read())
-                                    # 添加延迟，确保图片发送完成
-                                    await asyncio.sleep(1.5)
+                    # 保存最后生成的图片路径（用于后续编辑）
+                    if last_image_path:
+                        self.last_images[conversation_key] = last_image_path
 
-                                    # 保存图片路径
-                                    image_paths.append(image_path)
-                                    last_image_path = image_path
+                    # 不再发送对话提示
+                    # if not conversation_history:  # 如果是新会话
+                    #     await bot.send_text_message(from_wxid, f"已开始图像对话，可以直接发消息继续修改图片。需要结束时请发送\"{self.exit_commands[0]}\"")
 
-                            # 发送剩余的文本（如果有）
-                            if current_text.strip():
-                                await bot.send_text_message(from_wxid, current_text)
-                                # 添加短暂延迟
-                                await asyncio.sleep(0.5)
+                    # 更新会话历史和时间戳
+                    self._record_generate_turn(conversation_key, conversation_history, user_message, parts_list, image_paths)
+                else:
+                    # 检查是否有文本响应，可能是内容被拒绝
+                    # 尝试从 parts_list 中提取文本响应
+                    text_parts = [part["content"] for part in parts_list if part["type"] == "text"]
 
-                        # 保存最后生成的图片路径（用于后续编辑）
-                        if last_image_path:
-                            self.last_images[conversation_key] = last_image_path
+                    if text_parts:
+                        # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
+                        translated_response = self._translate_gemini_message(text_parts[0])
+                        await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
+                        logger.warning(f"API拒绝生成图片，提示: {text_parts[0]}")
+                    else:
+                        logger.error(f"生成图片失败，未获取到有效的图片数据")
+                        await bot.send_at_message(from_wxid, "\n图片生成失败，请稍后再试或修改提示词", [sender_wxid])
+            except Exception as e:
+                logger.error(f"生成图片失败: {str(e)}")
+                logger.error(traceback.format_exc())
+                await bot.send_at_message(from_wxid, f"\n生成图片失败: {str(e)}", [sender_wxid])
+            return False  # 已处理命令，阻止后续插件执行
 
-                        # 不再发送对话提示
-                        # if not conversation_history:  # 如果是新会话
-                        #     await bot.send_text_message(from_wxid, f"已开始图像对话，可以直接发消息继续修改图片。需要结束时请发送\"{self.exit_commands[0]}\"")
+        # 检查是否是编辑图片命令（针对已保存的图片）
+        if cmd_type == "edit":
+            # 按间隔清理过期缓存（读取缓存时会校验过期时间）
+            self._maybe_cleanup()
+            logger.info("编辑图片命令：优先使用系统缓存的图片")
 
-                        # 更新会话历史
-                        conversation_history.append(user_message)
+            # 提取提示词
+            prompt = content[len(cmd):].strip()
+            if not prompt:
+                await bot.send_at_message(from_wxid, "\n请提供编辑描述，格式：#编辑图片 [描述]", [sender_wxid])
+                return False  # 命令格式错误，阻止后续插件执行
 
-                        # 创建助手消息部分
-                        assistant_parts = []
+            # 检查API密钥是否配置
+            if not self.api_key:
+                await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
+                return False
 
-                        # 按照原始顺序添加文本和图片
-                        image_index = 0
-                        for part in parts_list:
-                            if part["type"] == "text":
-                                assistant_parts.append({"text": part["content"]})
-                            elif part["type"] == "image" and image_index < len(image_paths):
-                                assistant_parts.append({"image_url": image_paths[image_index]})
-                                image_index += 1
-
-                        # 如果没有文本，添加默认文本
-                        if not any("text" in p for p in assistant_parts):
-                            assistant_parts.insert(0, {"text": "我已基于您的提示生成了图片"})
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": assistant_parts
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 限制会话历史长度
-                        if len(conversation_history) > 10:  # 保留最近5轮对话
-                            conversation_history = conversation_history[-10:]
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
-                    else:
-                        # 检查是否有文本响应，可能是内容被拒绝
-                        # 尝试从 parts_list 中提取文本响应
-                        text_parts = [part["content"] for part in parts_list if part["type"] == "text"]
+            # 检查是否是引用图片的编辑命令
+            reference_id = message.get("ReferenceId", "")
+            if reference_id:
+                logger.info(f"检测到引用图片的编辑命令，引用ID: {reference_id}")
+                try:
+                    # 尝试从引用消息中获取图片
+                    reference_message = message.get("Quote", {})
 
-                        if text_parts:
-                            # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                            translated_response = self._translate_gemini_message(text_parts[0])
-                            await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
-                            logger.warning(f"API拒绝生成图片，提示: {text_parts[0]}")
-                        else:
-                            logger.error(f"生成图片失败，未获取到有效的图片数据")
-                            await bot.send_at_message(from_wxid, "\n图片生成失败，请稍后再试或修改提示词", [sender_wxid])
-                except Exception as e:
-                    logger.error(f"生成图片失败: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    await bot.send_at_message(from_wxid, f"\n生成图片失败: {str(e)}", [sender_wxid])
-                return False  # 已处理命令，阻止后续插件执行
+                    if reference_message:
+                        logger.info(f"成功获取引用消息: {reference_message}")
+                        # 记录完整的引用消息，帮助调试
+                        logger.info(f"引用消息完整内容: {reference_message}")
 
-        # 检查是否是编辑图片命令（针对已保存的图片）
-        for cmd in self.edit_commands:
-            if content.startswith(cmd):
-                # 清理过期缓存
-                self._cleanup_image_cache()
-                logger.info("编辑图片命令：清理过期缓存，优先使用系统缓存的图片")
+                        # 如果引用的是图片消息，处理引用的图片
+                        if reference_message.get("MsgType") == 3:  # 图片消息类型
+                            logger.info(f"引用的是图片消息，将处理引用的图片")
 
-                # 提取提示词
-                prompt = content[len(cmd):].strip()
-                if not prompt:
-                    await bot.send_at_message(from_wxid, "\n请提供编辑描述，格式：#编辑图片 [描述]", [sender_wxid])
-                    return False  # 命令格式错误，阻止后续插件执行
+                            # 尝试从引用消息中获取MD5
+                            ref_md5 = reference_message.get("md5", reference_message.get("FileMd5", ""))
+                            if not ref_md5 and "Content" in reference_message:
+                                # 尝试从Content中提取MD5
+                                content = reference_message.get("Content", "")
+                                md5_match = re.search(r'md5="([^"]+)"', content)
+                                if md5_match:
+                                    ref_md5 = md5_match.group(1)
+                                    logger.info(f"从Content中提取到MD5: {ref_md5}")
 
-                # 检查API密钥是否配置
-                if not self.api_key:
-                    await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
-                    return False
+                            if ref_md5:
+                                # 尝试在/app/files/目录下查找图片（检查多种格式）
+                                app_file_path = None
+                                for ext in ['.jpeg', '.png', '.jpg']:
+                                    temp_path = f"/app/files/{ref_md5}{ext}"
+                                    if os.path.exists(temp_path):
+                                        app_file_path = temp_path
+                                        logger.info(f"找到引用图片的系统缓存: {app_file_path}")
+                                        break
 
-                # 检查是否是引用图片的编辑命令
-                reference_id = message.get("ReferenceId", "")
-                if reference_id:
-                    logger.info(f"检测到引用图片的编辑命令，引用ID: {reference_id}")
-                    try:
-                        # 尝试从引用消息中获取图片
-                        reference_message = message.get("Quote", {})
-
-                        if reference_message:
-                            logger.info(f"成功获取引用消息: {reference_message}")
-                            # 记录完整的引用消息，帮助调试
-                            logger.info(f"引用消息完整内容: {reference_message}")
-
-                            # 如果引用的是图片消息，处理引用的图片
-                            if reference_message.get("MsgType") == 3:  # 图片消息类型
-                                logger.info(f"引用的是图片消息，将处理引用的图片")
-
-                                # 尝试从引用消息中获取MD5
-                                ref_md5 = reference_message.get("md5", reference_message.get("FileMd5", ""))
-                                if not ref_md5 and "Content" in reference_message:
-                                    # 尝试从Content中提取MD5
-                                    content = reference_message.get("Content", "")
-                                    md5_match = re.search(r'md5="([^"]+)"', content)
-                                    if md5_match:
-                                        ref_md5 = md5_match.group(1)
-                                        logger.info(f"从Content中提取到MD5: {ref_md5}")
-
-                                if ref_md5:
-                                    # 尝试在/app/files/目录下查找图片（检查多种格式）
-                                    app_file_path = None
-                                    for ext in ['.jpeg', '.png', '.jpg']:
-                                        temp_path = f"/app/files/{ref_md5}{ext}"
-                                        if os.path.exists(temp_path):
-                                            app_file_path = temp_path
-                                            logger.info(f"找到引用图片的系统缓存: {app_file_path}")
-                                            break
-
-                                    if app_file_path:
-                                        # 直接使用系统缓存的图片路径
-                                        self.last_images[conversation_key] = app_file_path
-                                        logger.info(f"成功保存引用图片的系统缓存路径: {app_file_path}")
-                                        # 不使用continue，让代码继续执行后续的编辑命令处理
-
-                                # 尝试获取引用图片的路径
-                                ref_img_path = reference_message.get("FilePath")
-                                if ref_img_path and os.path.exists(ref_img_path):
-                                    try:
-                                        logger.info(f"找到引用图片路径: {ref_img_path}")
+                                if app_file_path:
+                                    # 直接使用系统缓存的图片路径
+                                    self.last_images[conversation_key] = app_file_path
+                                    logger.info(f"成功保存引用图片的系统缓存路径: {app_file_path}")
+                                    # 不使用continue，让代码继续执行后续的编辑命令处理
 
-                                        # 直接使用引用图片的路径
-                                        self.last_images[conversation_key] = ref_img_path
-                                        logger.info(f"成功保存引用图片路径: {ref_img_path}")
-                                        # 不使用continue，让代码继续执行后续的编辑命令处理
-                                    except Exception as e:
-                                        logger.error(f"处理引用图片路径失败: {e}")
-                                        logger.error(traceback.format_exc())
-                    except Exception as e:
-                        logger.error(f"处理引用图片失败: {e}")
-                        logger.error(traceback.format_exc())
+                            # 尝试获取引用图片的路径
+                            ref_img_path = reference_message.get("FilePath")
+                            if ref_img_path and os.path.exists(ref_img_path):
+                                try:
+                                    logger.info(f"找到引用图片路径: {ref_img_path}")
 
-                # 检查积分
-                if self.enable_points and sender_wxid not in self.admins:
-                    points = self.db.get_points(sender_wxid)
-                    if points < self.edit_cost:
-                        await bot.send_at_message(from_wxid, f"\n您的积分不足，编辑图片需要{self.edit_cost}积分，您当前有{points}积分", [sender_wxid])
-                        return False  # 积分不足，阻止后续插件执行
+                                    # 直接使用引用图片的路径
+                                    self.last_images[conversation_key] = ref_img_path
+                                    logger.info(f"成功保存引用图片路径: {ref_img_path}")
+                                    # 不使用continue，让代码继续执行后续的编辑命令处理
+                                except Exception as e:
+                                    logger.error(f"处理引用图片路径失败: {e}")
+                                    logger.error(traceback.format_exc())
+                except Exception as e:
+                    logger.error(f"处理引用图片失败: {e}")
+                    logger.error(traceback.format_exc())
+
+            # 检查积分
+            if self.enable_points and sender_wxid not in self.admins:
+                points = self.db.get_points(sender_wxid)
+                if points < self.edit_cost:
+                    await bot.send_at_message(from_wxid, f"\n您的积分不足，编辑图片需要{self.edit_cost}积分，您当前有{points}积分", [sender_wxid])
+                    return False  # 积分不足，阻止后续插件执行
 
-                # 设置等待状态，等待用户上传图片
-                self.waiting_for_edit_image[sender_wxid] = True
-                self.waiting_for_edit_image_time[sender_wxid] = time.time()
-                self.waiting_for_edit_image_prompt[sender_wxid] = prompt
+            # 设置等待状态，等待用户上传图片
+            self.waiting_for_edit_image[sender_wxid] = True
+            self._start_wait(self.waiting_for_edit_image_time, sender_wxid)
+            self.waiting_for_edit_image_prompt[sender_wxid] = prompt
 
-                # 发送提示消息
-                await bot.send_at_message(from_wxid, "\n请上传要编辑的图片", [sender_wxid])
-                logger.info(f"用户 {sender_wxid} 开始等待上传图片进行编辑，提示词: {prompt}")
+            # 发送提示消息
+            await bot.send_at_message(from_wxid, "\n请上传要编辑的图片", [sender_wxid])
+            logger.info(f"用户 {sender_wxid} 开始等待上传图片进行编辑，提示词: {prompt}")
 
-                return False  # 已处理命令，阻止后续插件执行
+            return False  # 已处理命令，阻止后续插件执行
 
         # 这部分代码已经在前面处理过了，不需要重复处理
         # 如果前面没有检测到前缀，这里也不会检测到
@@ -2145,14 +1896,14 @@ class GeminiImage(PluginBase):
         # 因此，这段代码可以删除
 
         # 如果没有检测到前缀，但有活跃会话，检查是否需要前缀
-        if conversation_key in self.conversations and content and not any(content.startswith(cmd) for cmd in self.commands + self.edit_commands):
+        if conversation_key in self.conversations and content and cmd_type is None:
             # 如果需要前缀但没有找到前缀，则不处理这条消息
             if self.require_prefix_for_conversation:
                 logger.info(f"消息 '{content}' 没有包含所需前缀，不处理为连续对话")
                 return True
 
             # 在群聊中，检查是否包含唤醒词或@机器人
-            if message.get("IsGroup", False):
+            if is_group:
                 # 在群聊中必须包含唤醒词或@机器人才能继续对话
                 if not self.has_wake_word(content) and not self.is_at_message(message):
                     # 没有唤醒词，不处理
@@ -2182,10 +1933,10 @@ class GeminiImage(PluginBase):
                         return False  # 积分不足，阻止后续插件执行
 
                 # 发送处理中消息
-                await bot.send_at_message(from_wxid, "\n正在处理您的请求，请稍候...", [sender_wxid])
+                self._send_notice(bot.send_at_message(from_wxid, "\n正在处理您的请求，请稍候...", [sender_wxid]))
 
                 # 获取上下文历史
-                conversation_history = self.conversations[conversation_key]
+                conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
                 logger.info(f"对话历史长度: {len(conversation_history)}")
 
                 # 添加用户提示到会话
@@ -2196,12 +1947,12 @@ class GeminiImage(PluginBase):
                 logger.info(f"上一次图片路径: {last_image_path}")
 
                 # 如果没有找到图片路径，尝试从缓存获取
-                if not last_image_path or not os.path.exists(last_image_path):
+                if not last_image_path or not self._image_available(last_image_path):
                     logger.info("未找到上一次图片路径，尝试从缓存获取")
 
                     # 检查是否有系统缓存的图片路径
                     for key, value in self.last_images.items():
-                        if (from_wxid in key or sender_wxid in key) and os.path.exists(value):
+                        if (from_wxid in key or sender_wxid in key) and self._image_available(value):
                             if "/app/files/" in value:
                                 # 直接使用系统缓存的图片路径
                                 last_image_path = value
@@ -2210,7 +1961,7 @@ class GeminiImage(PluginBase):
                                 break
 
                     # 如果没有找到系统缓存的图片路径，尝试从缓存获取图片
-                    if not last_image_path or not os.path.exists(last_image_path):
+                    if not last_image_path or not self._image_available(last_image_path):
                         path, data = await self._get_recent_image(from_wxid, sender_wxid)
                         if path:
                             # 如果找到图片路径，直接使用
@@ -2219,9 +1970,8 @@ class GeminiImage(PluginBase):
                             logger.info(f"直接使用缓存的图片路径: {last_image_path}")
                         elif data:
                             # 如果找到图片数据，保存到本地再处理
-                            image_path = os.path.join(self.save_dir, f"temp_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                            with open(image_path, "wb") as f:
-                                f.write(data)
+                            image_path = self._new_file_path("temp")
+                            self._atomic_write(image_path, data)
                             self.last_images[conversation_key] = image_path
                             last_image_path = image_path
                             logger.info(f"从缓存找到图片数据，保存到：{image_path}")
@@ -2230,16 +1980,15 @@ class GeminiImage(PluginBase):
                         logger.info("未找到缓存图片，尝试使用更宽松的条件查找图片路径")
                         for key, value in self.last_images.items():
                             # 只有当会话活跃时才使用宽松条件查找图片
-                            if key in self.conversations and (from_wxid in key or sender_wxid in key) and os.path.exists(value):
+                            if key in self.conversations and (from_wxid in key or sender_wxid in key) and self._image_available(value):
                                 last_image_path = value
                                 logger.info(f"使用宽松条件找到图片路径: {last_image_path}, 键: {key}")
                                 break
 
-                if last_image_path and os.path.exists(last_image_path):
+                if last_image_path and self._image_available(last_image_path):
                     logger.info(f"找到上一次图片，将使用该图片进行编辑")
-                    # 读取上一次生成的图片
-                    with open(last_image_path, "rb") as f:
-                        image_data = f.read()
+                    # 读取上一次生成的图片（刚生成的图片直接使用内存中的数据）
+                    image_data = self._read_image_file(last_image_path)
 
                     # 调用编辑图片API
                     logger.info(f"调用编辑图片API")
@@ -2257,9 +2006,8 @@ class GeminiImage(PluginBase):
                     if len(edited_images) > 0 and edited_images[0]:
                         logger.info(f"成功获取编辑后的图片结果")
                         # 保存编辑后的图片
-                        new_image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                        with open(new_image_path, "wb") as f:
-                            f.write(edited_images[0])
+                        new_image_path = self._new_file_path("gemini")
+                        new_image_path = self._persist_image(new_image_path, edited_images[0])
 
                         # 更新最后生成的图片路径
                         self.last_images[conversation_key] = new_image_path
@@ -2273,59 +2021,17 @@ class GeminiImage(PluginBase):
 
                         # 发送文本回复（如果有）
                         first_valid_text = next((t for t in text_responses if t), None)
-                        if first_valid_text:
-                            # 清理文本，去除多余的空格和换行
-                            cleaned_text = first_valid_text.strip()
-                            # 将多个连续空格替换为单个空格
-                            import re
-                            cleaned_text = re.sub(r'\s+', ' ', cleaned_text)
-                            # 移除文本开头和结尾的引号
-                            if cleaned_text.startswith('"') and cleaned_text.endswith('"'):
-                                cleaned_text = cleaned_text[1:-1]
-                            # 构建消息文本，避免在没有积分消息时添加多余的换行
-                            if points_msg:
-                                message_text = f"{cleaned_text}\n\n{points_msg}"
-                            else:
-                                message_text = cleaned_text
-                            await bot.send_text_message(from_wxid, message_text)
-                        else:
-                            await bot.send_text_message(from_wxid, f"图片编辑成功！{points_msg if points_msg else ''}")
-                        # 添加短暂延迟，确保文本发送完成
-                        await asyncio.sleep(0.5)
+                        message_text = self._format_edit_reply(first_valid_text, points_msg)
 
-                        # 发送图片
+                        # 发送文本（如果有）和图片
                         logger.info(f"发送编辑后的图片")
-                        with open(new_image_path, "rb") as f:
-                            await bot.send_image_message(from_wxid, f.read())
+                        await self._send_text_and_image(bot, from_wxid, message_text, edited_images[0])
                         # 添加延迟，确保图片发送完成
                         await asyncio.sleep(1.5)
 
-                        # 更新会话历史
-                        # 添加包含图片的用户消息
-                        user_message = {
-                            "role": "user",
-                            "parts": [
-                                {"text": content},
-                                {"image_url": last_image_path}
-                            ]
-                        }
-                        conversation_history.append(user_message)
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": [
-                                {"text": first_valid_text if first_valid_text else "我已编辑了图片"},
-                                {"image_url": new_image_path}
-                            ]
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 限制会话历史长度
-                        if len(conversation_history) > 10:
-                            conversation_history = conversation_history[-10:]
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
+                        # 更新会话历史和时间戳
+                        self._record_edit_turn(conversation_key, conversation_history, content, last_image_path,
+                                               first_valid_text, new_image_path, "我已编辑了图片")
 
                         return False  # 已处理命令，阻止后续插件执行
                     else:
@@ -2335,7 +2041,7 @@ class GeminiImage(PluginBase):
                             # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
                             # 检查是否是JSON格式的错误信息
                             try:
-                                error_data = json.loads(first_valid_text)
+                                error_data = self._json_loads(first_valid_text)
                                 # 构建友好的错误消息
                                 error_message = "图片编辑请求被拒绝。"
 
@@ -2408,11 +2114,12 @@ class GeminiImage(PluginBase):
 
                             # 保存图片到本地并准备发送
                             saved_images = []
+                            # 同一批图片共用一个时间戳和随机标识，避免循环内重复生成
+                            batch_token = self._file_token()
                             for i, image_data in enumerate(image_parts):
                                 # 保存图片到本地
-                                image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}_{i}.png")
-                                with open(image_path, "wb") as f:
-                                    f.write(image_data)
+                                image_path = self._new_file_path("gemini", f"{batch_token}_{i}")
+                                image_path = self._persist_image(image_path, image_data)
                                 saved_images.append(image_path)
                                 # 保存图片路径
                                 image_paths.append(image_path)
@@ -2432,91 +2139,35 @@ class GeminiImage(PluginBase):
                                 while len(chinese_prompts) < len(story_contents):
                                     chinese_prompts.append(story_contents[len(chinese_prompts)])
 
-                                # 为每个缺少图片的故事内容单独生成图片
-                                for i in range(len(saved_images), len(story_contents)):
-                                    if i < len(chinese_prompts):
-                                        logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
-
-                                        # 单独调用API生成图片
-                                        try:
-                                            # 构建请求URL
-                                            single_url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-                                            # 检查URL格式是否正确
-                                            if not single_url.startswith("http"):
-                                                logger.warning(f"URL格式可能不正确: {single_url}")
-                                                # 尝试修复URL格式
-                                                single_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-                                            single_headers = {
-                                                "Content-Type": "application/json",
-                                            }
-                                            single_params = {
-                                                "key": self.api_key
-                                            }
-
-                                            # 构建请求数据
-                                            single_data = {
-                                                "contents": [
-                                                    {
-                                                        "role": "user",
-                                                        "parts": [
-                                                            {
-                                                                "text": chinese_prompts[i]
-                                                            }
-                                                        ]
-                                                    }
-                                                ],
-                                                "generation_config": {
-                                                    "response_modalities": ["Image"],
-                                                    "temperature": 0.4,
-                                                    "topP": 0.95,
-                                                    "topK": 64
-                                                }
-                                            }
-
-                                            # 创建代理配置
-                                            single_proxy = None
-                                            if self.enable_proxy and self.proxy_url:
-                                                single_proxy = self.proxy_url
-
-                                            # 发送请求
-                                            async with aiohttp.ClientSession() as single_session:
-                                                async with single_session.post(
-                                                    single_url,
-                                                    headers=single_headers,
-                                                    params=single_params,
-                                                    json=single_data,
-                                                    proxy=single_proxy,
-                                                    timeout=aiohttp.ClientTimeout(total=60)
-                                                ) as single_response:
-                                                    single_response_text = await single_response.text()
-
-                                                    if single_response.status == 200:
-                                                        single_result = json.loads(single_response_text)
-                                                        single_candidates = single_result.get("candidates", [])
-
-                                                        if single_candidates and len(single_candidates) > 0:
-                                                            single_content = single_candidates[0].get("content", {})
-                                                            single_parts = single_content.get("parts", [])
-
-                                                            for single_part in single_parts:
-                                                                if "inlineData" in single_part:
-                                                                    single_inline_data = single_part.get("inlineData", {})
-                                                                    if single_inline_data and "data" in single_inline_data:
-                                                                        # 返回Base64解码后的图片数据
-                                                                        single_image_data = base64.b64decode(single_inline_data["data"])
-
-                                                                        # 保存图片到本地
-                                                                        image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}_{i}.png")
-                                                                        with open(image_path, "wb") as f:
-                                                                            f.write(single_image_data)
-                                                                        saved_images.append(image_path)
-                                                                        image_paths.append(image_path)
-                                                                        last_image_path = image_path
-                                                                        logger.info(f"为第 {i+1} 个故事内容单独生成图片成功")
-                                                                        break
-                                        except Exception as e:
-                                            logger.error(f"单独生成图片失败: {str(e)}")
-                                            logger.error(traceback.format_exc())
+                                # 为每个缺少图片的故事内容单独生成图片，各场景请求互不依赖，并发发送
+                                missing_indexes = [i for i in range(len(saved_images), len(story_contents)) if i < len(chinese_prompts)]
+                                for i in missing_indexes:
+                                    logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
+
+                                single_images = await asyncio.gather(*(
+                                    self._request_single_image({
+                                        "contents": [{"role": "user", "parts": [{"text": chinese_prompts[i]}]}],
+                                        "generation_config": {
+                                            "response_modalities": ["Image"],
+                                            "temperature": 0.4,
+                                            "topP": 0.95,
+                                            "topK": 64
+                                        }
+                                    })
+                                    for i in missing_indexes
+                                ))
+
+                                for i, single_image_data in zip(missing_indexes, single_images):
+                                    if not single_image_data:
+                                        continue
+                                    # 保存图片到本地
+                                    image_path = self._new_file_path("gemini", f"{self._file_token()}_{i}")
+                                    image_path = self._persist_image(image_path, single_image_data)
+                                    saved_images.append(image_path)
+                                    image_paths.append(image_path)
+                                    image_parts.append(single_image_data)
+                                    last_image_path = image_path
+                                    logger.info(f"为第 {i+1} 个故事内容单独生成图片成功，大小: {len(single_image_data)} 字节")
 
                             # 按照一一对应的方式发送图片和文本
                             logger.info(f"准备发送 {len(saved_images)} 张图片和 {len(story_contents)} 段文本")
@@ -2532,8 +2183,7 @@ class GeminiImage(PluginBase):
 
                                 # 再发送图片
                                 if i < len(saved_images):
-                                    with open(saved_images[i], "rb") as f:
-                                        await bot.send_image_message(from_wxid, f.read())
+                                    await self._send_image_reply(bot, from_wxid, image_parts[i])
 
                             # 如果还有剩余的文本，发送剩余文本
                             for i in range(pairs_count, len(story_contents)):
@@ -2542,8 +2192,7 @@ class GeminiImage(PluginBase):
 
                             # 如果还有剩余的图片，发送剩余图片
                             for i in range(pairs_count, len(saved_images)):
-                                with open(saved_images[i], "rb") as f:
-                                    await bot.send_image_message(from_wxid, f.read())
+                                await self._send_image_reply(bot, from_wxid, image_parts[i])
                         else:
                             # 常规请求的处理方式
                             # 按照原始顺序发送文本和图片
@@ -2560,13 +2209,11 @@ class GeminiImage(PluginBase):
                                         current_text = ""
 
                                     # 保存图片到本地
-                                    image_path = os.path.join(self.save_dir, f"gemini_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                    with open(image_path, "wb") as f:
-                                        f.write(part["content"])
+                                    image_path = self._new_file_path("gemini")
+                                    image_path = self._persist_image(image_path, part["content"])
 
                                     # 发送图片
-                                    with open(image_path, "rb") as f:
-                                        await bot.send_image_message(from_wxid, f.read())
+                                    await self._send_image_reply(bot, from_wxid, part["content"])
 
                                     # 保存图片路径
                                     image_paths.append(image_path)
@@ -2582,37 +2229,8 @@ class GeminiImage(PluginBase):
 
                         logger.info(f"发送生成的图片完成")
 
-                        # 更新会话历史
-                        conversation_history.append(user_message)
-
-                        # 创建助手消息部分
-                        assistant_parts = []
-
-                        # 按照原始顺序添加文本和图片
-                        image_index = 0
-                        for part in parts_list:
-                            if part["type"] == "text":
-                                assistant_parts.append({"text": part["content"]})
-                            elif part["type"] == "image" and image_index < len(image_paths):
-                                assistant_parts.append({"image_url": image_paths[image_index]})
-                                image_index += 1
-
-                        # 如果没有文本，添加默认文本
-                        if not any("text" in p for p in assistant_parts):
-                            assistant_parts.insert(0, {"text": "我已基于您的提示生成了图片"})
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": assistant_parts
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 限制会话历史长度
-                        if len(conversation_history) > 10:
-                            conversation_history = conversation_history[-10:]
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
+                        # 更新会话历史和时间戳
+                        self._record_generate_turn(conversation_key, conversation_history, user_message, parts_list, image_paths)
                     else:
                         # 检查是否有文本响应，可能是内容被拒绝
                         # 尝试从 parts_list 中提取文本响应
@@ -2646,158 +2264,125 @@ class GeminiImage(PluginBase):
         sender_wxid = message.get("SenderWxid", "")
         file_info = message.get("FileInfo", {})
 
-        # 清理过期的会话
-        self._cleanup_expired_conversations()
+        # 检查消息是否含有文件信息
+        if not file_info or "FileID" not in file_info:
+            return True  # 不是有效的文件消息，继续执行后续插件
+
+        # 文件说明不是编辑图片命令时与本插件无关，直接放行，不做后续清理和处理
+        summary = file_info.get("FileSummary", "").strip()
+        cmd_type, used_command = self._match_command(summary)
+        if cmd_type != "edit":
+            return True
+
+        # 按间隔清理过期的会话和图片缓存
+        self._maybe_cleanup()
 
         # 会话标识
         conversation_key = f"{from_wxid}_{sender_wxid}"
 
-        # 检查消息是否含有文件信息
-        if not file_info or "FileID" not in file_info:
-            return True  # 不是有效的文件消息，继续执行后续插件
+        # 提取提示词
+        prompt = summary[len(used_command):].strip()
+        if not prompt:
+            await bot.send_at_message(from_wxid, "\n请提供编辑描述，格式：#编辑图片 [描述]", [sender_wxid])
+            return False  # 命令格式错误，阻止后续插件执行
 
-        # 检查是否是图片编辑命令
-        if "FileSummary" in file_info:
-            summary = file_info.get("FileSummary", "").strip()
-
-            for cmd in self.edit_commands:
-                if summary.startswith(cmd):
-                    # 提取提示词
-                    prompt = summary[len(cmd):].strip()
-                    if not prompt:
-                        await bot.send_at_message(from_wxid, "\n请提供编辑描述，格式：#编辑图片 [描述]", [sender_wxid])
-                        return False  # 命令格式错误，阻止后续插件执行
-
-                    # 检查API密钥是否配置
-                    if not self.api_key:
-                        await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
-                        return False
-
-                    # 检查文件类型是否为图片
-                    file_name = file_info.get("FileName", "").lower()
-                    valid_extensions = [".jpg", ".jpeg", ".png", ".webp"]
-                    is_image = any(file_name.endswith(ext) for ext in valid_extensions)
-
-                    if not is_image:
-                        await bot.send_at_message(from_wxid, "\n请上传图片文件（支持JPG、PNG、WEBP格式）", [sender_wxid])
-                        return False
-
-                    # 检查积分
-                    if self.enable_points and sender_wxid not in self.admins:
-                        points = self.db.get_points(sender_wxid)
-                        if points < self.edit_cost:
-                            await bot.send_at_message(from_wxid, f"\n您的积分不足，编辑图片需要{self.edit_cost}积分，您当前有{points}积分", [sender_wxid])
-                            return False  # 积分不足，阻止后续插件执行
+        # 检查API密钥是否配置
+        if not self.api_key:
+            await bot.send_at_message(from_wxid, "\n请先在配置文件中设置Gemini API密钥", [sender_wxid])
+            return False
 
-                    # 编辑图片
-                    try:
-                        # 发送处理中消息
-                        await bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid])
+        # 检查文件类型是否为图片
+        file_name = file_info.get("FileName", "").lower()
+        valid_extensions = [".jpg", ".jpeg", ".png", ".webp"]
+        is_image = any(file_name.endswith(ext) for ext in valid_extensions)
 
-                        # 下载用户上传的图片
-                        file_id = file_info.get("FileID")
-                        file_content = await bot.download_file(file_id)
+        if not is_image:
+            await bot.send_at_message(from_wxid, "\n请上传图片文件（支持JPG、PNG、WEBP格式）", [sender_wxid])
+            return False
 
-                        # 保存原始图片
-                        orig_image_path = os.path.join(self.save_dir, f"orig_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                        with open(orig_image_path, "wb") as f:
-                            f.write(file_content)
+        # 检查积分
+        if self.enable_points and sender_wxid not in self.admins:
+            points = self.db.get_points(sender_wxid)
+            if points < self.edit_cost:
+                await bot.send_at_message(from_wxid, f"\n您的积分不足，编辑图片需要{self.edit_cost}积分，您当前有{points}积分", [sender_wxid])
+                return False  # 积分不足，阻止后续插件执行
 
-                        # 保存到图片缓存
-                        self._save_image_to_cache(from_wxid, sender_wxid, file_content)
-                        logger.info(f"保存上传的文件到图片缓存，大小: {len(file_content)} 字节")
+        # 编辑图片
+        try:
+            # 发送处理中消息
+            self._send_notice(bot.send_at_message(from_wxid, "\n正在编辑图片，请稍候...", [sender_wxid]))
 
-                        # 获取会话上下文
-                        conversation_history = self.conversations[conversation_key]
+            # 下载用户上传的图片
+            file_id = file_info.get("FileID")
+            file_content = await bot.download_file(file_id)
 
-                        # 调用Gemini API编辑图片
-                        edited_images, text_responses = await self._edit_image(prompt, file_content, conversation_history)
+            # 保存原始图片
+            orig_image_path = self._new_file_path("orig")
+            self._atomic_write(orig_image_path, file_content)
 
-                        # 确保 edited_images 和 text_responses 不为 None
-                        if edited_images is None:
-                            edited_images = []
-                        if text_responses is None:
-                            text_responses = []
+            # 保存到图片缓存
+            self._save_image_to_cache(from_wxid, sender_wxid, file_content)
+            logger.info(f"保存上传的文件到图片缓存，大小: {len(file_content)} 字节")
 
-                        if len(edited_images) > 0 and edited_images[0]:
-                            # 保存编辑后的图片
-                            edited_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                            with open(edited_image_path, "wb") as f:
-                                f.write(edited_images[0])
+            # 获取会话上下文，只读取不创建，编辑成功后才写入会话
+            conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
 
-                            # 更新最后生成的图片路径
-                            self.last_images[conversation_key] = edited_image_path
+            # 调用Gemini API编辑图片
+            edited_images, text_responses = await self._edit_image(prompt, file_content, conversation_history)
 
-                            # 扣除积分
-                            if self.enable_points and sender_wxid not in self.admins:
-                                self.db.add_points(sender_wxid, -self.edit_cost)
-                                points_msg = f"已扣除{self.edit_cost}积分，当前剩余{points - self.edit_cost}积分"
-                            else:
-                                points_msg = ""
-
-                            # 发送文本回复（如果有）
-                            first_valid_text = next((t for t in text_responses if t), None)
-                            if first_valid_text:
-                                await bot.send_text_message(from_wxid, f"{first_valid_text}\n\n{points_msg if points_msg else ''}")
-                            else:
-                                await bot.send_text_message(from_wxid, f"图片编辑成功！{points_msg if points_msg else ''}")
-                            # 添加短暂延迟，确保文本发送完成
-                            await asyncio.sleep(0.5)
+            # 确保 edited_images 和 text_responses 不为 None
+            if edited_images is None:
+                edited_images = []
+            if text_responses is None:
+                text_responses = []
 
-                            # 发送图片
-                            with open(edited_image_path, "rb") as f:
-                                await bot.send_image_message(from_wxid, f.read())
-                            # 添加延迟，确保图片发送完成
-                            await asyncio.sleep(1.5)
+            if len(edited_images) > 0 and edited_images[0]:
+                # 保存编辑后的图片
+                edited_image_path = self._new_file_path("edited")
+                edited_image_path = self._persist_image(edited_image_path, edited_images[0])
 
-                            # 不再发送对话提示
-                            # if not conversation_history:  # 如果是新会话
-                            #     await bot.send_text_message(from_wxid, f"已开始图像对话，可以直接发消息继续修改图片。需要结束时请发送\"{self.exit_commands[0]}\"")
-
-                            # 更新会话历史
-                            user_message = {
-                                "role": "user",
-                                "parts": [
-                                    {"text": prompt},
-                                    {"image_url": orig_image_path}
-                                ]
-                            }
-                            conversation_history.append(user_message)
-
-                            assistant_message = {
-                                "role": "model",
-                                "parts": [
-                                    {"text": first_valid_text if first_valid_text else "我已编辑完成图片"},
-                                    {"image_url": edited_image_path}
-                                ]
-                            }
-                            conversation_history.append(assistant_message)
+                # 更新最后生成的图片路径
+                self.last_images[conversation_key] = edited_image_path
 
-                            # 限制会话历史长度
-                            if len(conversation_history) > 10:  # 保留最近5轮对话
-                                conversation_history = conversation_history[-10:]
+                # 扣除积分
+                if self.enable_points and sender_wxid not in self.admins:
+                    self.db.add_points(sender_wxid, -self.edit_cost)
+                    points_msg = f"已扣除{self.edit_cost}积分，当前剩余{points - self.edit_cost}积分"
+                else:
+                    points_msg = ""
 
-                            # 更新会话时间戳
-                            self.conversation_timestamps[conversation_key] = time.time()
-                        else:
-                            # 检查是否有文本响应，可能是内容被拒绝
-                            first_valid_text = next((t for t in text_responses if t), None)
-                            if first_valid_text:
-                                # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                                translated_response = self._translate_gemini_message(first_valid_text)
-                                await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
-                                logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
-                            else:
-                                logger.error(f"编辑图片失败，未获取到有效的图片数据")
-                                await bot.send_at_message(from_wxid, "\n图片编辑失败，请稍后再试或修改描述", [sender_wxid])
-                    except Exception as e:
-                        logger.error(f"编辑图片失败: {str(e)}")
-                        logger.error(traceback.format_exc())
-                        await bot.send_at_message(from_wxid, f"\n编辑图片失败: {str(e)}", [sender_wxid])
-                    return False  # 已处理命令，阻止后续插件执行
+                # 发送文本回复（如果有）
+                first_valid_text = next((t for t in text_responses if t), None)
+                message_text = self._format_edit_reply(first_valid_text, points_msg, clean_text=False)
 
-        # 不是本插件的命令，继续执行后续插件
-        return True
+                # 发送文本（如果有）和图片
+                await self._send_text_and_image(bot, from_wxid, message_text, edited_images[0])
+                # 添加延迟，确保图片发送完成
+                await asyncio.sleep(1.5)
+
+                # 不再发送对话提示
+                # if not conversation_history:  # 如果是新会话
+                #     await bot.send_text_message(from_wxid, f"已开始图像对话，可以直接发消息继续修改图片。需要结束时请发送\"{self.exit_commands[0]}\"")
+
+                # 更新会话历史和时间戳
+                self._record_edit_turn(conversation_key, conversation_history, prompt, orig_image_path,
+                                       first_valid_text, edited_image_path)
+            else:
+                # 检查是否有文本响应，可能是内容被拒绝
+                first_valid_text = next((t for t in text_responses if t), None)
+                if first_valid_text:
+                    # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
+                    translated_response = self._translate_gemini_message(first_valid_text)
+                    await bot.send_at_message(from_wxid, f"\n{translated_response}", [sender_wxid])
+                    logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
+                else:
+                    logger.error(f"编辑图片失败，未获取到有效的图片数据")
+                    await bot.send_at_message(from_wxid, "\n图片编辑失败，请稍后再试或修改描述", [sender_wxid])
+        except Exception as e:
+            logger.error(f"编辑图片失败: {str(e)}")
+            logger.error(traceback.format_exc())
+            await bot.send_at_message(from_wxid, f"\n编辑图片失败: {str(e)}", [sender_wxid])
+        return False  # 已处理命令，阻止后续插件执行
 
     @on_image_message(priority=200)
     async def handle_image_edit(self, bot: WechatAPIClient, message: dict) -> bool:
@@ -2805,35 +2390,42 @@ class GeminiImage(PluginBase):
         if not self.enable:
             return True  # 插件未启用，继续执行后续插件
 
-        # 获取会话信息
-        chat_id = message.get("chat_id", message.get("FromWxid", ""))
-        user_id = message.get("user_id", message.get("SenderWxid", ""))
-        conversation_key = f"{chat_id}_{user_id}"
-
+        # 获取会话信息，只读取一次消息字段
         from_wxid = message.get("FromWxid", "")
         sender_wxid = message.get("SenderWxid", "")
+        is_group = message.get("IsGroup", False)
+        chat_id = message.get("chat_id", from_wxid)
+        user_id = message.get("user_id", sender_wxid)
+        conversation_key = f"{chat_id}_{user_id}"
 
         # 记录详细的消息信息
-        logger.info(f"GeminiImage收到图片消息: MsgId={message.get('MsgId', '')}, FromWxid={from_wxid}, SenderWxid={sender_wxid}")
-        logger.info(f"等待融图状态: {self.waiting_for_merge_images}")
+        logger.debug("GeminiImage收到图片消息: MsgId={}, FromWxid={}, SenderWxid={}", message.get("MsgId", ""), from_wxid, sender_wxid)
+        # 融图等待状态中包含已上传的图片数据，只记录每个用户已收到的图片数量，且仅在DEBUG级别输出时才构建
+        logger.opt(lazy=True).debug(
+            "等待融图状态: {}",
+            lambda: {uid: len(merge_data["图片列表"]) for uid, merge_data in self.waiting_for_merge_images.items()}
+        )
 
         # 确保使用正确的用户ID
         if not user_id and sender_wxid:
             user_id = sender_wxid
-            logger.info(f"使用SenderWxid作为用户ID: {user_id}")
+            logger.debug("使用SenderWxid作为用户ID: {}", user_id)
         elif not user_id and from_wxid:
             user_id = from_wxid
-            logger.info(f"使用FromWxid作为用户ID: {user_id}")
+            logger.debug("使用FromWxid作为用户ID: {}", user_id)
+
+        # 各等待状态的超时判断共用一次时钟读取；使用单调时钟，不受系统时间调整影响
+        now = time.monotonic()
 
         # 检查是否在等待融图图片
         if user_id in self.waiting_for_merge_images:
             merge_data = self.waiting_for_merge_images[user_id]
             # 检查是否超时
-            if time.time() - merge_data["开始时间"] > self.merge_image_wait_timeout:
+            if now - merge_data["开始时间"] > self.merge_image_wait_timeout:
                 # 超时，清除等待状态
                 del self.waiting_for_merge_images[user_id]
                 await bot.send_text_message(chat_id, "融图等待超时，请重新开始")
-                logger.info(f"用户 {user_id} 融图等待超时，已清除等待状态")
+                logger.info("用户 {} 融图等待超时，已清除等待状态", user_id)
             else:
                 # 未超时，添加图片到列表
                 image_list = merge_data["图片列表"]
@@ -2841,15 +2433,15 @@ class GeminiImage(PluginBase):
                 # 检查是否已达到最大图片数量
                 if len(image_list) >= self.max_merge_images:
                     await bot.send_text_message(chat_id, f"已达到最大图片数量 {self.max_merge_images} 张，请发送 {self.start_merge_commands[0]} 开始融合")
-                    logger.info(f"用户 {user_id} 已达到最大融图图片数量 {self.max_merge_images} 张")
+                    logger.info("用户 {} 已达到最大融图图片数量 {} 张", user_id, self.max_merge_images)
                     return False  # 阻断后续插件执行
 
-                logger.info(f"用户 {user_id} 正在等待融图图片，当前已有 {len(image_list)} 张图片")
+                logger.info("用户 {} 正在等待融图图片，当前已有 {} 张图片", user_id, len(image_list))
 
         # 检查是否在等待反向提示词图片
         if user_id in self.waiting_for_reverse_image and self.waiting_for_reverse_image[user_id]:
             # 检查是否超时
-            if time.time() - self.waiting_for_reverse_image_time[user_id] > self.reverse_image_wait_timeout:
+            if now - self.waiting_for_reverse_image_time[user_id] > self.reverse_image_wait_timeout:
                 # 超时，清除等待状态
                 del self.waiting_for_reverse_image[user_id]
                 del self.waiting_for_reverse_image_time[user_id]
@@ -2863,7 +2455,7 @@ class GeminiImage(PluginBase):
         # 检查是否在等待图片分析
         if user_id in self.waiting_for_analyze_image and self.waiting_for_analyze_image[user_id]:
             # 检查是否超时
-            if time.time() - self.waiting_for_analyze_image_time[user_id] > self.analyze_image_wait_timeout:
+            if now - self.waiting_for_analyze_image_time[user_id] > self.analyze_image_wait_timeout:
                 # 超时，清除等待状态
                 del self.waiting_for_analyze_image[user_id]
                 del self.waiting_for_analyze_image_time[user_id]
@@ -2875,12 +2467,12 @@ class GeminiImage(PluginBase):
                     points_before = await self.db.get_user_points(user_id)
                     await self.db.update_user_points(user_id, -self.analysis_cost)
                     points_after = await self.db.get_user_points(user_id)
-                    logger.info(f"用户 {user_id} 图片分析扣除积分 {self.analysis_cost}，积分变化: {points_before} -> {points_after}")
+                    logger.info("用户 {} 图片分析扣除积分 {}，积分变化: {} -> {}", user_id, self.analysis_cost, points_before, points_after)
 
         # 检查是否在等待编辑图片
         if user_id in self.waiting_for_edit_image and self.waiting_for_edit_image[user_id]:
             # 检查是否超时
-            if time.time() - self.waiting_for_edit_image_time[user_id] > self.edit_image_wait_timeout:
+            if now - self.waiting_for_edit_image_time[user_id] > self.edit_image_wait_timeout:
                 # 超时，清除等待状态
                 del self.waiting_for_edit_image[user_id]
                 del self.waiting_for_edit_image_time[user_id]
@@ -2894,16 +2486,15 @@ class GeminiImage(PluginBase):
                     points_before = await self.db.get_user_points(user_id)
                     await self.db.update_user_points(user_id, -self.edit_cost)
                     points_after = await self.db.get_user_points(user_id)
-                    logger.info(f"用户 {user_id} 编辑图片扣除积分 {self.edit_cost}，积分变化: {points_before} -> {points_after}")
+                    logger.info("用户 {} 编辑图片扣除积分 {}，积分变化: {} -> {}", user_id, self.edit_cost, points_before, points_after)
 
         # 在群聊中，使用发送者ID作为图片所有者
         # 在私聊中，FromWxid和SenderWxid相同
-        is_group = message.get("IsGroup", False)
         image_owner = sender_wxid if is_group else from_wxid
 
         try:
-            # 清理过期缓存
-            self._cleanup_image_cache()
+            # 按间隔清理过期缓存
+            self._maybe_cleanup()
 
             # 尝试从MD5获取图片路径（优先使用系统缓存）
             md5 = message.get("FileMd5", message.get("md5", ""))
@@ -2912,7 +2503,7 @@ class GeminiImage(PluginBase):
                 for ext in ['.jpeg', '.png', '.jpg']:
                     app_file_path = f"/app/files/{md5}{ext}"
                     if os.path.exists(app_file_path):
-                        logger.info(f"找到系统缓存的图片: {app_file_path}")
+                        logger.info("找到系统缓存的图片: {}", app_file_path)
                         break
                 else:
                     # 如果循环正常结束（没有break），说明没有找到图片
@@ -2927,16 +2518,17 @@ class GeminiImage(PluginBase):
             # 如果没有MD5或系统缓存不存在，尝试从FilePath获取
             file_path = message.get("FilePath", "")
             if file_path and os.path.exists(file_path):
-                logger.info(f"找到图片路径: {file_path}")
+                logger.info("找到图片路径: {}", file_path)
 
                 # 直接使用图片路径
                 self._save_image_to_cache(from_wxid, image_owner, None, file_path)
                 return False  # 成功处理图片，阻断后续插件执行
 
             # 如果没有路径，尝试直接从ImgBuf获取
-            if "ImgBuf" in message and message["ImgBuf"] and len(message["ImgBuf"]) > 100:
-                image_data = message["ImgBuf"]
-                logger.info(f"从ImgBuf提取到图片数据，大小: {len(image_data)} 字节")
+            img_buf = message.get("ImgBuf")
+            if img_buf and len(img_buf) > 100:
+                image_data = img_buf
+                logger.info("从ImgBuf提取到图片数据，大小: {} 字节", len(image_data))
 
                 # 保存图片到缓存
                 self._save_image_to_cache(from_wxid, image_owner, image_data)
@@ -2949,11 +2541,11 @@ class GeminiImage(PluginBase):
                     # 检查是否已达到最大图片数量
                     if len(image_list) >= self.max_merge_images:
                         await bot.send_text_message(chat_id, f"已达到最大图片数量 {self.max_merge_images} 张，请发送 {self.start_merge_commands[0]} 开始融合")
-                        logger.info(f"用户 {user_id} 已达到最大融图图片数量 {self.max_merge_images} 张")
+                        logger.info("用户 {} 已达到最大融图图片数量 {} 张", user_id, self.max_merge_images)
                     else:
                         # 添加图片到列表
                         image_list.append(image_data)
-                        logger.info(f"已添加第 {len(image_list)} 张融图图片，大小: {len(image_data)} 字节")
+                        logger.info("已添加第 {} 张融图图片，大小: {} 字节", len(image_list), len(image_data))
 
                         # 发送提示消息
                         await bot.send_text_message(chat_id, f"已添加第 {len(image_list)} 张图片，还可以继续添加 {self.max_merge_images - len(image_list)} 张图片，或发送 {self.start_merge_commands[0]} 开始融合")
@@ -2961,21 +2553,21 @@ class GeminiImage(PluginBase):
                         # 如果已达到最大图片数量，自动开始融合
                         if len(image_list) >= self.max_merge_images:
                             prompt = merge_data["提示词"]
-                            logger.info(f"已达到最大融图图片数量 {self.max_merge_images}，自动开始融合，提示词: {prompt}")
+                            logger.info("已达到最大融图图片数量 {}，自动开始融合，提示词: {}", self.max_merge_images, prompt)
 
                             # 扣除积分
                             if self.enable_points and self.merge_cost > 0:
                                 points_before = await self.db.get_user_points(user_id)
                                 await self.db.update_user_points(user_id, -self.merge_cost)
                                 points_after = await self.db.get_user_points(user_id)
-                                logger.info(f"用户 {user_id} 融图扣除积分 {self.merge_cost}，积分变化: {points_before} -> {points_after}")
+                                logger.info("用户 {} 融图扣除积分 {}，积分变化: {} -> {}", user_id, self.merge_cost, points_before, points_after)
 
                             # 处理融图请求
                             success = await self._handle_merge_images(bot, message, prompt, image_list)
 
                             # 清除等待状态
                             del self.waiting_for_merge_images[user_id]
-                            logger.info(f"融图处理{'成功' if success else '失败'}，已清除用户 {user_id} 的等待状态")
+                            logger.info("融图处理{}，已清除用户 {} 的等待状态", '成功' if success else '失败', user_id)
 
                 # 处理反向提示词图片
                 if user_id in self.waiting_for_reverse_image and self.waiting_for_reverse_image[user_id]:
@@ -3009,84 +2601,17 @@ class GeminiImage(PluginBase):
                         del self.waiting_for_edit_image_prompt[user_id]
 
                     # 发送处理中消息
-                    await bot.send_text_message(chat_id, "正在编辑图片，请稍候...")
+                    self._send_notice(bot.send_text_message(chat_id, "正在编辑图片，请稍候..."))
 
-                    # 获取会话上下文
+                    # 会话标识
                     conversation_key = f"{chat_id}_{user_id}"
-                    conversation_history = self.conversations.get(conversation_key, [])
 
                     # 保存原始图片
-                    orig_image_path = os.path.join(self.save_dir, f"orig_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                    with open(orig_image_path, "wb") as f:
-                        f.write(image_data)
-
-                    # 调用Gemini API编辑图片
-                    edited_images, text_responses = await self._edit_image(prompt, image_data, conversation_history)
-
-                    # 确保 edited_images 和 text_responses 不为 None
-                    if edited_images is None:
-                        edited_images = []
-                    if text_responses is None:
-                        text_responses = []
+                    orig_image_path = self._new_file_path("orig")
+                    self._atomic_write(orig_image_path, image_data)
 
-                    if len(edited_images) > 0 and edited_images[0]:
-                        # 保存编辑后的图片
-                        edited_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                        with open(edited_image_path, "wb") as f:
-                            f.write(edited_images[0])
-
-                        # 更新最后生成的图片路径
-                        self.last_images[conversation_key] = edited_image_path
-
-                        # 发送文本回复（如果有）
-                        first_valid_text = next((t for t in text_responses if t), None)
-                        if first_valid_text:
-                            await bot.send_text_message(chat_id, first_valid_text)
-                        else:
-                            await bot.send_text_message(chat_id, "图片编辑成功！")
-
-                        # 添加短暂延迟，确保文本发送完成
-                        await asyncio.sleep(0.5)
-
-                        # 发送图片
-                        with open(edited_image_path, "rb") as f:
-                            await bot.send_image_message(chat_id, f.read())
-
-                        # 更新会话历史
-                        user_message = {
-                            "role": "user",
-                            "parts": [
-                                {"text": prompt},
-                                {"image_url": orig_image_path}
-                            ]
-                        }
-                        conversation_history.append(user_message)
-
-                        assistant_message = {
-                            "role": "model",
-                            "parts": [
-                                {"text": first_valid_text if first_valid_text else "我已编辑完成图片"},
-                                {"image_url": edited_image_path}
-                            ]
-                        }
-                        conversation_history.append(assistant_message)
-
-                        # 更新会话历史
-                        self.conversations[conversation_key] = conversation_history
-
-                        # 更新会话时间戳
-                        self.conversation_timestamps[conversation_key] = time.time()
-                    else:
-                        # 检查是否有文本响应，可能是内容被拒绝
-                        first_valid_text = next((t for t in text_responses if t), None)
-                        if first_valid_text:
-                            # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                            translated_response = self._translate_gemini_message(first_valid_text)
-                            await bot.send_text_message(chat_id, translated_response)
-                            logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
-                        else:
-                            logger.error(f"编辑图片失败，未获取到有效的图片数据")
-                            await bot.send_text_message(chat_id, "图片编辑失败，请稍后再试或修改描述")
+                    # 调用Gemini API编辑图片，并保存、回复结果
+                    await self._do_edit_and_reply(bot, chat_id, conversation_key, prompt, image_data, orig_image_path)
 
                     return False  # 阻断后续插件执行
 
@@ -3106,47 +2631,47 @@ class GeminiImage(PluginBase):
                             base64_data = content[xml_end + 6:].strip()
                             if base64_data:
                                 try:
-                                    image_data = base64.b64decode(base64_data)
-                                    logger.info(f"从XML后面提取到Base64数据，长度: {len(image_data)} 字节")
+                                    image_data = self._b64decode(base64_data)
+                                    logger.info("从XML后面提取到Base64数据，长度: {} 字节", len(image_data))
 
                                     # 保存图片到缓存
                                     self._save_image_to_cache(from_wxid, image_owner, image_data)
                                 except Exception as e:
-                                    logger.error(f"XML后Base64解码失败: {e}")
+                                    logger.error("XML后Base64解码失败: {}", e)
 
                         # 如果上面的方法失败，尝试直接检测任何位置的Base64图片头部标识
-                        base64_markers = ["iVBOR", "/9j/", "R0lGOD", "UklGR", "PD94bWw", "Qk0", "SUkqAA"]
-                        for marker in base64_markers:
-                            if marker in content:
-                                idx = content.find(marker)
-                                if idx > 0:
-                                    try:
-                                        # 可能的Base64数据，截取从标记开始到结束的部分
-                                        base64_data = content[idx:]
-                                        # 去除可能的非Base64字符
-                                        base64_data = ''.join(c for c in base64_data if c in
-                                                              'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=')
-
-                                        # 修正长度确保是4的倍数
-                                        padding = len(base64_data) % 4
-                                        if padding:
-                                            base64_data += '=' * (4 - padding)
-
-                                        # 尝试解码
-                                        image_data = base64.b64decode(base64_data)
-                                        if len(image_data) > 1000:  # 确保至少有一些数据
-                                            logger.info(f"从内容中提取到{marker}格式图片数据，长度: {len(image_data)} 字节")
-
-                                            # 保存图片到缓存 - 使用(聊天ID, 用户ID)作为键
+                        for marker in self._base64_image_markers:
+                            # 每个标识只查找一次，find返回-1时同样跳过
+                            idx = content.find(marker)
+                            if idx > 0:
+                                try:
+                                    # 可能的Base64数据，截取从标记开始到结束的部分
+                                    base64_data = content[idx:]
+                                    # 去除可能的非Base64字符
+                                    base64_data = self._non_base64_regex.sub('', base64_data)
+
+                                    # 修正长度确保是4的倍数
+                                    padding = len(base64_data) % 4
+                                    if padding:
+                                        base64_data += '=' * (4 - padding)
+
+                                    # 尝试解码
+                                    image_data = self._b64decode(base64_data)
+                                    if len(image_data) > 1000:  # 确保至少有一些数据
+                                        logger.info("从内容中提取到{}格式图片数据，长度: {} 字节", marker, len(image_data))
+
+                                        # 保存图片到缓存 - 使用(聊天ID, 用户ID)作为键
+                                        # 只按文件头魔数粗略校验，完整解码留到实际编辑时再做
+                                        if self._looks_like_image(image_data):
                                             cache_key = (from_wxid, image_owner)
-                                            self.image_cache[cache_key] = {
+                                            self._image_cache_put(cache_key, {
                                                 "content": image_data,
-                                                "timestamp": time.time()
-                                            }
-                                    except Exception as e:
-                                        logger.error(f"提取{marker}格式图片数据失败: {e}")
+                                                "timestamp": time.monotonic()
+                                            })
+                                except Exception as e:
+                                    logger.error("提取{}格式图片数据失败: {}", marker, e)
                     except Exception as e:
-                        logger.error(f"提取XML中图片数据失败: {e}")
+                        logger.error("提取XML中图片数据失败: {}", e)
 
                 # 如果前面的方法都失败了，再尝试一种方法，直接提取整个content作为可能的Base64数据
                 # 这对于某些不标准的消息格式可能有效
@@ -3158,166 +2683,97 @@ class GeminiImage(PluginBase):
                     if padding:
                         base64_content += '=' * (4 - padding)
 
-                    image_data = base64.b64decode(base64_content)
+                    image_data = self._b64decode(base64_content)
                     # 如果解码成功且数据量足够大，可能是图片
                     if len(image_data) > 10000:  # 图片数据通常较大
                         try:
-                            # 仅尝试打开，不进行验证，避免某些非标准图片格式失败
-                            with Image.open(BytesIO(image_data)) as img:
-                                width, height = img.size
-                                if width > 10 and height > 10:  # 确保是有效图片
-                                    logger.info(f"从内容解码成功，图片尺寸: {width}x{height}")
+                            # 只按文件头魔数校验图片，不用PIL解析，完整解码留到实际编辑时再做
+                            if self._looks_like_image(image_data):
+                                logger.info("从内容解码成功，图片大小: {} 字节", len(image_data))
 
-                                    # 保存图片到缓存
-                                    self._save_image_to_cache(from_wxid, image_owner, image_data)
+                                # 保存图片到缓存
+                                self._save_image_to_cache(from_wxid, image_owner, image_data)
 
-                                    # 处理融图图片
-                                    if user_id in self.waiting_for_merge_images:
-                                        merge_data = self.waiting_for_merge_images[user_id]
-                                        image_list = merge_data["图片列表"]
+                                # 处理融图图片
+                                if user_id in self.waiting_for_merge_images:
+                                    merge_data = self.waiting_for_merge_images[user_id]
+                                    image_list = merge_data["图片列表"]
 
-                                        # 添加图片到列表
-                                        image_list.append(image_data)
-                                        logger.info(f"已添加第 {len(image_list)} 张融图图片，大小: {len(image_data)} 字节")
+                                    # 添加图片到列表
+                                    image_list.append(image_data)
+                                    logger.info("已添加第 {} 张融图图片，大小: {} 字节", len(image_list), len(image_data))
 
-                                        # 发送提示消息
-                                        await bot.send_text_message(chat_id, f"已添加第 {len(image_list)} 张图片，还可以继续添加 {self.max_merge_images - len(image_list)} 张图片，或发送 {self.start_merge_commands[0]} 开始融合")
+                                    # 发送提示消息
+                                    await bot.send_text_message(chat_id, f"已添加第 {len(image_list)} 张图片，还可以继续添加 {self.max_merge_images - len(image_list)} 张图片，或发送 {self.start_merge_commands[0]} 开始融合")
 
-                                        # 如果已达到最大图片数量，自动开始融合
-                                        if len(image_list) >= self.max_merge_images:
-                                            prompt = merge_data["提示词"]
-                                            logger.info(f"已达到最大融图图片数量 {self.max_merge_images}，自动开始融合，提示词: {prompt}")
+                                    # 如果已达到最大图片数量，自动开始融合
+                                    if len(image_list) >= self.max_merge_images:
+                                        prompt = merge_data["提示词"]
+                                        logger.info("已达到最大融图图片数量 {}，自动开始融合，提示词: {}", self.max_merge_images, prompt)
 
-                                            # 扣除积分
-                                            if self.enable_points and self.merge_cost > 0:
-                                                await self.db.update_user_points(user_id, -self.merge_cost)
-                                                logger.info(f"已扣除融图积分 {self.merge_cost}")
+                                        # 扣除积分
+                                        if self.enable_points and self.merge_cost > 0:
+                                            await self.db.update_user_points(user_id, -self.merge_cost)
+                                            logger.info("已扣除融图积分 {}", self.merge_cost)
 
-                                            # 处理融图请求
-                                            await self._handle_merge_images(bot, message, prompt, image_list)
+                                        # 处理融图请求
+                                        await self._handle_merge_images(bot, message, prompt, image_list)
 
-                                            # 清除等待状态
-                                            del self.waiting_for_merge_images[user_id]
-                                            logger.info("融图处理完成，已清除等待状态")
+                                        # 清除等待状态
+                                        del self.waiting_for_merge_images[user_id]
+                                        logger.info("融图处理完成，已清除等待状态")
 
-                                        return False  # 阻断后续插件执行
+                                    return False  # 阻断后续插件执行
 
-                                    # 处理反向提示词图片
-                                    if user_id in self.waiting_for_reverse_image and self.waiting_for_reverse_image[user_id]:
-                                        # 清除等待状态
-                                        del self.waiting_for_reverse_image[user_id]
-                                        del self.waiting_for_reverse_image_time[user_id]
+                                # 处理反向提示词图片
+                                if user_id in self.waiting_for_reverse_image and self.waiting_for_reverse_image[user_id]:
+                                    # 清除等待状态
+                                    del self.waiting_for_reverse_image[user_id]
+                                    del self.waiting_for_reverse_image_time[user_id]
 
-                                        # 处理反向提示词请求
-                                        await self._handle_reverse_image(bot, message, image_data)
-                                        return False  # 阻断后续插件执行
+                                    # 处理反向提示词请求
+                                    await self._handle_reverse_image(bot, message, image_data)
+                                    return False  # 阻断后续插件执行
+
+                                # 处理图片分析请求
+                                if user_id in self.waiting_for_analyze_image and self.waiting_for_analyze_image[user_id]:
+                                    # 清除等待状态
+                                    del self.waiting_for_analyze_image[user_id]
+                                    del self.waiting_for_analyze_image_time[user_id]
 
                                     # 处理图片分析请求
-                                    if user_id in self.waiting_for_analyze_image and self.waiting_for_analyze_image[user_id]:
-                                        # 清除等待状态
-                                        del self.waiting_for_analyze_image[user_id]
-                                        del self.waiting_for_analyze_image_time[user_id]
+                                    await self._handle_analyze_image(bot, message, image_data)
+                                    return False  # 阻断后续插件执行
 
-                                        # 处理图片分析请求
-                                        await self._handle_analyze_image(bot, message, image_data)
-                                        return False  # 阻断后续插件执行
+                                # 处理编辑图片请求
+                                if user_id in self.waiting_for_edit_image and self.waiting_for_edit_image[user_id]:
+                                    # 获取提示词
+                                    prompt = self.waiting_for_edit_image_prompt.get(user_id, "")
 
-                                    # 处理编辑图片请求
-                                    if user_id in self.waiting_for_edit_image and self.waiting_for_edit_image[user_id]:
-                                        # 获取提示词
-                                        prompt = self.waiting_for_edit_image_prompt.get(user_id, "")
+                                    # 清除等待状态
+                                    del self.waiting_for_edit_image[user_id]
+                                    del self.waiting_for_edit_image_time[user_id]
+                                    if user_id in self.waiting_for_edit_image_prompt:
+                                        del self.waiting_for_edit_image_prompt[user_id]
 
-                                        # 清除等待状态
-                                        del self.waiting_for_edit_image[user_id]
-                                        del self.waiting_for_edit_image_time[user_id]
-                                        if user_id in self.waiting_for_edit_image_prompt:
-                                            del self.waiting_for_edit_image_prompt[user_id]
-
-                                        # 发送处理中消息
-                                        await bot.send_text_message(chat_id, "正在编辑图片，请稍候...")
-
-                                        # 获取会话上下文
-                                        conversation_key = f"{chat_id}_{user_id}"
-                                        conversation_history = self.conversations.get(conversation_key, [])
-
-                                        # 保存原始图片
-                                        orig_image_path = os.path.join(self.save_dir, f"orig_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                        with open(orig_image_path, "wb") as f:
-                                            f.write(image_data)
-
-                                        # 调用Gemini API编辑图片
-                                        edited_images, text_responses = await self._edit_image(prompt, image_data, conversation_history)
-
-                                        # 确保 edited_images 和 text_responses 不为 None
-                                        if edited_images is None:
-                                            edited_images = []
-                                        if text_responses is None:
-                                            text_responses = []
-
-                                        if len(edited_images) > 0 and edited_images[0]:
-                                            # 保存编辑后的图片
-                                            edited_image_path = os.path.join(self.save_dir, f"edited_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                                            with open(edited_image_path, "wb") as f:
-                                                f.write(edited_images[0])
-
-                                            # 更新最后生成的图片路径
-                                            self.last_images[conversation_key] = edited_image_path
-
-                                            # 发送文本回复（如果有）
-                                            first_valid_text = next((t for t in text_responses if t), None)
-                                            if first_valid_text:
-                                                await bot.send_text_message(chat_id, first_valid_text)
-                                            else:
-                                                await bot.send_text_message(chat_id, "图片编辑成功！")
+                                    # 发送处理中消息
+                                    self._send_notice(bot.send_text_message(chat_id, "正在编辑图片，请稍候..."))
 
-                                            # 添加短暂延迟，确保文本发送完成
-                                            await asyncio.sleep(0.5)
+                                    # 会话标识
+                                    conversation_key = f"{chat_id}_{user_id}"
 
-                                            # 发送图片
-                                            with open(edited_image_path, "rb") as f:
-                                                await bot.send_image_message(chat_id, f.read())
-
-                                            # 更新会话历史
-                                            user_message = {
-                                                "role": "user",
-                                                "parts": [
-                                                    {"text": prompt},
-                                                    {"image_url": orig_image_path}
-                                                ]
-                                            }
-                                            conversation_history.append(user_message)
-
-                                            assistant_message = {
-                                                "role": "model",
-                                                "parts": [
-                                                    {"text": first_valid_text if first_valid_text else "我已编辑完成图片"},
-                                                    {"image_url": edited_image_path}
-                                                ]
-                                            }
-                                            conversation_history.append(assistant_message)
-
-                                            # 更新会话历史
-                                            self.conversations[conversation_key] = conversation_history
-
-                                            # 更新会话时间戳
-                                            self.conversation_timestamps[conversation_key] = time.time()
-                                        else:
-                                            # 检查是否有文本响应，可能是内容被拒绝
-                                            first_valid_text = next((t for t in text_responses if t), None)
-                                            if first_valid_text:
-                                                # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
-                                                translated_response = self._translate_gemini_message(first_valid_text)
-                                                await bot.send_text_message(chat_id, translated_response)
-                                                logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
-                                            else:
-                                                logger.error(f"编辑图片失败，未获取到有效的图片数据")
-                                                await bot.send_text_message(chat_id, "图片编辑失败，请稍后再试或修改描述")
+                                    # 保存原始图片
+                                    orig_image_path = self._new_file_path("orig")
+                                    self._atomic_write(orig_image_path, image_data)
 
-                                        return False  # 阻断后续插件执行
+                                    # 调用Gemini API编辑图片，并保存、回复结果
+                                    await self._do_edit_and_reply(bot, chat_id, conversation_key, prompt, image_data, orig_image_path)
 
                                     return False  # 阻断后续插件执行
+
+                                return False  # 阻断后续插件执行
                         except Exception as img_e:
-                            logger.error(f"解码后数据不是有效图片: {img_e}")
+                            logger.error("解码后数据不是有效图片: {}", img_e)
                 except Exception as e:
                     # 解码失败不是错误，只是这种方法不适用
                     pass
@@ -3332,7 +2788,7 @@ class GeminiImage(PluginBase):
             elif user_id in self.waiting_for_analyze_image and self.waiting_for_analyze_image[user_id]:
                 await bot.send_text_message(chat_id, "无法提取图片数据，请重新上传")
         except Exception as e:
-            logger.error(f"处理图片消息失败: {str(e)}")
+            logger.error("处理图片消息失败: {}", str(e))
             logger.error(traceback.format_exc())
 
         # 如果是在等待融图、反向提示词、图片分析或编辑图片的状态，阻断后续插件执行
@@ -3343,34 +2799,115 @@ class GeminiImage(PluginBase):
             return False  # 阻断后续插件执行
         return True  # 继续执行后续插件
 
+    def _maybe_cleanup(self):
+        """按固定间隔清理过期的会话和图片缓存，避免每条消息都全量扫描"""
+        now = time.monotonic()
+        if now - self._last_cleanup < self._cleanup_interval:
+            return
+        self._last_cleanup = now
+        self._cleanup_expired_conversations()
+        self._cleanup_image_cache()
+
+    def _end_conversation(self, conversation_key: str) -> bool:
+        """结束会话，一次性清除该会话的历史、时间戳和最后图片路径
+
+        Args:
+            conversation_key: 会话标识
+
+        Returns:
+            bool: 结束前是否存在活跃会话
+        """
+        had_conversation = self.conversations.pop(conversation_key, None) is not None
+        self.conversation_timestamps.pop(conversation_key, None)
+        last_image_path = self.last_images.pop(conversation_key, None)
+        if last_image_path:
+            self._recent_image_bytes.pop(last_image_path, None)
+        return had_conversation
+
+    def _touch_conversation(self, conversation_key: str):
+        """更新会话的最后活动时间
+
+        先删除再插入，使conversation_timestamps始终按活动时间排序，
+        清理时只需从头扫描到第一个未过期的会话即可停止。
+
+        Args:
+            conversation_key: 会话标识
+        """
+        self.conversation_timestamps.pop(conversation_key, None)
+        self.conversation_timestamps[conversation_key] = time.monotonic()
+
     def _cleanup_expired_conversations(self):
         """清理过期的会话"""
-        current_time = time.time()
-        expired_keys = []
+        # 时间戳按活动先后排列，遇到第一个未过期的会话即可停止
+        expired_keys = self._expired_keys(self.conversation_timestamps.items(),
+                                          time.monotonic() - self.conversation_expiry)
+        for key in expired_keys:
+            self._end_conversation(key)
 
-        for key, timestamp in self.conversation_timestamps.items():
-            if current_time - timestamp > self.conversation_expiry:
-                expired_keys.append(key)
+    @staticmethod
+    def _start_wait(wait_times: dict, user_id: str):
+        """记录等待状态的开始时间
 
-        for key in expired_keys:
-            if key in self.conversations:
-                del self.conversations[key]
-            if key in self.conversation_timestamps:
-                del self.conversation_timestamps[key]
-            if key in self.last_images:
-                del self.last_images[key]
-
-    def _cleanup_image_cache(self):
-        """清理过期的图片缓存"""
-        current_time = time.time()
-        expired_keys = []
+        先删除再插入，使等待时间字典始终按开始时间排序，清理时遇到第一个未超时的用户即可停止。
 
-        for key, cache_data in self.image_cache.items():
-            if current_time - cache_data["timestamp"] > self.image_cache_timeout:
-                expired_keys.append(key)
+        Args:
+            wait_times: 等待开始时间字典
+            user_id: 用户ID
+        """
+        wait_times.pop(user_id, None)
+        wait_times[user_id] = time.monotonic()
 
-        for key in expired_keys:
-            del self.image_cache[key]
+    @staticmethod
+    def _expired_keys(items, deadline: float) -> list:
+        """从按时间先后排列的(键, 时间戳)序列中取出所有早于deadline的键
+
+        Args:
+            items: 按时间戳升序排列的(键, 时间戳)可迭代对象
+            deadline: 截止时间，早于该时间的视为过期
+
+        Returns:
+            list: 过期的键
+        """
+        expired = []
+        for key, timestamp in items:
+            if timestamp >= deadline:
+                break
+            expired.append(key)
+        return expired
+
+    def _cleanup_expired_waits(self):
+        """清理超时的等待图片状态
+
+        等待状态原本只在用户再次发送图片时才检查超时，用户放弃操作后会一直留在内存中
+        （融图状态还持有已上传的图片数据），这里定期统一清理
+        """
+        now = time.monotonic()
+        wait_states = (
+            (self.waiting_for_reverse_image_time, self.reverse_image_wait_timeout,
+             (self.waiting_for_reverse_image,)),
+            (self.waiting_for_analyze_image_time, self.analyze_image_wait_timeout,
+             (self.waiting_for_analyze_image, self.waiting_for_analyze_image_query)),
+            (self.waiting_for_edit_image_time, self.edit_image_wait_timeout,
+             (self.waiting_for_edit_image, self.waiting_for_edit_image_prompt)),
+        )
+        expired_count = 0
+        for wait_times, timeout, related_states in wait_states:
+            expired_users = self._expired_keys(wait_times.items(), now - timeout)
+            for user_id in expired_users:
+                del wait_times[user_id]
+                for state in related_states:
+                    state.pop(user_id, None)
+            expired_count += len(expired_users)
+
+        expired_merges = self._expired_keys(
+            ((user_id, merge_data["开始时间"]) for user_id, merge_data in self.waiting_for_merge_images.items()),
+            now - self.merge_image_wait_timeout)
+        for user_id in expired_merges:
+            del self.waiting_for_merge_images[user_id]
+        expired_count += len(expired_merges)
+
+        if expired_count:
+            logger.info(f"已清理 {expired_count} 个超时的等待图片状态")
 
     @schedule('interval', minutes=5)
     async def scheduled_cleanup(self, bot=None):
@@ -3378,10 +2915,15 @@ class GeminiImage(PluginBase):
         try:
             self._cleanup_image_cache()
             self._cleanup_expired_conversations()
-            self._cleanup_temp_files()
+            # 刚完成一次完整清理，消息处理中的按间隔清理不必紧接着再执行一次
+            self._last_cleanup = time.monotonic()
+            self._cleanup_expired_waits()
+            # 临时目录可能有大量文件，在线程池中扫描，避免阻塞事件循环
+            await self._run_io(self._cleanup_temp_files)
+            await self._run_io(self._prune_enhance_db)
             # 清理过期的会话密钥映射
             self.clean_expired_session_keys()
-            logger.info("定时清理图片缓存、会话、临时文件和会话密钥映射完成")
+            logger.info("定时清理图片缓存、会话、等待状态、临时文件、增强缓存和会话密钥映射完成")
         except Exception as e:
             logger.error(f"定时清理任务异常: {str(e)}")
             logger.error(traceback.format_exc())
@@ -3395,14 +2937,11 @@ class GeminiImage(PluginBase):
         Returns:
             bool: 是否包含唤醒词
         """
-        # 从配置中获取唤醒词列表
-        wake_words = self.config.get("wake_words", [])
-
         # 检查消息是否包含任何唤醒词
-        for word in wake_words:
-            if word in message:
-                logger.info(f"检测到唤醒词 '{word}' 在消息中")
-                return True
+        word = next((w for w in self.wake_words if w in message), None)
+        if word is not None:
+            logger.debug("检测到唤醒词 '{}' 在消息中", word)
+            return True
 
         return False
 
@@ -3418,20 +2957,16 @@ class GeminiImage(PluginBase):
         # 检查消息内容是否包含@标记
         content = message.get("content", message.get("Content", ""))
 
-        # 获取机器人名称列表
-        robot_names = self.config.get("robot_names", ["bot", "机器人"])
-
         # 检查是否有@机器人的标记
-        for name in robot_names:
-            at_pattern = f"@{name}"
-            if at_pattern in content:
-                logger.info(f"检测到@机器人标记 '{at_pattern}' 在消息中")
-                return True
+        at_pattern = next((p for p in self._at_patterns if p in content), None)
+        if at_pattern is not None:
+            logger.debug("检测到@机器人标记 '{}' 在消息中", at_pattern)
+            return True
 
         # 检查消息属性中是否标记了@
         is_at = message.get("IsAt", False)
         if is_at:
-            logger.info("消息属性中标记了@机器人")
+            logger.debug("消息属性中标记了@机器人")
             return True
 
         return False
@@ -3450,17 +2985,71 @@ class GeminiImage(PluginBase):
         content = re.sub(r'@[^\s]+\s*', '', content)
 
         # 移除唤醒词
-        wake_words = self.config.get("wake_words", [])
-        for word in wake_words:
-            if word in content:
-                content = content.replace(word, "", 1)  # 只替换第一次出现的唤醒词
-                break  # 只移除一个唤醒词
+        word = next((w for w in self.wake_words if w in content), None)
+        if word is not None:
+            content = content.replace(word, "", 1)  # 只替换第一次出现的唤醒词，且只移除一个唤醒词
 
         # 清理多余的空格
         content = content.strip()
 
         return content
 
+    def _compile_command_regex(self, commands: List[str]) -> re.Pattern:
+        """将命令列表预编译为一个匹配命令开头的正则表达式
+
+        Args:
+            commands: 命令列表
+
+        Returns:
+            re.Pattern: 匹配 "命令" 或 "命令 + 空白" 开头的正则
+        """
+        pattern = '|'.join(re.escape(cmd) for cmd in commands)
+        return re.compile(f'^({pattern})(\\s|$)')
+
+    @staticmethod
+    def _build_command_table(typed_commands) -> Tuple[Dict[str, Tuple[Tuple[str, str], ...]], Tuple[str, ...]]:
+        """构建命令分发表
+
+        Args:
+            typed_commands: (命令类型, 命令列表) 序列，排在前面的类型在命令重复时优先
+
+        Returns:
+            Tuple[Dict, Tuple[str, ...]]: (首字符 -> 按长度降序排列的 (命令, 命令类型) 元组, 全部命令前缀元组)
+        """
+        cmd_map = {}
+        for cmd_type, cmds in typed_commands:
+            for cmd in cmds:
+                if cmd:
+                    cmd_map.setdefault(cmd, cmd_type)
+        # 按首字符分桶，桶内按长度降序排列，保证较长的命令优先匹配
+        cmd_buckets = {}
+        for cmd in sorted(cmd_map, key=len, reverse=True):
+            cmd_buckets.setdefault(cmd[0], []).append((cmd, cmd_map[cmd]))
+        return {k: tuple(v) for k, v in cmd_buckets.items()}, tuple(cmd_map)
+
+    def _match_command(self, content: str, cmd_buckets: Dict[str, Tuple[Tuple[str, str], ...]] = None, cmd_prefixes: Tuple[str, ...] = None) -> Tuple[Optional[str], Optional[str]]:
+        """按命令分发表匹配命令，默认匹配生成/编辑图片命令
+
+        先用 str.startswith(tuple) 在C层一次性判断，非命令消息直接返回；
+        命中后只遍历与消息首字符相同的那一小桶命令
+
+        Args:
+            content: 消息内容
+            cmd_buckets: 首字符 -> (命令, 命令类型) 元组，默认为生成/编辑图片命令表
+            cmd_prefixes: 全部命令前缀元组，与cmd_buckets对应
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: (命令类型, 命令)，未匹配时返回 (None, None)
+        """
+        if cmd_buckets is None:
+            cmd_buckets, cmd_prefixes = self._cmd_buckets, self._cmd_prefixes
+        if not content or not content.startswith(cmd_prefixes):
+            return None, None
+        for cmd, cmd_type in cmd_buckets.get(content[0], ()):
+            if content.startswith(cmd):
+                return cmd_type, cmd
+        return None, None
+
     def _check_message_prefix(self, message: str) -> Tuple[bool, str]:
         """检查消息是否带有所需前缀
 
@@ -3498,163 +3087,966 @@ class GeminiImage(PluginBase):
                 return True, processed_message
 
         # 没有找到前缀
-        logger.debug(f"消息 '{message}' 没有包含所需前缀")
+        logger.debug("消息 '{}' 没有包含所需前缀", message)
         return False, message
 
-    def _cleanup_temp_files(self):
-        """清理临时文件"""
-        try:
-            # 获取当前时间
-            current_time = time.time()
-            # 获取临时目录中的所有文件
-            for file_name in os.listdir(self.save_dir):
-                file_path = os.path.join(self.save_dir, file_name)
-                # 检查是否是文件
-                if os.path.isfile(file_path):
-                    # 获取文件的修改时间
-                    file_mod_time = os.path.getmtime(file_path)
-                    # 如果文件超过24小时未修改，则删除
-                    if current_time - file_mod_time > 24 * 3600:
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"已删除过期临时文件: {file_path}")
-                        except Exception as e:
-                            logger.error(f"删除临时文件失败: {str(e)}")
+    async def _get_http_session(self) -> aiohttp.ClientSession:
+        """获取共享的HTTP会话，所有Gemini API请求复用同一个连接池
+
+        Returns:
+            aiohttp.ClientSession: 共享的客户端会话
+        """
+        if self._http_session is None or self._http_session.closed:
+            # 几乎所有请求都发往同一个API域名，每个域名的连接上限决定了实际并发数：
+            # 分镜场景并发生成和多用户同时请求时，过小的上限会让请求排队等待空闲连接
+            connector = aiohttp.TCPConnector(limit=20, limit_per_host=10, keepalive_timeout=60, ttl_dns_cache=300)
+            # 请求体都是预先序列化好的JSON字节，Content-Type作为会话默认请求头只设置一次；
+            # API通过密钥鉴权，不需要Cookie，使用DummyCookieJar省去每次请求筛选、每次响应解析保存Cookie的开销
+            self._http_session = aiohttp.ClientSession(connector=connector, headers=self._api_headers,
+                                                       cookie_jar=aiohttp.DummyCookieJar())
+        return self._http_session
+
+    async def _coalesce(self, key: tuple, factory):
+        """合并同一时刻完全相同的请求
+
+        群聊中多人几乎同时发送相同提示词时，只发出一次API请求，其余调用等待同一个结果
+
+        Args:
+            key: 请求标识，例如(请求类型, 提示词)
+            factory: 无参函数，返回实际发送请求的协程
+
+        Returns:
+            请求结果
+        """
+        task = self._inflight_requests.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight_requests[key] = task
+            task.add_done_callback(lambda _: self._inflight_requests.pop(key, None))
+        # shield避免某个等待方被取消时连带取消其他等待方共享的请求
+        return await asyncio.shield(task)
+
+    def _send_notice(self, send_coro):
+        """在后台发送“请稍候”之类的处理中提示，不等待发送完成就继续调用API
+
+        提示消息的发送与随后API请求的网络往返相互重叠；API调用通常耗时数秒，提示消息仍会先于结果送达
+
+        Args:
+            send_coro: 发送提示消息的协程，例如 bot.send_text_message(...)
+        """
+        task = asyncio.ensure_future(send_coro)
+        self._notice_tasks.add(task)
+        task.add_done_callback(self._notice_done)
+
+    def _notice_done(self, task: asyncio.Task):
+        """提示消息发送完成的回调：释放引用并记录发送失败"""
+        self._notice_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("发送处理中提示失败: {}", task.exception())
+
+    async def _enhance_cached(self, kind: str, prompt: str, factory) -> str:
+        """带LRU缓存的提示词增强
+
+        用户经常重复使用相同的提示词，命中缓存时不再请求API；
+        增强失败时各增强方法会返回原始提示词，这种结果不写入缓存
+
+        Args:
+            kind: 增强类型，例如 "generate"、"edit"
+            prompt: 原始提示词
+            factory: 无参函数，返回实际执行增强的协程
+
+        Returns:
+            str: 增强后的提示词
+        """
+        # 折叠空白后再取摘要，仅空格、换行不同的提示词视为同一请求；
+        # 用固定长度的摘要作为键，避免长提示词（如分镜脚本）占用缓存内存
+        # 摘要中包含增强所用的模型，更换模型后不会复用旧模型的结果
+        normalized = " ".join(prompt.split())
+        digest = hashlib.blake2b(f"{self.prompt_model}|{normalized}".encode("utf-8"), digest_size=16).digest()
+        cache_key = (kind, digest)
+        cached = self._enhance_cache.get(cache_key)
+        if cached is not None:
+            self._enhance_cache.move_to_end(cache_key)
+            logger.info("提示词增强命中缓存: {}", kind)
+            return cached
+
+        cached = await self._run_io(self._enhance_db_get, kind, digest)
+        if cached is not None:
+            logger.info("提示词增强命中持久化缓存: {}", kind)
+            self._enhance_cache_put(cache_key, cached)
+            return cached
+
+        enhanced_prompt = await self._coalesce(cache_key, factory)
+        if enhanced_prompt and enhanced_prompt != prompt:
+            self._enhance_cache_put(cache_key, enhanced_prompt)
+            # 写库在后台完成，不等待
+            self._run_io(self._enhance_db_put, kind, digest, enhanced_prompt)
+        return enhanced_prompt
+
+    def _enhance_cache_put(self, cache_key: tuple, enhanced_prompt: str):
+        """写入提示词增强结果的内存LRU缓存，超出上限时淘汰最久未使用的条目"""
+        self._enhance_cache[cache_key] = enhanced_prompt
+        while len(self._enhance_cache) > self._enhance_cache_max_entries:
+            self._enhance_cache.popitem(last=False)
+
+    def _enhance_db_connect(self) -> sqlite3.Connection:
+        """打开提示词增强持久化缓存，首次使用时建表，调用方需持有 _enhance_db_lock
+
+        Returns:
+            sqlite3.Connection: 数据库连接，插件已禁用时返回None
+        """
+        if self._enhance_db_closed:
+            return None
+        if self._enhance_db is None:
+            db = sqlite3.connect(self._enhance_db_path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS enhance_cache ("
+                "kind TEXT NOT NULL, digest BLOB NOT NULL, result TEXT NOT NULL, ts INTEGER NOT NULL, "
+                "PRIMARY KEY (kind, digest))"
+            )
+            self._enhance_db = db
+        return self._enhance_db
+
+    def _enhance_db_get(self, kind: str, digest: bytes) -> Optional[str]:
+        """从持久化缓存读取提示词增强结果，在IO线程池中调用
+
+        Returns:
+            Optional[str]: 增强后的提示词，未命中、已过期或读取失败时返回None
+        """
+        try:
+            with self._enhance_db_lock:
+                db = self._enhance_db_connect()
+                if db is None:
+                    return None
+                row = db.execute(
+                    "SELECT result FROM enhance_cache WHERE kind = ? AND digest = ? AND ts > ?",
+                    (kind, digest, int(time.time()) - self._enhance_db_ttl)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning("读取提示词增强持久化缓存失败: {}", e)
+            return None
+        return row[0] if row else None
+
+    def _enhance_db_put(self, kind: str, digest: bytes, enhanced_prompt: str):
+        """把提示词增强结果写入持久化缓存，在IO线程池中调用"""
+        try:
+            with self._enhance_db_lock:
+                db = self._enhance_db_connect()
+                if db is None:
+                    return
+                db.execute(
+                    "INSERT OR REPLACE INTO enhance_cache (kind, digest, result, ts) VALUES (?, ?, ?, ?)",
+                    (kind, digest, enhanced_prompt, int(time.time()))
+                )
+        except sqlite3.Error as e:
+            logger.warning("写入提示词增强持久化缓存失败: {}", e)
+
+    def _prune_enhance_db(self):
+        """删除持久化缓存中过期的提示词增强结果，在IO线程池中调用"""
+        try:
+            with self._enhance_db_lock:
+                db = self._enhance_db_connect()
+                if db is None:
+                    return
+                db.execute(
+                    "DELETE FROM enhance_cache WHERE ts <= ?", (int(time.time()) - self._enhance_db_ttl,)
+                )
+        except sqlite3.Error as e:
+            logger.warning("清理提示词增强持久化缓存失败: {}", e)
+
+    async def on_enable(self, bot=None):
+        """插件启用时在后台预热到API服务器的连接"""
+        await super().on_enable(bot)
+        if self.enable:
+            self._prewarm_task = asyncio.ensure_future(self._prewarm_connection())
+
+    async def _prewarm_connection(self):
+        """预先完成DNS解析和TCP/TLS握手，连接留在共享连接池中，启用后的首个请求不必再等待建立连接
+
+        只发送一个HEAD请求，返回什么状态码都无所谓；失败时首个请求照常自行建立连接
+        """
+        # base_url可能留空，从实际请求使用的模型URL中取出协议和主机
+        parts = urlsplit(self._image_model_url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        try:
+            session = await self._get_http_session()
+            async with session.head(origin, proxy=self._proxy, timeout=aiohttp.ClientTimeout(total=5)):
+                pass
+            logger.debug("已预热到API服务器的连接: {}", origin)
         except Exception as e:
-            logger.error(f"清理临时文件失败: {str(e)}")
-            logger.error(traceback.format_exc())
+            logger.debug("预热API连接失败，首个请求时再建立连接: {}", e)
+
+    async def on_disable(self):
+        """插件禁用时关闭共享的HTTP会话和提示词增强持久化缓存"""
+        await super().on_disable()
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+            self._prewarm_task = None
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+        self._http_session = None
+        # 禁用时可能仍有请求在等待API响应，返回后的保存、编码改由默认线程池执行；
+        # 已提交的写入任务不取消，在后台继续完成
+        self._io_closed = True
+        self._io_pool.shutdown(wait=False, cancel_futures=False)
+        with self._enhance_db_lock:
+            self._enhance_db_closed = True
+            if self._enhance_db is not None:
+                self._enhance_db.close()
+                self._enhance_db = None
+
+    def _run_io(self, func, *args) -> asyncio.Future:
+        """在后台IO线程池中执行func，返回可等待的Future；不需要结果时可以不等待
+
+        插件禁用后线程池已关闭，此时改用事件循环的默认线程池，
+        禁用前发出的请求返回后仍能正常保存图片和编码上传数据
+        """
+        executor = None if self._io_closed else self._io_pool
+        return asyncio.get_running_loop().run_in_executor(executor, func, *args)
 
-    def _save_image_to_cache(self, from_wxid: str, sender_wxid: str, image_data: bytes = None, file_path: str = None):
-        """保存图片到缓存
+    def _file_token(self) -> str:
+        """生成文件名使用的 "时间戳_随机串" 标识"""
+        return f"{int(time.time())}_{random.getrandbits(32):08x}"
+
+    def _new_file_path(self, prefix: str, token: str = None, ext: str = ".png") -> str:
+        """生成保存目录下的新文件路径，格式为 {prefix}_{时间戳}_{随机串}{ext}
 
         Args:
-            from_wxid: 消息来源ID
-            sender_wxid: 发送者ID
-            image_data: 图片数据，可以为None
-            file_path: 图片文件路径，可以为None
+            prefix: 文件名前缀
+            token: 文件标识，为None时自动生成；批量保存时可复用同一个标识
+            ext: 文件扩展名
         """
-        # 使用(from_wxid, sender_wxid)作为键
-        cache_key = (from_wxid, sender_wxid)
-        conversation_key = f"{from_wxid}_{sender_wxid}"
+        return f"{self.save_dir}{os.sep}{prefix}_{token or self._file_token()}{ext}"
 
-        # 如果提供了文件路径，保存路径到last_images
-        if file_path and os.path.exists(file_path):
-            self.last_images[conversation_key] = file_path
-            logger.info(f"保存图片路径到缓存: {file_path}, 键: {conversation_key}")
+    def _persist_image(self, image_path: str, image_data: bytes) -> str:
+        """在后台线程中保存图片，调用方可以立即使用返回的路径记录会话历史
 
-            # 如果需要图片数据，从文件中读取
-            if image_data is None and file_path.endswith(('.jpeg', '.jpg', '.png')):
-                try:
-                    # 直接使用系统缓存的文件，不创建临时副本
-                    if "/app/files/" in file_path:
-                        logger.info(f"直接使用系统缓存的文件: {file_path}")
-                        image_data = None  # 不需要读取图片数据
-                    else:
-                        # 读取图片数据
-                        with open(file_path, "rb") as f_in:
-                            image_data = f_in.read()
-                        logger.info(f"从文件读取图片数据: {file_path}, 大小: {len(image_data)} 字节")
-                except Exception as e:
-                    logger.error(f"读取图片文件失败: {e}")
+        较大的照片类图片会在后台重新编码为JPEG，此时返回的路径扩展名为 .jpg
 
-        # 如果提供了图片数据，保存到image_cache
-        if image_data:
-            self.image_cache[cache_key] = {
-                "content": image_data,
-                "timestamp": time.time()
-            }
-            logger.info(f"成功缓存图片数据，大小: {len(image_data)} 字节，键: {cache_key}, {from_wxid}_{sender_wxid}")
-            logger.info(f"当前图片缓存包含 {len(self.image_cache)} 个条目")
+        Args:
+            image_path: 图片保存路径
+            image_data: 图片数据
 
-        # 处理融图功能
-        self._handle_merge_image_upload(from_wxid, sender_wxid, image_data, file_path)
+        Returns:
+            str: 实际保存的图片路径
+        """
+        recompress = self._should_recompress(image_data)
+        if recompress:
+            image_path = os.path.splitext(image_path)[0] + ".jpg"
+        self._run_io(self._write_image_file, image_path, image_data, recompress)
+        self._recent_image_bytes[image_path] = image_data
+        while len(self._recent_image_bytes) > self._recent_image_bytes_max_entries:
+            self._recent_image_bytes.popitem(last=False)
+        return image_path
+
+    def _image_available(self, image_path: str) -> bool:
+        """判断图片是否可用：刚保存的图片在后台写入（可能还在重新编码）时文件尚不存在，
+        但内存中有数据，与文件已存在同样视为可用
 
-    def _handle_merge_image_upload(self, from_wxid: str, sender_wxid: str, image_data: bytes = None, file_path: str = None):
-        """处理融图图片上传
+        Args:
+            image_path: 图片路径
+
+        Returns:
+            bool: 图片是否可用
+        """
+        return image_path in self._recent_image_bytes or os.path.exists(image_path)
+
+    def _read_image_file(self, image_path: str) -> bytes:
+        """读取图片数据，优先使用最近保存时留在内存中的数据，未命中时再读取文件
 
         Args:
-            from_wxid: 消息来源ID
-            sender_wxid: 发送者ID
-            image_data: 图片数据，可以为None
-            file_path: 图片文件路径，可以为None
+            image_path: 图片路径
+
+        Returns:
+            bytes: 图片数据
         """
-        # 检查所有可能的用户ID，确保能够找到等待融图状态
-        possible_user_ids = [sender_wxid, from_wxid]
-        for user_id in possible_user_ids:
-            if user_id in self.waiting_for_merge_images:
-                merge_data = self.waiting_for_merge_images[user_id]
-                image_list = merge_data["图片列表"]
+        image_data = self._recent_image_bytes.get(image_path)
+        if image_data is not None:
+            self._recent_image_bytes.move_to_end(image_path)
+            return image_data
+        # 不带缓冲层打开：FileIO.readall按fstat得到的文件大小一次分配缓冲区读取，
+        # 省去BufferedReader对象及其8KB缓冲区
+        with open(image_path, "rb", buffering=0) as f:
+            return f.readall()
+
+    def _should_recompress(self, image_data: bytes) -> bool:
+        """判断图片是否需要重新编码为JPEG：超过512KB且为不带透明通道的RGB图片
+
+        只解析文件头，不解码像素数据；该判断在事件循环中对每张保存的图片执行
+        """
+        if len(image_data) <= 512 * 1024:
+            return False
+        if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+            # API返回的图片基本都是PNG：IHDR块位置固定，第25字节为颜色类型，2表示不带透明通道的RGB，
+            # 直接读取该字节即可，无需创建BytesIO和PIL图片对象
+            return image_data[25] == 2
+        try:
+            with Image.open(BytesIO(image_data)) as img:
+                return img.mode in ("RGB", "YCbCr")
+        except Exception:
+            return False
 
-                # 检查是否已达到最大图片数量
-                if len(image_list) < self.max_merge_images:
-                    # 如果有文件路径但没有图片数据，从文件中读取
-                    if file_path and not image_data and os.path.exists(file_path):
-                        try:
-                            with open(file_path, "rb") as f:
-                                image_data = f.read()
-                            logger.info(f"从文件读取融图图片数据: {file_path}, 大小: {len(image_data)} 字节")
-                        except Exception as e:
-                            logger.error(f"读取融图图片文件失败: {e}")
-                            continue
+    def _recompress(self, image_data: bytes) -> bytes:
+        """将图片重新编码为 JPEG(quality=90)，视觉上无差别，体积通常只有原来的1/4左右"""
+        with Image.open(BytesIO(image_data)) as img:
+            output = BytesIO()
+            img.save(output, format="JPEG", quality=90, optimize=True)
+        return output.getvalue()
 
-                    # 确保有图片数据
-                    if image_data:
-                        # 添加图片到列表
-                        image_list.append(image_data)
-                        logger.info(f"在_handle_merge_image_upload中添加第 {len(image_list)} 张融图图片，大小: {len(image_data)} 字节，用户ID: {user_id}")
+    def _atomic_write(self, path: str, data: bytes):
+        """原子写入文件：先写临时文件再重命名，避免其他流程读到写了一半的图片
 
-                        # 更新等待融合的图片列表
-                        self.waiting_for_merge_images[user_id]["图片列表"] = image_list
+        Args:
+            path: 目标文件路径
+            data: 文件数据
+        """
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        try:
+            # 直接使用底层文件描述符写入，跳过缓冲IO层的额外系统调用（fstat/ioctl/lseek）
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, path)
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
 
-                        # 找到匹配的用户ID后，不再继续检查
-                        break
-                    else:
-                        logger.warning(f"没有有效的图片数据用于融图，用户ID: {user_id}")
-                else:
-                    logger.info(f"用户 {user_id} 已达到最大融图图片数量 {self.max_merge_images} 张")
+    def _write_image_file(self, image_path: str, image_data: bytes, recompress: bool = False):
+        """将图片数据写入文件（在IO线程池中执行）"""
+        try:
+            if recompress:
+                original_size = len(image_data)
+                image_data = self._recompress(image_data)
+                logger.info(f"图片重新编码为JPEG: {original_size} -> {len(image_data)} 字节")
+            self._atomic_write(image_path, image_data)
+        except Exception as e:
+            logger.error(f"保存图片到文件失败: {image_path}, {e}")
+
+    async def _do_edit_and_reply(self, bot: WechatAPIClient, to_wxid: str, conversation_key: str, prompt: str,
+                                 image_data: bytes, source_path: str, at_user: str = None, clean_text: bool = False) -> bool:
+        """编辑图片并回复结果：调用编辑API、保存图片、发送文本和图片、更新会话历史
+
+        Args:
+            bot: 微信API客户端
+            to_wxid: 回复的目标ID
+            conversation_key: 会话标识
+            prompt: 编辑提示词
+            image_data: 要编辑的图片数据
+            source_path: 原图路径，记录到会话历史中
+            at_user: 失败消息需要@的用户，为None时发送普通文本
+            clean_text: 是否清理模型返回文本中多余的空白和首尾引号
+
+        Returns:
+            bool: 是否编辑成功
+        """
+        # 只用文件头魔数校验，不创建PIL对象；损坏的图片会在压缩上传或API调用时报错
+        if not self._looks_like_image(image_data):
+            reply_text = "无法识别要编辑的图片，请重新发送图片"
+            if at_user:
+                await bot.send_at_message(to_wxid, f"\n{reply_text}", [at_user])
+            else:
+                await bot.send_text_message(to_wxid, reply_text)
+            return False
+
+        conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
+        edited_images, text_responses = await self._edit_image(prompt, image_data, conversation_history)
+        edited_images = edited_images or []
+        first_valid_text = next((t for t in text_responses or [] if t), None)
+
+        if not edited_images or not edited_images[0]:
+            # 检查是否有文本响应，可能是内容被拒绝
+            if first_valid_text:
+                # 内容审核拒绝的情况，翻译并转发拒绝消息给用户
+                reply_text = self._translate_gemini_message(first_valid_text)
+                logger.warning(f"API拒绝编辑图片，提示: {first_valid_text}")
             else:
-                logger.info(f"用户 {user_id} 不在等待融图状态")
+                reply_text = "图片编辑失败，请稍后再试或修改描述"
+                logger.error(f"编辑图片失败，未获取到有效的图片数据")
+            if at_user:
+                await bot.send_at_message(to_wxid, f"\n{reply_text}", [at_user])
+            else:
+                await bot.send_text_message(to_wxid, reply_text)
+            return False
+
+        # 保存编辑后的图片
+        edited_image_path = self._new_file_path("edited")
+        logger.info(f"保存编辑后的图片到: {edited_image_path}, 数据大小: {len(edited_images[0])} 字节")
+        edited_image_path = self._persist_image(edited_image_path, edited_images[0])
+
+        # 更新最后生成的图片路径
+        self.last_images[conversation_key] = edited_image_path
 
-    async def _get_recent_image(self, chat_id: str, user_id: str) -> Optional[bytes]:
-        """获取最近的图片
+        # 发送文本回复（如果有）
+        reply_text = self._format_edit_reply(first_valid_text, clean_text=clean_text)
+        await self._send_text_and_image(bot, to_wxid, reply_text, edited_images[0])
+
+        # 更新会话历史和时间戳
+        self._record_edit_turn(conversation_key, conversation_history, prompt, source_path,
+                               first_valid_text, edited_image_path)
+        return True
+
+    @staticmethod
+    def _format_edit_reply(text: Optional[str], points_msg: str = "", clean_text: bool = True) -> str:
+        """构建编辑图片成功后随图片发送的文本
 
         Args:
-            chat_id: 聊天ID
-            user_id: 用户ID
+            text: 模型返回的第一段有效文本
+            points_msg: 积分扣除提示，没有时为空字符串
+            clean_text: 是否合并连续空白并移除首尾引号
 
         Returns:
-            Optional[bytes]: 图片数据，如果没有则返回None
+            str: 消息文本，没有模型文本时使用"图片编辑成功！"提示
         """
-        try:
-            # 检查会话是否活跃
-            conversation_key = f"{chat_id}_{user_id}"
-            if conversation_key not in self.conversations:
-                # 会话已经结束，不返回任何图片
-                logger.info(f"会话 {conversation_key} 已结束或不存在，不返回任何图片")
-                return None
+        if not text:
+            return f"图片编辑成功！{points_msg}"
+        if clean_text:
+            # 清理文本，将多个连续空白合并为单个空格（split/join在C层一次完成），并移除首尾引号
+            text = " ".join(text.split())
+            if text.startswith('"') and text.endswith('"'):
+                text = text[1:-1]
+        # 构建消息文本，避免在没有积分消息时添加多余的换行
+        return f"{text}\n\n{points_msg}" if points_msg else text
+
+    def _record_generate_turn(self, conversation_key: str, conversation_history, user_message: dict,
+                              parts_list: List[Dict], image_paths: List[str]):
+        """把一轮图片生成写入会话历史并更新会话时间戳
+
+        助手消息按API返回的原始顺序保存文本和图片路径；历史为带maxlen的deque，
+        追加时自动丢弃最早的消息
 
-            # 清理过期缓存
-            self._cleanup_image_cache()
+        Args:
+            conversation_key: 会话标识
+            conversation_history: 会话历史
+            user_message: 本轮用户消息
+            parts_list: API返回的文本和图片部分，格式为 {"type": "text"/"image", "content": ...}
+            image_paths: 已保存的图片路径，与parts_list中的图片按顺序对应
+        """
+        # 按照原始顺序添加文本和图片
+        assistant_parts = []
+        image_iter = iter(image_paths)
+        for part in parts_list:
+            if part["type"] == "text":
+                assistant_parts.append({"text": part["content"]})
+            elif part["type"] == "image":
+                image_path = next(image_iter, None)
+                if image_path is not None:
+                    assistant_parts.append({"image_url": image_path})
+
+        # 如果没有文本，添加默认文本
+        if not any("text" in p for p in assistant_parts):
+            assistant_parts.insert(0, {"text": "我已基于您的提示生成了图片"})
+
+        conversation_history.append(user_message)
+        conversation_history.append({
+            "role": "model",
+            "parts": assistant_parts
+        })
+        self.conversations[conversation_key] = conversation_history
 
-            # 尝试从缓存中获取图片
-            for key, cache_data in self.image_cache.items():
-                # 检查是否是当前聊天的图片
-                if key[0] == chat_id or key[1] == user_id:
-                    return cache_data["content"]
+        # 更新会话时间戳
+        self._touch_conversation(conversation_key)
 
-            # 如果没有找到，尝试从最后生成的图片中获取
-            if conversation_key in self.last_images:
-                image_path = self.last_images[conversation_key]
-                if os.path.exists(image_path):
-                    with open(image_path, "rb") as f:
-                        return f.read()
+    def _record_edit_turn(self, conversation_key: str, conversation_history, prompt: str, source_path: str,
+                          reply_text: Optional[str], edited_image_path: str, default_reply: str = "我已编辑完成图片"):
+        """把一轮图片编辑写入会话历史并更新会话时间戳
 
-            return None
+        历史为带maxlen的deque，追加时自动丢弃最早的消息，无需再切片截断
+
+        Args:
+            conversation_key: 会话标识
+            conversation_history: 会话历史
+            prompt: 用户的编辑提示词
+            source_path: 被编辑的原图路径
+            reply_text: 模型返回的文本，没有时使用default_reply
+            edited_image_path: 编辑后的图片路径
+            default_reply: 模型没有返回文本时记录的回复
+        """
+        conversation_history.append({
+            "role": "user",
+            "parts": [
+                {"text": prompt},
+                {"image_url": source_path}
+            ]
+        })
+        conversation_history.append({
+            "role": "model",
+            "parts": [
+                {"text": reply_text if reply_text else default_reply},
+                {"image_url": edited_image_path}
+            ]
+        })
+        self.conversations[conversation_key] = conversation_history
+
+        # 更新会话时间戳
+        self._touch_conversation(conversation_key)
+
+    @staticmethod
+    def _json_payload(data: dict) -> bytes:
+        """把请求数据序列化为紧凑的UTF-8 JSON字节串
+
+        请求体主要是大段Base64图片数据，预先序列化一次后在重试中复用，
+        避免aiohttp每次发送都重新调用json.dumps
+
+        Args:
+            data: 请求数据
+
+        Returns:
+            bytes: JSON请求体
+        """
+        if orjson is not None:
+            # orjson直接输出紧凑的UTF-8字节串，序列化数MB的Base64字符串也快得多
+            return orjson.dumps(data)
+        # 保持默认的ensure_ascii：中文转义为\uXXXX后整个JSON字符串都是ASCII，按单字节存储；
+        # 否则只要提示词含中文，数MB的Base64字符串就会被整体放宽为每字符两字节，峰值内存翻倍
+        return json.dumps(data, separators=(",", ":")).encode("ascii")
+
+    @staticmethod
+    def _json_loads(body: Union[str, bytes]):
+        """解析API响应JSON，安装了orjson时使用orjson
+
+        orjson.JSONDecodeError是json.JSONDecodeError的子类，调用方原有的异常处理不需要修改
+
+        Args:
+            body: 响应内容（str或bytes）
+
+        Returns:
+            解析后的对象
+        """
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+
+    @staticmethod
+    def _request_data_for_log(data: dict) -> str:
+        """把请求数据转换为便于记录日志的JSON字符串，inlineData中的Base64数据替换为长度信息
+
+        Args:
+            data: 请求数据
+
+        Returns:
+            str: 不含Base64数据的JSON字符串
+        """
+        def redact(part):
+            inline_data = part.get("inlineData")
+            if inline_data is None or "data" not in inline_data:
+                return part
+            return {"inlineData": {**inline_data, "data": f"[BASE64_DATA_{len(inline_data['data'])}bytes]"}}  # 替换为长度信息
+
+        log_data = dict(data)
+        log_data["contents"] = [
+            {**content, "parts": [redact(part) for part in content.get("parts", [])]}
+            for content in data.get("contents", [])
+        ]
+        return json.dumps(log_data, ensure_ascii=False)
+
+    def _model_url(self, model: str) -> str:
+        """获取指定模型的generateContent请求URL，结果按模型名缓存
+
+        Args:
+            model: 模型名称
+
+        Returns:
+            str: 请求URL
+        """
+        url = self._model_urls.get(model)
+        if url is None:
+            url = f"{self.base_url}/v1beta/models/{model}:generateContent"
+            # 检查URL格式是否正确
+            if not url.startswith("http"):
+                logger.warning(f"URL格式可能不正确: {url}")
+                # 尝试修复URL格式
+                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent"
+            self._model_urls[model] = url
+        return url
+
+    async def _request_single_image(self, single_data: dict) -> Optional[bytes]:
+        """单独调用图片生成模型生成一张图片
+
+        分镜脚本中缺少图片的场景各自调用本方法，调用方可以用asyncio.gather并发发送
+
+        Args:
+            single_data: 请求数据
+
+        Returns:
+            Optional[bytes]: 生成的图片数据，失败时返回None
+        """
+        # 构建请求URL
+        single_url = self._image_model_url
+        single_params = {
+            "key": self.api_key
+        }
+
+        retry_count = 0
+        retry_delay = self.initial_retry_delay
+        payload = self._json_payload(single_data)  # 请求体只序列化一次，重试时直接复用
+        try:
+            single_session = await self._get_http_session()
+            if self._scene_request_limit is None:
+                self._scene_request_limit = asyncio.Semaphore(self._scene_request_concurrency)
+            async with self._scene_request_limit:
+                while True:
+                    async with single_session.post(
+                        single_url,
+                        params=single_params,
+                        data=payload,
+                        proxy=self._proxy,
+                        timeout=self._api_timeout
+                    ) as single_response:
+                        single_response_body = await single_response.read()
+
+                        if single_response.status != 200:
+                            logger.error(f"单独生成图片 API 调用失败 (状态码: {single_response.status}): {single_response_body[:200].decode('utf-8', 'replace')}...")
+                            # 多个场景并发请求时容易触发限流，可重试的状态码按指数退避重试
+                            if single_response.status in self._retry_status_codes and retry_count < self.max_retries:
+                                retry_count += 1
+                                logger.info("第 {} 次重试单独生成图片，等待 {} 秒", retry_count, retry_delay)
+                                await asyncio.sleep(retry_delay)
+                                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                continue
+                            return None
+
+                        single_result = self._json_loads(single_response_body)
+                        single_candidates = single_result.get("candidates", [])
+                        if not single_candidates:
+                            logger.warning(f"单独生成图片失败，API 响应中没有候选结果")
+                            return None
+
+                        single_parts = single_candidates[0].get("content", {}).get("parts", [])
+                        _, single_image = self._extract_text_and_image(single_parts)
+                        if single_image:
+                            return single_image
+
+                        logger.warning(f"单独生成图片失败，API 响应中没有图片数据")
+                        return None
         except Exception as e:
-            logger.error(f"获取最近图片失败: {str(e)}")
+            logger.error(f"单独生成图片异常: {str(e)}")
             logger.error(traceback.format_exc())
             return None
 
+    def _extract_character_description(self, first_prompt: str) -> str:
+        """从第一个场景的提示词中提取人物/主体描述，用于保持后续场景的一致性
+
+        Args:
+            first_prompt: 第一个场景的提示词
+
+        Returns:
+            str: 人物描述，没有提示词时返回空字符串
+        """
+        character_description = ""
+        logger.info(f"分析第一个场景的提示词以提取人物描述: {first_prompt[:100]}...")
+
+        # 查找主要人物/对象描述部分
+        character_markers = [
+            "**主要人物/对象描述**",
+            "主要人物/对象描述",
+            "**主体对象：**",
+            "主体对象：",
+            "**人物描述：**",
+            "人物描述：",
+            "**人物特征：**",
+            "人物特征：",
+            "**角色描述：**",
+            "角色描述："
+        ]
+
+        for marker in character_markers:
+            if marker in first_prompt:
+                logger.info(f"在第一个场景中找到标记: {marker}")
+                parts = first_prompt.split(marker, 1)
+                if len(parts) > 1:
+                    # 提取人物描述部分
+                    desc_part = parts[1].strip()
+                    # 查找下一个标记
+                    next_markers = [
+                        "**场景：", "**故事内容", "**1. 图片内容概述",
+                        "**场景环境：**", "场景环境：", "**背景：**", "背景：",
+                        "**气氛：**", "气氛：", "**风格：**", "风格："
+                    ]
+                    end_pos = len(desc_part)
+                    for next_marker in next_markers:
+                        pos = desc_part.find(next_marker)
+                        if pos != -1 and pos < end_pos:
+                            end_pos = pos
+
+                    character_description = desc_part[:end_pos].strip()
+                    logger.info(f"从第一个场景提取到人物描述: {character_description[:100]}...")
+                    break
+
+        # 如果没有找到明确的人物描述，尝试提取主体对象部分
+        if not character_description:
+            # 查找主体对象部分
+            object_markers = [
+                "**2. 主体对象：**",
+                "**主体对象：**",
+                "主体对象：",
+                "**主体：**",
+                "主体："
+            ]
+
+            for marker in object_markers:
+                if marker in first_prompt:
+                    logger.info(f"在第一个场景中找到主体对象标记: {marker}")
+                    parts = first_prompt.split(marker, 1)
+                    if len(parts) > 1:
+                        # 提取主体对象部分
+                        obj_part = parts[1].strip()
+                        # 查找下一个标记
+                        next_markers = [
+                            "**3. 场景环境：**", "**场景环境：**", "场景环境：",
+                            "**背景：**", "背景：", "**气氛：**", "气氛："
+                        ]
+                        end_pos = len(obj_part)
+                        for next_marker in next_markers:
+                            pos = obj_part.find(next_marker)
+                            if pos != -1 and pos < end_pos:
+                                end_pos = pos
+
+                        character_description = obj_part[:end_pos].strip()
+                        logger.info(f"从第一个场景提取到主体对象描述: {character_description[:100]}...")
+                        break
+
+        # 如果还是没有找到人物描述，尝试使用整个第一个场景的提示词
+        if not character_description and len(first_prompt) > 0:
+            # 使用第一个场景的前100个字符作为人物描述
+            character_description = f"保持与第一个场景相同的风格和一致性"
+            logger.info(f"未找到明确的人物描述，使用通用一致性提示: {character_description}")
+
+        return character_description
+
+    @staticmethod
+    def _b64encode(data) -> str:
+        """Base64编码图片数据并返回字符串，安装了pybase64时使用其SIMD实现
+
+        Args:
+            data: bytes或其他支持缓冲区协议的对象（如mmap）
+
+        Returns:
+            str: Base64字符串
+        """
+        if pybase64 is not None:
+            return pybase64.b64encode_as_string(data)
+        return base64.b64encode(data).decode("ascii")
+
+    @staticmethod
+    def _b64decode(data) -> bytes:
+        """解码Base64图片数据，安装了pybase64时使用其SIMD实现
+
+        Args:
+            data: Base64字符串
+
+        Returns:
+            bytes: 解码后的数据
+        """
+        if pybase64 is not None:
+            return pybase64.b64decode(data)
+        return base64.b64decode(data)
+
+    def _extract_text_and_image(self, parts):
+        """从API响应的parts中取出第一段文本和第一张图片
+
+        只对最终选中的那一段Base64数据解码，不在遍历过程中逐个解码。
+
+        Args:
+            parts: 响应中candidates[0].content.parts列表
+
+        Returns:
+            tuple: (文本内容或None, 图片数据或None)
+        """
+        text_response = next((p["text"] for p in parts if p.get("text")), None)
+        b64 = next((p["inlineData"]["data"] for p in parts if "data" in p.get("inlineData", ())), None)
+        image_data = self._b64decode(b64) if b64 else None
+        return text_response, image_data
+
+    def _prepare_upload(self, image_data: Union[bytes, mmap.mmap]) -> Tuple[Union[bytes, mmap.mmap], str]:
+        """压缩待上传给API的图片
+
+        最长边超过upload_max_edge或数据超过upload_max_bytes时缩放并重新编码：
+        不透明图片转为JPEG，带透明通道的保持PNG；否则原样返回
+
+        Args:
+            image_data: 原始图片数据，也可以是图片文件的mmap（原样返回时调用方需在mmap关闭前使用）
+
+        Returns:
+            Tuple[Union[bytes, mmap.mmap], str]: (上传用的图片数据, MIME类型)
+        """
+        mime_type = "image/jpeg" if image_data[:3] == b"\xff\xd8\xff" else "image/png"
+        # mmap本身支持read/seek，PIL可以直接读取，无需再复制一份到BytesIO
+        source = image_data if isinstance(image_data, mmap.mmap) else BytesIO(image_data)
+        try:
+            with Image.open(source) as img:
+                mime_type = Image.MIME.get(img.format, mime_type)
+                if max(img.size) <= self.upload_max_edge and len(image_data) <= self.upload_max_bytes:
+                    return image_data, mime_type
+
+                img.thumbnail((self.upload_max_edge, self.upload_max_edge), Image.LANCZOS)
+                output = BytesIO()
+                if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                    img.save(output, format="PNG", optimize=True)
+                    new_mime_type = "image/png"
+                else:
+                    img.convert("RGB").save(output, format="JPEG", quality=85, optimize=True)
+                    new_mime_type = "image/jpeg"
+
+            compressed_data = output.getvalue()
+            if len(compressed_data) >= len(image_data):
+                return image_data, mime_type
+            logger.info(f"上传图片已压缩: {len(image_data)} -> {len(compressed_data)} 字节")
+            return compressed_data, new_mime_type
+        except Exception as e:
+            logger.warning(f"压缩上传图片失败，使用原图: {e}")
+            return image_data, mime_type
+
+    async def _history_image_part(self, image_path: str) -> dict:
+        """把会话历史中的图片文件转换为inlineData格式
+
+        插件刚保存的图片直接使用内存中的数据；其他图片通过mmap直接对文件内容做Base64编码，
+        避免先read()出一份完整的字节副本；压缩和编码在线程池中进行，避免阻塞事件循环；
+        编码结果按(路径, 修改时间)缓存，连续对话中同一张历史图片只编码一次
+
+        Args:
+            image_path: 图片文件路径
+
+        Returns:
+            dict: inlineData格式的请求片段
+        """
+        image_data = self._recent_image_bytes.get(image_path)
+        # 插件保存的图片路径带时间戳和随机数，不会被覆盖，内存中有数据时不必stat文件（后台写入也可能尚未完成）
+        cache_key = (image_path, None) if image_data is not None else (image_path, os.path.getmtime(image_path))
+        cached_part = self._history_part_cache.get(cache_key)
+        if cached_part is not None:
+            self._history_part_cache.move_to_end(cache_key)
+            return cached_part
+
+        if image_data is not None:
+            # 连续编辑时上一轮的结果图既是历史中的模型图片，又是本轮待编辑的图片；
+            # 与待上传图片共用按内容摘要的缓存，同一张图片只压缩编码一次
+            part = await self._upload_image_part(image_data)
+        else:
+            part = await self._run_io(self._encode_history_file, image_path)
+
+        self._history_part_cache[cache_key] = part
+        while len(self._history_part_cache) > self._history_part_cache_max_entries:
+            self._history_part_cache.popitem(last=False)
+        return part
+
+    def _encode_history_file(self, image_path: str) -> dict:
+        """从mmap读取历史图片文件并编码为inlineData格式的请求片段"""
+        if os.path.getsize(image_path) > self.upload_max_bytes:
+            # 较大的历史图片（例如用户上传的原图）先压缩再编码，同样从mmap读取
+            with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                upload_data, mime_type = self._prepare_upload(mapped)
+                image_base64 = self._b64encode(upload_data)
+        else:
+            with open(image_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                image_base64 = self._b64encode(mapped)
+            mime_type = "image/jpeg" if image_path.endswith((".jpg", ".jpeg")) else "image/png"
+        return {
+            "inlineData": {
+                "mimeType": mime_type,
+                "data": image_base64
+            }
+        }
+
+    @staticmethod
+    def _image_digest(image_data: bytes) -> bytes:
+        """计算图片内容摘要，用作按图片内容缓存的键"""
+        return hashlib.blake2b(image_data, digest_size=16).digest()
+
+    async def _upload_image_part(self, image_data: bytes, digest: bytes = None) -> dict:
+        """把待上传的图片（编辑、分析、反推）压缩并转换为inlineData格式
+
+        压缩和Base64编码在线程池中进行，避免阻塞事件循环；
+        编码结果按图片内容摘要缓存，同一张图片（反复编辑同一张引用图、先分析再编辑、失败后重试）只处理一次
+
+        Args:
+            image_data: 图片数据
+            digest: 调用方已算好的图片内容摘要，省去重复计算
+
+        Returns:
+            dict: inlineData格式的请求片段
+        """
+        cache_key = digest or self._image_digest(image_data)
+        cached_part = self._upload_part_cache.get(cache_key)
+        if cached_part is not None:
+            self._upload_part_cache.move_to_end(cache_key)
+            return cached_part
+
+        part = await self._run_io(self._encode_upload_part, image_data)
+        self._upload_part_cache_put(cache_key, part)
+        return part
+
+    def _encode_upload_part(self, image_data: bytes) -> dict:
+        """压缩图片并编码为inlineData格式的请求片段"""
+        upload_data, mime_type = self._prepare_upload(image_data)
+        return {
+            "inlineData": {
+                "mimeType": mime_type,
+                "data": self._b64encode(upload_data)
+            }
+        }
+
+    def _upload_part_cache_put(self, cache_key: bytes, part: dict):
+        """写入按图片内容摘要缓存的请求片段，超出上限时淘汰最久未使用的条目"""
+        self._upload_part_cache[cache_key] = part
+        while len(self._upload_part_cache) > self._upload_part_cache_max_entries:
+            self._upload_part_cache.popitem(last=False)
+
+    async def _send_image_reply(self, bot: WechatAPIClient, to_wxid: str, image_data: bytes):
+        """直接发送内存中的图片数据
+
+        图片在发送前已经落盘用于会话历史（last_images），这里不再重新打开文件读取，
+        避免每条消息多一次完整的读盘操作。
+
+        Args:
+            bot: 微信API客户端
+            to_wxid: 接收者ID
+            image_data: 图片数据
+        """
+        await bot.send_image_message(to_wxid, image_data)
+
+    async def _send_text_and_image(self, bot: WechatAPIClient, to_wxid: str, text: str, image_data: bytes):
+        """发送图片，有实际文本内容时先发送文本
+
+        微信接口没有图文合并发送，也不支持图片附带说明文字，文本和图片仍分两条消息发送。
+        文本发送完成后立即发送图片，保证文本先于图片到达，不再额外等待固定延迟。
+
+        Args:
+            bot: 微信API客户端
+            to_wxid: 接收者ID
+            text: 随图片发送的文本，为空时只发送图片
+            image_data: 图片数据
+        """
+        if text and text.strip():
+            await bot.send_text_message(to_wxid, text)
+
+        await self._send_image_reply(bot, to_wxid, image_data)
+
+    def _cleanup_temp_files(self):
+        """清理临时文件"""
+        try:
+            # 超过24小时未修改的文件视为过期
+            deadline = time.time() - 24 * 3600
+            # scandir返回的目录项自带文件类型，每个文件只需一次stat
+            with os.scandir(self.save_dir) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.stat().st_mtime < deadline:
+                        try:
+                            os.remove(entry.path)
+                            logger.info(f"已删除过期临时文件: {entry.path}")
+                        except Exception as e:
+                            logger.error(f"删除临时文件失败: {str(e)}")
+        except Exception as e:
+            logger.error(f"清理临时文件失败: {str(e)}")
+            logger.error(traceback.format_exc())
+
     def _is_multi_image_request(self, text: str) -> bool:
         """检测是否是多图文请求
 
@@ -3667,6 +4059,11 @@ class GeminiImage(PluginBase):
         if not text or not isinstance(text, str):
             return False
 
+        # 下面的关键词和正则都至少包含一个中文字符，纯ASCII的文本（如英文提示词）不可能匹配；
+        # str.isascii() 直接读取字符串对象的内部标志，是O(1)操作，无需扫描文本
+        if text.isascii():
+            return False
+
         # 多图文请求的关键词和模式
         multi_image_keywords = [
             # 多个场景/图片相关
@@ -3748,15 +4145,7 @@ class GeminiImage(PluginBase):
         """
         try:
             # 使用多图文系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.prompt_model}:generateContent"
-            # 检查URL格式是否正确
-            if not url.startswith("http"):
-                logger.warning(f"URL格式可能不正确: {url}")
-                # 尝试修复URL格式
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.prompt_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.prompt_model)
 
             params = {
                 "key": self.api_key
@@ -3776,14 +4165,7 @@ class GeminiImage(PluginBase):
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": MULTI_IMAGE_SYSTEM_PROMPT
-                        }
-                    ]
-                },
+                "systemInstruction": self._system_instruction(MULTI_IMAGE_SYSTEM_PROMPT),
                 "generationConfig": {
                     "temperature": 0.9,
                     "topP": 0.95,
@@ -3794,57 +4176,56 @@ class GeminiImage(PluginBase):
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
-            while retry_count <= self.max_retries:
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            enhanced_prompt = part["text"]
-                                            logger.info(f"多图文分镜脚本生成成功，长度: {len(enhanced_prompt)}")
-                                            # 添加明确的指示，确保生成图片
-                                            enhanced_prompt += "\n\n请生成上述场景的图片，确保在回复中包含图片。"
-                                            return enhanced_prompt
-
-                                return prompt  # 如果无法解析响应，返回原始提示词
-                            else:
-                                logger.error(f"生成多图文分镜脚本API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试生成多图文分镜脚本，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
+            while retry_count <= self.max_retries:
+                try:
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
+
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        enhanced_prompt = part["text"]
+                                        logger.info(f"多图文分镜脚本生成成功，长度: {len(enhanced_prompt)}")
+                                        # 添加明确的指示，确保生成图片
+                                        enhanced_prompt += "\n\n请生成上述场景的图片，确保在回复中包含图片。"
+                                        return enhanced_prompt
+
+                            return prompt  # 如果无法解析响应，返回原始提示词
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"生成多图文分镜脚本API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试生成多图文分镜脚本，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return prompt  # 返回原始提示词
+                            return prompt  # 返回原始提示词
                 except Exception as e:
                     logger.error(f"生成多图文分镜脚本异常: {str(e)}")
 
@@ -3931,7 +4312,7 @@ class GeminiImage(PluginBase):
                 logger.info(f"使用模式 {i+1} 找到 {len(matches)} 个中文提示词")
                 for match in matches:
                     # 清理提示词，移除多余的空白字符和换行符
-                    cleaned_match = re.sub(r'\s+', ' ', match).strip()
+                    cleaned_match = " ".join(match.split())
                     if cleaned_match and cleaned_match not in chinese_prompts:  # 避免重复
                         chinese_prompts.append(cleaned_match)
 
@@ -3947,7 +4328,7 @@ class GeminiImage(PluginBase):
                 if matches:
                     logger.info(f"找到 {len(matches)} 个英文提示词")
                     for match in matches:
-                        cleaned_match = re.sub(r'\s+', ' ', match).strip()
+                        cleaned_match = " ".join(match.split())
                         if cleaned_match:
                             # 标记为英文提示词，后续处理可能需要翻译
                             chinese_prompts.append(f"[英文提示词] {cleaned_match}")
@@ -3971,33 +4352,6 @@ class GeminiImage(PluginBase):
 
         return chinese_prompts
 
-    def _translate_gemini_message(self, message: str) -> str:
-        """翻译Gemini的错误消息"""
-        if not message:
-            return ""
-
-        # 常见的拒绝消息模式
-        rejection_patterns = {
-            r"I cannot generate": "我无法生成",
-            r"I'm unable to generate": "我无法生成",
-            r"I apologize": "很抱歉",
-            r"I'm sorry": "很抱歉",
-            r"violates our content policy": "违反了内容政策",
-            r"harmful content": "有害内容",
-            r"inappropriate content": "不适当的内容",
-            r"content policy": "内容政策",
-            r"safety guidelines": "安全准则",
-            r"cannot fulfill": "无法满足",
-            r"cannot create": "无法创建",
-            r"cannot provide": "无法提供",
-        }
-
-        translated = message
-        for pattern, replacement in rejection_patterns.items():
-            translated = re.sub(pattern, replacement, translated, flags=re.IGNORECASE)
-
-        return translated
-
     def _clean_response_text(self, text: str) -> str:
         """清理响应文本，移除对话式语句"""
         if not text:
@@ -4037,18 +4391,10 @@ class GeminiImage(PluginBase):
                 return await self._enhance_edit_prompt(prompt)
 
             # 使用标准系统提示词增强提示词
-            url = f"{self.base_url}/v1beta/models/{self.prompt_model}:generateContent"
-            # 检查URL格式是否正确
-            if not url.startswith("http"):
-                logger.warning(f"URL格式可能不正确: {url}")
-                # 尝试修复URL格式
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.prompt_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.prompt_model)
 
             # 获取会话ID
-            session_id = f"enhance_{uuid.uuid4().hex[:8]}"  # 为提示词增强生成一个唯一的会话ID
+            session_id = f"enhance_{random.getrandbits(32):08x}"  # 为提示词增强生成一个唯一的会话ID
 
             # 获取API密钥
             api_key = self.get_api_key_for_session(session_id)
@@ -4068,77 +4414,69 @@ class GeminiImage(PluginBase):
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": STANDARD_SYSTEM_PROMPT
-                        }
-                    ]
-                }
+                "systemInstruction": self._system_instruction(STANDARD_SYSTEM_PROMPT)
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return prompt  # 如果无法解析响应，返回原始提示词
-                            else:
-                                logger.error(f"增强提示词API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试增强提示词，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        return part["text"]
+
+                            return prompt  # 如果无法解析响应，返回原始提示词
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"增强提示词API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试增强提示词，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return prompt  # 返回原始提示词
+                            return prompt  # 返回原始提示词
                 except Exception as e:
                     logger.error(f"增强提示词异常: {str(e)}")
 
@@ -4165,18 +4503,10 @@ class GeminiImage(PluginBase):
         """直接生成详细提示词，用于提示词生成功能"""
         try:
             # 使用详细输出系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.prompt_model}:generateContent"
-            # 检查URL格式是否正确
-            if not url.startswith("http"):
-                logger.warning(f"URL格式可能不正确: {url}")
-                # 尝试修复URL格式
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.prompt_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.prompt_model)
 
             # 获取会话ID
-            session_id = f"enhance_direct_{uuid.uuid4().hex[:8]}"  # 为直接提示词增强生成一个唯一的会话ID
+            session_id = f"enhance_direct_{random.getrandbits(32):08x}"  # 为直接提示词增强生成一个唯一的会话ID
 
             # 获取API密钥
             api_key = self.get_api_key_for_session(session_id)
@@ -4196,77 +4526,69 @@ class GeminiImage(PluginBase):
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": DETAILED_SYSTEM_PROMPT if detailed_output else STANDARD_SYSTEM_PROMPT
-                        }
-                    ]
-                }
+                "systemInstruction": self._system_instruction(DETAILED_SYSTEM_PROMPT if detailed_output else STANDARD_SYSTEM_PROMPT)
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return None  # 如果无法解析响应，返回None
-                            else:
-                                logger.error(f"生成提示词API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试生成提示词，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        return part["text"]
+
+                            return None  # 如果无法解析响应，返回None
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"生成提示词API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试生成提示词，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return None  # 返回None
+                            return None  # 返回None
                 except Exception as e:
                     logger.error(f"生成提示词异常: {str(e)}")
 
@@ -4311,18 +4633,10 @@ class GeminiImage(PluginBase):
 
         try:
             # 使用编辑图像系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.prompt_model}:generateContent"
-            # 检查URL格式是否正确
-            if not url.startswith("http"):
-                logger.warning(f"URL格式可能不正确: {url}")
-                # 尝试修复URL格式
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.prompt_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.prompt_model)
 
             # 获取会话ID
-            session_id = f"enhance_edit_{uuid.uuid4().hex[:8]}"  # 为编辑提示词增强生成一个唯一的会话ID
+            session_id = f"enhance_edit_{random.getrandbits(32):08x}"  # 为编辑提示词增强生成一个唯一的会话ID
 
             # 获取API密钥
             api_key = self.get_api_key_for_session(session_id)
@@ -4356,66 +4670,65 @@ class GeminiImage(PluginBase):
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return prompt  # 如果无法解析响应，返回原始提示词
-                            else:
-                                logger.error(f"增强编辑提示词API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试增强编辑提示词，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        return part["text"]
+
+                            return prompt  # 如果无法解析响应，返回原始提示词
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"增强编辑提示词API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试增强编辑提示词，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return prompt  # 返回原始提示词
+                            return prompt  # 返回原始提示词
                 except Exception as e:
                     logger.error(f"增强编辑提示词异常: {str(e)}")
 
@@ -4446,15 +4759,13 @@ class GeminiImage(PluginBase):
             user_query: 用户指定的分析问题
             message_info: 消息相关信息，包含user_id等
         """
+        # 只用文件头魔数校验，不是图片时不必压缩编码、调用API
+        if not self._looks_like_image(image_data):
+            logger.warning("图片分析收到的数据不是可识别的图片，大小: {} 字节", len(image_data) if image_data else 0)
+            return None
         try:
-            # 将图片数据转换为Base64编码
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
-
             # 使用图片分析系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.analysis_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.analysis_model)
 
             # 获取会话ID
             session_id = ""
@@ -4485,23 +4796,12 @@ class GeminiImage(PluginBase):
                 # 如果没有找到，尝试使用其他可能的键
                 if not user_query and self.waiting_for_analyze_image_query:
                     logger.info(f"使用user_id={user_id}未找到分析问题，尝试其他可能的键")
-                    # 尝试使用消息中的其他ID
-                    possible_keys = [
-                        message_info.get("chat_id", ""),
-                        message_info.get("from_wxid", ""),
-                        message_info.get("sender_wxid", "")
-                    ]
-
-                    # 记录所有可能的键和waiting_for_analyze_image_query的内容
-                    logger.info(f"可能的键: {possible_keys}")
-                    logger.info(f"waiting_for_analyze_image_query: {self.waiting_for_analyze_image_query}")
-
-                    # 尝试所有可能的键
-                    for key in possible_keys:
-                        if key and key in self.waiting_for_analyze_image_query:
-                            user_query = self.waiting_for_analyze_image_query[key]
-                            logger.info(f"使用键 {key} 找到用户分析问题: {user_query}")
-                            break
+                    # 尝试使用消息中的其他ID，取第一个存在的键
+                    key = next((message_info[name] for name in ("chat_id", "from_wxid", "sender_wxid")
+                                if message_info.get(name) and message_info[name] in self.waiting_for_analyze_image_query), None)
+                    if key is not None:
+                        user_query = self.waiting_for_analyze_image_query[key]
+                        logger.info(f"使用键 {key} 找到用户分析问题: {user_query}")
 
                     # 如果仍然没有找到，使用字典中的第一个非空值
                     if not user_query:
@@ -4519,31 +4819,31 @@ class GeminiImage(PluginBase):
                 user_text = "请用中文分析这张图片"
                 logger.info("使用默认分析提示")
 
+            # 相同图片、相同问题直接返回缓存的分析结果，省去编码上传和一次API调用
+            digest = self._image_digest(image_data)
+            cache_key = (self.analysis_model, digest, user_text)
+            cached = self._analysis_cache.get(cache_key)
+            if cached is not None:
+                self._analysis_cache.move_to_end(cache_key)
+                logger.info("图片分析命中缓存")
+                return cached
+
+            # 将图片数据转换为Base64编码（与编辑共用缓存，同一张图片只压缩编码一次）
+            image_part = await self._upload_image_part(image_data, digest)
+
             data = {
                 "contents": [
                     {
                         "role": "user",
                         "parts": [
-                            {
-                                "inlineData": {
-                                    "mimeType": "image/png",
-                                    "data": image_base64
-                                }
-                            },
+                            image_part,
                             {
                                 "text": user_text
                             }
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": IMAGE_ANALYSIS_PROMPT
-                        }
-                    ]
-                },
+                "systemInstruction": self._system_instruction(IMAGE_ANALYSIS_PROMPT),
                 "generationConfig": {
                     "temperature": 0.4,
                     "topP": 0.95,
@@ -4552,66 +4852,68 @@ class GeminiImage(PluginBase):
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return None  # 如果无法解析响应，返回None
-                            else:
-                                logger.error(f"图片分析API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试图片分析，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        self._analysis_cache[cache_key] = part["text"]
+                                        while len(self._analysis_cache) > self._analysis_cache_max_entries:
+                                            self._analysis_cache.popitem(last=False)
+                                        return part["text"]
+
+                            return None  # 如果无法解析响应，返回None
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"图片分析API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试图片分析，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return None  # 返回None
+                            return None  # 返回None
                 except Exception as e:
                     logger.error(f"图片分析异常: {str(e)}")
 
@@ -4636,18 +4938,19 @@ class GeminiImage(PluginBase):
 
     async def _reverse_image(self, image_data: bytes) -> Optional[str]:
         """从图片生成详细提示词"""
+        # 只用文件头魔数校验，不是图片时不必压缩编码、调用API
+        if not self._looks_like_image(image_data):
+            logger.warning("反向提示词收到的数据不是可识别的图片，大小: {} 字节", len(image_data) if image_data else 0)
+            return None
         try:
-            # 将图片数据转换为Base64编码
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
+            # 将图片数据转换为Base64编码（与编辑共用缓存，同一张图片只压缩编码一次）
+            image_part = await self._upload_image_part(image_data)
 
             # 使用反向提示词系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.reverse_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.reverse_model)
 
             # 获取会话ID
-            session_id = f"reverse_{uuid.uuid4().hex[:8]}"  # 为反向提示词生成一个唯一的会话ID
+            session_id = f"reverse_{random.getrandbits(32):08x}"  # 为反向提示词生成一个唯一的会话ID
 
             # 获取API密钥
             api_key = self.get_api_key_for_session(session_id)
@@ -4661,86 +4964,73 @@ class GeminiImage(PluginBase):
                     {
                         "role": "user",
                         "parts": [
-                            {
-                                "inlineData": {
-                                    "mimeType": "image/png",
-                                    "data": image_base64
-                                }
-                            }
+                            image_part
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": REVERSE_PROMPT
-                        }
-                    ]
-                }
+                "systemInstruction": self._system_instruction(REVERSE_PROMPT)
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return None  # 如果无法解析响应，返回None
-                            else:
-                                logger.error(f"反向提示词API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试反向提示词，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        return part["text"]
+
+                            return None  # 如果无法解析响应，返回None
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"反向提示词API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试反向提示词，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return None  # 返回None
+                            return None  # 返回None
                 except Exception as e:
                     logger.error(f"反向提示词异常: {str(e)}")
 
@@ -4777,13 +5067,10 @@ class GeminiImage(PluginBase):
 
         try:
             # 使用融图系统提示词
-            url = f"{self.base_url}/v1beta/models/{self.prompt_model}:generateContent"
-            headers = {
-                "Content-Type": "application/json",
-            }
+            url = self._model_url(self.prompt_model)
 
             # 获取会话ID
-            session_id = f"enhance_{uuid.uuid4().hex[:8]}"  # 为提示词增强生成一个唯一的会话ID
+            session_id = f"enhance_{random.getrandbits(32):08x}"  # 为提示词增强生成一个唯一的会话ID
 
             # 获取API密钥
             api_key = self.get_api_key_for_session(session_id)
@@ -4803,77 +5090,69 @@ class GeminiImage(PluginBase):
                         ]
                     }
                 ],
-                "systemInstruction": {
-                    "role": "system",
-                    "parts": [
-                        {
-                            "text": MERGE_IMAGE_SYSTEM_PROMPT
-                        }
-                    ]
-                }
+                "systemInstruction": self._system_instruction(MERGE_IMAGE_SYSTEM_PROMPT)
             }
 
             # 创建代理配置
-            proxy = None
-            if self.enable_proxy and self.proxy_url:
-                proxy = self.proxy_url
+            proxy = self._proxy
 
             # 使用重试机制
             retry_count = 0
             retry_delay = self.initial_retry_delay
 
+            payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
             while retry_count <= self.max_retries:
                 try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(
-                            url,
-                            headers=headers,
-                            params=params,
-                            json=data,
-                            proxy=proxy,
-                            timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                        ) as response:
-                            response_text = await response.text()
-
-                            if response.status == 200:
-                                result = json.loads(response_text)
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    for part in parts:
-                                        if "text" in part and part["text"]:
-                                            return part["text"]
-
-                                return prompt  # 如果无法解析响应，返回原始提示词
-                            else:
-                                logger.error(f"增强融图提示词API调用失败 (状态码: {response.status}): {response_text}")
-
-                                # 如果是API密钥错误，尝试切换密钥
-                                if response.status == 400 and "API key not valid" in response_text:
-                                    logger.warning("API密钥无效，尝试切换密钥")
-                                    # 标记当前密钥出错，并获取新密钥
-                                    new_api_key = self.mark_api_key_error(api_key, session_id)
-                                    if new_api_key and new_api_key != api_key:
-                                        # 更新请求参数中的API密钥
-                                        api_key = new_api_key
-                                        params["key"] = api_key
-                                        logger.info("已切换到新的API密钥")
-                                        # 不增加重试计数，直接使用新密钥重试
-                                        continue
+                    session = await self._get_http_session()
+                    async with session.post(
+                        url,
+                        params=params,
+                        data=payload,
+                        proxy=proxy,
+                        timeout=self._api_timeout
+                    ) as response:
+                        response_body = await response.read()
 
-                                # 检查是否是可重试的错误
-                                if response.status in [429, 500, 502, 503, 504]:
-                                    retry_count += 1
-                                    if retry_count <= self.max_retries:
-                                        logger.info(f"第 {retry_count} 次重试增强融图提示词，等待 {retry_delay} 秒")
-                                        await asyncio.sleep(retry_delay)
-                                        # 指数退避策略
-                                        retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                        continue
+                        if response.status == 200:
+                            result = self._json_loads(response_body)
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                for part in parts:
+                                    if "text" in part and part["text"]:
+                                        return part["text"]
+
+                            return prompt  # 如果无法解析响应，返回原始提示词
+                        else:
+                            response_text = response_body.decode("utf-8", "replace")
+                            logger.error(f"增强融图提示词API调用失败 (状态码: {response.status}): {response_text}")
+
+                            # 如果是API密钥错误，尝试切换密钥
+                            if response.status == 400 and "API key not valid" in response_text:
+                                logger.warning("API密钥无效，尝试切换密钥")
+                                # 标记当前密钥出错，并获取新密钥
+                                new_api_key = self.mark_api_key_error(api_key, session_id)
+                                if new_api_key and new_api_key != api_key:
+                                    # 更新请求参数中的API密钥
+                                    api_key = new_api_key
+                                    params["key"] = api_key
+                                    logger.info("已切换到新的API密钥")
+                                    # 不增加重试计数，直接使用新密钥重试
+                                    continue
+
+                            # 检查是否是可重试的错误
+                            if response.status in self._retry_status_codes:
+                                retry_count += 1
+                                if retry_count <= self.max_retries:
+                                    logger.info(f"第 {retry_count} 次重试增强融图提示词，等待 {retry_delay} 秒")
+                                    await asyncio.sleep(retry_delay)
+                                    # 指数退避策略
+                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                    continue
 
-                                return prompt  # 返回原始提示词
+                            return prompt  # 返回原始提示词
                 except Exception as e:
                     logger.error(f"增强融图提示词异常: {str(e)}")
 
@@ -4916,7 +5195,7 @@ class GeminiImage(PluginBase):
             logger.info(f"开始处理融图请求，提示词: {prompt}, 图片数量: {len(image_list)}")
 
             # 增强提示词，使用专门的融图提示词增强
-            enhanced_prompt = await self._enhance_merge_prompt(prompt)
+            enhanced_prompt = await self._enhance_cached("merge", prompt, lambda: self._enhance_merge_prompt(prompt))
             prompt = enhanced_prompt
 
             # 压缩图片以减小请求体大小
@@ -4927,16 +5206,15 @@ class GeminiImage(PluginBase):
                 compressed_images.append(compressed_img)
 
             # 发送提示消息
-            await bot.send_text_message(chat_id, "正在处理融图请求，请稍候...")
+            self._send_notice(bot.send_text_message(chat_id, "正在处理融图请求，请稍候..."))
 
             # 调用API生成融合图片
             image_data, response_text = await self._generate_image_with_multiple_images(prompt, compressed_images)
 
             if image_data:
                 # 保存图片到本地
-                image_path = os.path.join(self.save_dir, f"gemini_merge_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
+                image_path = self._new_file_path("gemini_merge")
+                image_path = self._persist_image(image_path, image_data)
 
                 # 保存最后生成的图片路径
                 self.last_images[conversation_key] = image_path
@@ -4958,15 +5236,14 @@ class GeminiImage(PluginBase):
                         await bot.send_text_message(chat_id, cleaned_text)
                         logger.info(f"使用chat_id发送融图文本响应: {cleaned_text[:100]}...")
 
-                # 发送图片
-                with open(image_path, "rb") as f:
-                    # 尝试使用from_wxid而不是chat_id
-                    if from_wxid:
-                        await bot.send_image_message(from_wxid, f.read())
-                        logger.info(f"使用from_wxid发送融合图片，路径: {image_path}")
-                    else:
-                        await bot.send_image_message(chat_id, f.read())
-                        logger.info(f"使用chat_id发送融合图片，路径: {image_path}")
+                # 发送图片（直接使用内存中的图片数据，无需重新读取文件）
+                # 尝试使用from_wxid而不是chat_id
+                if from_wxid:
+                    await self._send_image_reply(bot, from_wxid, image_data)
+                    logger.info(f"使用from_wxid发送融合图片，路径: {image_path}")
+                else:
+                    await self._send_image_reply(bot, chat_id, image_data)
+                    logger.info(f"使用chat_id发送融合图片，路径: {image_path}")
 
                 # 返回成功信息
                 return True
@@ -5017,10 +5294,10 @@ class GeminiImage(PluginBase):
             # 发送提示消息
             # 尝试使用from_wxid而不是chat_id
             if from_wxid:
-                await bot.send_text_message(from_wxid, "正在分析图片，生成提示词，请稍候...")
+                self._send_notice(bot.send_text_message(from_wxid, "正在分析图片，生成提示词，请稍候..."))
                 logger.info(f"使用from_wxid发送反向提示词生成提示消息")
             else:
-                await bot.send_text_message(chat_id, "正在分析图片，生成提示词，请稍候...")
+                self._send_notice(bot.send_text_message(chat_id, "正在分析图片，生成提示词，请稍候..."))
                 logger.info(f"使用chat_id发送反向提示词生成提示消息")
 
             # 调用反向提示词生成
@@ -5231,6 +5508,22 @@ class GeminiImage(PluginBase):
         # 返回三个部分
         return [analysis_part, chinese_prompt_part, english_prompt_part]
 
+    @staticmethod
+    def _looks_like_image(image_data: bytes) -> bool:
+        """通过文件头魔数快速判断数据是否为常见图片格式（JPEG/PNG/GIF/WEBP/BMP/TIFF）
+
+        Args:
+            image_data: 图片数据
+
+        Returns:
+            bool: 是否像是图片数据
+        """
+        if not image_data:
+            return False
+        if image_data.startswith(b"RIFF"):
+            return image_data[8:12] == b"WEBP"
+        return image_data.startswith((b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF8", b"BM", b"II*\x00", b"MM\x00*"))
+
     async def _compress_image(self, image_data: bytes, max_size: int = 1200, quality: int = 90) -> bytes:
         """压缩图片
 
@@ -5242,6 +5535,10 @@ class GeminiImage(PluginBase):
         Returns:
             bytes: 压缩后的图片数据
         """
+        # 文件头魔数不像图片时PIL必然打开失败，直接返回原始数据，省去一次解析和异常栈记录
+        if not self._looks_like_image(image_data):
+            logger.warning("待压缩的数据不是可识别的图片，跳过压缩")
+            return image_data
         try:
             # 打开图片
             image = Image.open(BytesIO(image_data))
@@ -5282,10 +5579,7 @@ class GeminiImage(PluginBase):
         Returns:
             Tuple[Optional[bytes], Optional[str]]: 生成的图片数据和文本响应
         """
-        url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-        }
+        url = self._image_model_url
 
         params = {
             "key": self.api_key
@@ -5296,7 +5590,7 @@ class GeminiImage(PluginBase):
 
         # 添加所有图片
         for img_data in image_list:
-            img_base64 = base64.b64encode(img_data).decode("utf-8")
+            img_base64 = self._b64encode(img_data)
             parts.append({
                 "inlineData": {
                     "mimeType": "image/jpeg",
@@ -5306,132 +5600,110 @@ class GeminiImage(PluginBase):
 
         # 构建完整请求
         data = {
-            "contents": [{
-                "role": "user",
-                "parts": parts
-            }],
-            "generationConfig": {
-                "responseModalities": ["Text", "Image"]
-            }
-        }
-
-        # 创建代理配置
-        proxy = None
-        if self.enable_proxy and self.proxy_url:
-            proxy = self.proxy_url
-
-        # 使用重试机制
-        retry_count = 0
-        retry_delay = self.initial_retry_delay
-
-        while retry_count <= self.max_retries:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        url,
-                        headers=headers,
-                        params=params,
-                        json=data,
-                        proxy=proxy,
-                        timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                    ) as response:
-                        response_text = await response.text()
-
-                        if response.status == 200:
-                            result = json.loads(response_text)
-
-                            # 提取响应
-                            candidates = result.get("candidates", [])
-                            if candidates and len(candidates) > 0:
-                                content = candidates[0].get("content", {})
-                                parts = content.get("parts", [])
-
-                                # 处理文本和图片响应
-                                text_response = None
-                                image_data = None
+            "contents": [{
+                "role": "user",
+                "parts": parts
+            }],
+            "generationConfig": {
+                "responseModalities": ["Text", "Image"]
+            }
+        }
 
-                                for part in parts:
-                                    # 处理文本部分
-                                    if "text" in part and part["text"]:
-                                        text_response = part["text"]
+        # 创建代理配置
+        proxy = self._proxy
 
-                                    # 处理图片部分
-                                    elif "inlineData" in part:
-                                        inline_data = part.get("inlineData", {})
-                                        if inline_data and "data" in inline_data:
-                                            # 解码图片数据
-                                            image_data = base64.b64decode(inline_data["data"])
-
-                                if not image_data:
-                                    # 如果没有生成图像，尝试使用英文提示词重试
-                                    logger.info("未获取到图像，尝试使用英文提示词重试...")
-                                    english_prompt = f"Please merge these images. {prompt}. Make sure to include the generated image in your response."
-
-                                    # 更新请求体中的提示词
-                                    data["contents"][0]["parts"][0]["text"] = english_prompt
-
-                                    # 重新发送请求
-                                    async with session.post(
-                                        url,
-                                        headers=headers,
-                                        params=params,
-                                        json=data,
-                                        proxy=proxy,
-                                        timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                                    ) as retry_response:
-                                        retry_response_text = await retry_response.text()
-
-                                        if retry_response.status == 200:
-                                            retry_result = json.loads(retry_response_text)
-                                            retry_candidates = retry_result.get("candidates", [])
-                                            if retry_candidates and len(retry_candidates) > 0:
-                                                retry_content = retry_candidates[0].get("content", {})
-                                                retry_parts = retry_content.get("parts", [])
-
-                                                for retry_part in retry_parts:
-                                                    # 处理文本部分
-                                                    if "text" in retry_part and retry_part["text"]:
-                                                        text_response = retry_part["text"]
-
-                                                    # 处理图片部分
-                                                    elif "inlineData" in retry_part:
-                                                        retry_inline_data = retry_part.get("inlineData", {})
-                                                        if retry_inline_data and "data" in retry_inline_data:
-                                                            # 解码图片数据
-                                                            image_data = base64.b64decode(retry_inline_data["data"])
-
-                                return image_data, text_response
-                            else:
-                                # 记录响应摘要，避免输出大量base64数据
-                                response_summary = self._get_response_summary(response_text)
-                                logger.error(f"API响应不包含候选结果: {response_summary}")
-
-                                # 检查是否是可重试的错误
-                                retry_count += 1
-                                if retry_count <= self.max_retries:
-                                    logger.info(f"第 {retry_count} 次重试生成融合图片，等待 {retry_delay} 秒")
-                                    await asyncio.sleep(retry_delay)
-                                    # 指数退避策略
-                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                    continue
+        # 使用重试机制
+        retry_count = 0
+        retry_delay = self.initial_retry_delay
 
-                                return None, "API响应不包含候选结果，请稍后再试"
+        payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
+        while retry_count <= self.max_retries:
+            try:
+                session = await self._get_http_session()
+                async with session.post(
+                    url,
+                    params=params,
+                    data=payload,
+                    proxy=proxy,
+                    timeout=self._api_timeout
+                ) as response:
+                    # 直接读取原始字节，JSON解析不需要先把包含图片的响应解码为str
+                    response_body = await response.read()
+
+                    if response.status == 200:
+                        result = self._json_loads(response_body)
+
+                        # 提取响应
+                        candidates = result.get("candidates", [])
+                        if candidates and len(candidates) > 0:
+                            content = candidates[0].get("content", {})
+                            parts = content.get("parts", [])
+
+                            # 处理文本和图片响应
+                            text_response, image_data = self._extract_text_and_image(parts)
+
+                            if not image_data:
+                                # 如果没有生成图像，尝试使用英文提示词重试
+                                logger.info("未获取到图像，尝试使用英文提示词重试...")
+                                english_prompt = f"Please merge these images. {prompt}. Make sure to include the generated image in your response."
+
+                                # 更新请求体中的提示词
+                                data["contents"][0]["parts"][0]["text"] = english_prompt
+                                payload = self._json_payload(data)
+
+                                # 重新发送请求
+                                async with session.post(
+                                    url,
+                                    params=params,
+                                    data=payload,
+                                    proxy=proxy,
+                                    timeout=self._api_timeout
+                                ) as retry_response:
+                                    retry_response_body = await retry_response.read()
+
+                                    if retry_response.status == 200:
+                                        retry_result = self._json_loads(retry_response_body)
+                                        retry_candidates = retry_result.get("candidates", [])
+                                        if retry_candidates and len(retry_candidates) > 0:
+                                            retry_content = retry_candidates[0].get("content", {})
+                                            retry_parts = retry_content.get("parts", [])
+
+                                            retry_text, image_data = self._extract_text_and_image(retry_parts)
+                                            if retry_text:
+                                                text_response = retry_text
+
+                            return image_data, text_response
                         else:
                             # 记录响应摘要，避免输出大量base64数据
-                            response_summary = self._get_response_summary(response_text)
-                            logger.error(f"融合图片API调用失败 (状态码: {response.status}): {response_summary}")
+                            response_summary = self._get_response_summary(response_body, result)
+                            logger.error(f"API响应不包含候选结果: {response_summary}")
 
                             # 检查是否是可重试的错误
-                            if response.status in [429, 500, 502, 503, 504]:
-                                retry_count += 1
-                                if retry_count <= self.max_retries:
-                                    logger.info(f"第 {retry_count} 次重试生成融合图片，等待 {retry_delay} 秒")
-                                    await asyncio.sleep(retry_delay)
-                                    # 指数退避策略
-                                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
-                                    continue
-
-                            return None, f"融合图片API调用失败 (状态码: {response.status})"
+                            retry_count += 1
+                            if retry_count <= self.max_retries:
+                                logger.info(f"第 {retry_count} 次重试生成融合图片，等待 {retry_delay} 秒")
+                                await asyncio.sleep(retry_delay)
+                                # 指数退避策略
+                                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                continue
+
+                            return None, "API响应不包含候选结果，请稍后再试"
+                    else:
+                        # 记录响应摘要，避免输出大量base64数据
+                        response_summary = self._get_response_summary(response_body)
+                        logger.error(f"融合图片API调用失败 (状态码: {response.status}): {response_summary}")
+
+                        # 检查是否是可重试的错误
+                        if response.status in self._retry_status_codes:
+                            retry_count += 1
+                            if retry_count <= self.max_retries:
+                                logger.info(f"第 {retry_count} 次重试生成融合图片，等待 {retry_delay} 秒")
+                                await asyncio.sleep(retry_delay)
+                                # 指数退避策略
+                                retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                                continue
+
+                        return None, self._api_error_messages.get(response.status, f"融合图片API调用失败 (状态码: {response.status})")
             except Exception as e:
                 logger.error(f"生成融合图片异常: {str(e)}")
 
@@ -5450,6 +5722,54 @@ class GeminiImage(PluginBase):
 
         return None, "生成融合图片失败，请稍后再试"
 
+    async def _build_contents(self, prompt: str, conversation_history: List[Dict] = None, extra_part: dict = None) -> List[Dict]:
+        """构建Gemini请求的contents列表：会话历史 + 本轮用户消息
+
+        Args:
+            prompt: 本轮提示词
+            conversation_history: 会话历史，图片以image_url形式保存
+            extra_part: 附加到本轮用户消息中的片段（如待编辑图片的inlineData）
+
+        Returns:
+            List[Dict]: contents列表
+        """
+        contents = []
+        history = conversation_history or ()
+        # 最近两轮（4条消息）的历史图片把编码结果直接挂在历史记录上，每轮对话都会用到，
+        # 不受全局LRU中其他用户请求的挤占，也不必每轮再stat文件查缓存；更早的消息释放该引用
+        inline_from = len(history) - 4
+        for index, msg in enumerate(history):
+            # 转换角色名称，确保使用 "user" 或 "model"
+            role = msg["role"]
+            if role == "assistant":
+                role = "model"
+
+            processed_parts = []
+            for part in msg["parts"]:
+                if "text" in part:
+                    processed_parts.append({"text": part["text"]})
+                elif "image_url" in part:
+                    # 需要读取图片并转换为inlineData格式
+                    try:
+                        inline_part = part.get("_inline")
+                        if inline_part is None:
+                            inline_part = await self._history_image_part(part["image_url"])
+                            if index >= inline_from:
+                                part["_inline"] = inline_part
+                        elif index < inline_from:
+                            del part["_inline"]
+                        processed_parts.append(inline_part)
+                    except Exception as e:
+                        logger.error(f"处理历史图片失败: {e}")
+                        # 跳过这个图片
+            contents.append({"role": role, "parts": processed_parts})
+
+        user_parts = [{"text": prompt}]
+        if extra_part is not None:
+            user_parts.append(extra_part)
+        contents.append({"role": "user", "parts": user_parts})
+        return contents
+
     async def _generate_image(self, prompt: str, conversation_history: List[Dict] = None, is_continuous_dialogue: bool = False) -> Tuple[List[bytes], List[str]]:
         """调用Gemini API生成图片，返回图片数据列表和文本响应列表
 
@@ -5461,15 +5781,7 @@ class GeminiImage(PluginBase):
         Returns:
             Tuple[List[bytes], List[str]]: 图片数据列表和文本响应列表
         """
-        url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-        # 检查URL格式是否正确
-        if not url.startswith("http"):
-            logger.warning(f"URL格式可能不正确: {url}")
-            # 尝试修复URL格式
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-        }
+        url = self._image_model_url
 
         params = {
             "key": self.api_key
@@ -5483,10 +5795,10 @@ class GeminiImage(PluginBase):
             # 只在新对话中增强提示词，不在连续对话中增强
             if is_multi_image:
                 # 如果是多图文请求，使用多图文提示词增强
-                enhanced_prompt = await self._enhance_multi_image_prompt(prompt)
+                enhanced_prompt = await self._enhance_cached("multi_image", prompt, lambda: self._enhance_multi_image_prompt(prompt))
             else:
                 # 如果是普通请求，使用标准提示词增强
-                enhanced_prompt = await self._enhance_prompt(prompt)
+                enhanced_prompt = await self._enhance_cached("generate", prompt, lambda: self._enhance_prompt(prompt))
 
             prompt = enhanced_prompt
         else:
@@ -5494,415 +5806,168 @@ class GeminiImage(PluginBase):
             logger.info(f"连续对话模式，不增强提示词，直接使用原始提示词: {prompt}")
 
         # 构建请求数据
-        if conversation_history and len(conversation_history) > 0:
-            # 有会话历史，构建上下文
-            # 需要处理会话历史中的图片格式
-            processed_history = []
-            for msg in conversation_history:
-                # 转换角色名称，确保使用 "user" 或 "model"
-                role = msg["role"]
-                if role == "assistant":
-                    role = "model"
-
-                processed_msg = {"role": role, "parts": []}
-                for part in msg["parts"]:
-                    if "text" in part:
-                        processed_msg["parts"].append({"text": part["text"]})
-                    elif "image_url" in part:
-                        # 需要读取图片并转换为inlineData格式
-                        try:
-                            with open(part["image_url"], "rb") as f:
-                                image_data = f.read()
-                                image_base64 = base64.b64encode(image_data).decode("utf-8")
-                                processed_msg["parts"].append({
-                                    "inlineData": {
-                                        "mimeType": "image/png",
-                                        "data": image_base64
-                                    }
-                                })
-                        except Exception as e:
-                            logger.error(f"处理历史图片失败: {e}")
-                            # 跳过这个图片
-                processed_history.append(processed_msg)
-
-            data = {
-                "contents": processed_history + [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                "generation_config": {
-                    "response_modalities": ["Text", "Image"]
-                }
-            }
-        else:
-            # 无会话历史，直接使用提示
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {
-                                "text": prompt
-                            }
-                        ]
-                    }
-                ],
-                "generation_config": {
-                    "response_modalities": ["Text", "Image"]
-                }
-            }
+        data = {
+            "contents": await self._build_contents(prompt, conversation_history),
+            "generation_config": self._image_generation_config
+        }
 
         # 创建代理配置
-        proxy = None
-        if self.enable_proxy and self.proxy_url:
-            proxy = self.proxy_url
+        proxy = self._proxy
 
         try:
-            # 创建客户端会话，设置代理（如果启用）
-            async with aiohttp.ClientSession() as session:
-                try:
-                    # 使用代理发送请求
-                    async with session.post(
-                        url,
-                        headers=headers,
-                        params=params,
-                        json=data,
-                        proxy=proxy,
-                        timeout=aiohttp.ClientTimeout(total=60)  # 增加超时时间到60秒
-                    ) as response:
-                        response_text = await response.text()
+            # 获取共享的客户端会话，代理在请求时设置（如果启用）
+            session = await self._get_http_session()
+            try:
+                # 使用代理发送请求
+                async with session.post(
+                    url,
+                    params=params,
+                    data=self._json_payload(data),
+                    proxy=proxy,
+                    timeout=self._api_timeout
+                ) as response:
+                    # 直接读取原始字节，JSON解析不需要先把数MB的响应解码为str
+                    response_body = await response.read()
+
+
+                    if response.status == 200:
+                        try:
+                            result = self._json_loads(response_body)
 
+                            # 记录响应状态
+                            logger.info(f"Gemini API响应成功")
 
-                        if response.status == 200:
-                            try:
-                                result = json.loads(response_text)
-
-                                # 记录响应状态
-                                logger.info(f"Gemini API响应成功")
-
-                                # 提取响应
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    # 处理文本和图片响应，保持原始顺序
-                                    parts_list = []
-                                    image_count = 0
-
-                                    # 检查是否是多图文请求
-                                    if is_multi_image:
-                                        logger.info(f"检测到多图文请求，开始处理分镜脚本")
-                                        logger.info(f"原始提示词: {prompt[:200]}..." if len(prompt) > 200 else f"原始提示词: {prompt}")
-
-                                        # 从分镜脚本中提取故事内容和中文提示词
-                                        story_contents = self._extract_story_content(prompt)
-                                        chinese_prompts = self._extract_chinese_prompt(prompt)
-
-                                        logger.info(f"从分镜脚本中提取到 {len(story_contents)} 个故事内容和 {len(chinese_prompts)} 个中文提示词")
-
-                                        # 记录每个故事内容的前50个字符，便于调试
-                                        for i, content in enumerate(story_contents):
-                                            logger.info(f"故事内容 {i+1}: {content[:50]}..." if len(content) > 50 else f"故事内容 {i+1}: {content}")
-
-                                        # 如果成功提取到中文提示词，使用这些提示词生成图片
-                                        if chinese_prompts:
-                                            # 首先从 API 响应中提取所有图片
-                                            all_images = []
-                                            for part in parts:
-                                                if "inlineData" in part:
-                                                    inline_data = part.get("inlineData", {})
-                                                    if inline_data and "data" in inline_data:
-                                                        # 解码图片数据
-                                                        image_data = base64.b64decode(inline_data["data"])
-                                                        all_images.append(image_data)
-                                                        logger.info(f"从 API 响应中提取到第 {len(all_images)} 张图片，大小: {len(image_data)} 字节")
-
-                                            logger.info(f"从 API 响应中总共提取到 {len(all_images)} 张图片")
-
-                                            # 先添加整体的文本描述
-                                            if len(parts) > 0 and "text" in parts[0] and parts[0]["text"]:
-                                                parts_list.append({"type": "text", "content": parts[0]["text"]})
-
-                                            # 为每个中文提示词/故事内容添加图片
-                                            for i in range(max(len(chinese_prompts), len(story_contents))):
-                                                # 如果有对应的故事内容，添加到parts_list
-                                                if i < len(story_contents):
-                                                    parts_list.append({"type": "text", "content": story_contents[i]})
-
-                                                # 如果有对应的图片，使用它
-                                                if i < len(all_images):
-                                                    parts_list.append({"type": "image", "content": all_images[i]})
-                                                    image_count += 1
-                                                    logger.info(f"为第 {i+1} 个故事内容使用 API 响应中的图片")
-                                                elif i < len(chinese_prompts):
-                                                    # 如果没有对应的图片，单独生成一张
-                                                    logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
-
-                                                    # 单独调用API生成图片
-                                                    try:
-                                                        # 构建请求URL
-                                                        single_url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-                                                        # 检查URL格式是否正确
-                                                        if not single_url.startswith("http"):
-                                                            logger.warning(f"URL格式可能不正确: {single_url}")
-                                                            # 尝试修复URL格式
-                                                            single_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-                                                        single_headers = {
-                                                            "Content-Type": "application/json",
-                                                        }
-                                                        single_params = {
-                                                            "key": self.api_key
-                                                        }
-
-                                                        # 构建请求数据
-                                                        # 提取第一个场景的人物描述，用于保持一致性
-                                                        character_description = ""
-                                                        if i > 0 and len(chinese_prompts) > 0:
-                                                            # 尝试从第一个场景的提示词中提取人物描述
-                                                            first_prompt = chinese_prompts[0]
-                                                            logger.info(f"分析第一个场景的提示词以提取人物描述: {first_prompt[:100]}...")
-
-                                                            # 查找主要人物/对象描述部分
-                                                            character_markers = [
-                                                                "**主要人物/对象描述**",
-                                                                "主要人物/对象描述",
-                                                                "**主体对象：**",
-                                                                "主体对象：",
-                                                                "**人物描述：**",
-                                                                "人物描述：",
-                                                                "**人物特征：**",
-                                                                "人物特征：",
-                                                                "**角色描述：**",
-                                                                "角色描述："
-                                                            ]
-
-                                                            for marker in character_markers:
-                                                                if marker in first_prompt:
-                                                                    logger.info(f"在第一个场景中找到标记: {marker}")
-                                                                    parts = first_prompt.split(marker, 1)
-                                                                    if len(parts) > 1:
-                                                                        # 提取人物描述部分
-                                                                        desc_part = parts[1].strip()
-                                                                        # 查找下一个标记
-                                                                        next_markers = [
-                                                                            "**场景：", "**故事内容", "**1. 图片内容概述",
-                                                                            "**场景环境：**", "场景环境：", "**背景：**", "背景：",
-                                                                            "**气氛：**", "气氛：", "**风格：**", "风格："
-                                                                        ]
-                                                                        end_pos = len(desc_part)
-                                                                        for next_marker in next_markers:
-                                                                            pos = desc_part.find(next_marker)
-                                                                            if pos != -1 and pos < end_pos:
-                                                                                end_pos = pos
-
-                                                                        character_description = desc_part[:end_pos].strip()
-                                                                        logger.info(f"从第一个场景提取到人物描述: {character_description[:100]}...")
-                                                                        break
-
-                                                            # 如果没有找到明确的人物描述，尝试提取主体对象部分
-                                                            if not character_description:
-                                                                # 查找主体对象部分
-                                                                object_markers = [
-                                                                    "**2. 主体对象：**",
-                                                                    "**主体对象：**",
-                                                                    "主体对象：",
-                                                                    "**主体：**",
-                                                                    "主体："
-                                                                ]
-
-                                                                for marker in object_markers:
-                                                                    if marker in first_prompt:
-                                                                        logger.info(f"在第一个场景中找到主体对象标记: {marker}")
-                                                                        parts = first_prompt.split(marker, 1)
-                                                                        if len(parts) > 1:
-                                                                            # 提取主体对象部分
-                                                                            obj_part = parts[1].strip()
-                                                                            # 查找下一个标记
-                                                                            next_markers = [
-                                                                                "**3. 场景环境：**", "**场景环境：**", "场景环境：",
-                                                                                "**背景：**", "背景：", "**气氛：**", "气氛："
-                                                                            ]
-                                                                            end_pos = len(obj_part)
-                                                                            for next_marker in next_markers:
-                                                                                pos = obj_part.find(next_marker)
-                                                                                if pos != -1 and pos < end_pos:
-                                                                                    end_pos = pos
-
-                                                                            character_description = obj_part[:end_pos].strip()
-                                                                            logger.info(f"从第一个场景提取到主体对象描述: {character_description[:100]}...")
-                                                                            break
-
-                                                            # 如果还是没有找到人物描述，尝试使用整个第一个场景的提示词
-                                                            if not character_description and len(first_prompt) > 0:
-                                                                # 使用第一个场景的前100个字符作为人物描述
-                                                                character_description = f"保持与第一个场景相同的风格和一致性"
-                                                                logger.info(f"未找到明确的人物描述，使用通用一致性提示: {character_description}")
-
-                                                        # 如果找到了人物描述，将其添加到当前场景的提示词中
-                                                        enhanced_prompt = chinese_prompts[i]
-                                                        if character_description:
-                                                            # 检查当前提示词中是否已经包含了人物描述
-                                                            if character_description not in enhanced_prompt:
-                                                                # 在提示词开头添加人物描述
-                                                                enhanced_prompt = f"保持与第一个场景相同的人物特征和风格：{character_description}\n\n{enhanced_prompt}"
-                                                                logger.info(f"为第 {i+1} 个场景添加了人物描述，确保一致性")
-
-                                                        # 为每个场景使用不同的温度参数，增加多样性
-                                                        # 场景索引越大，温度越高，生成的图片越多样
-                                                        scene_temperature = min(0.7, 0.4 + i * 0.05)
-
-                                                        # 添加明确的指示，要求生成与前面场景不同的图片
-                                                        scene_instruction = f"为第{i+1}个场景生成一张与前面场景不同的图片。"
-                                                        if i > 0:
-                                                            scene_instruction += "请确保这张图片与前面的图片有明显区别，但保持人物特征一致。"
-
-                                                        # 在提示词中添加场景编号，帮助模型区分不同场景
-                                                        final_prompt = f"{scene_instruction}\n\n场景{i+1}：{enhanced_prompt}"
-
-                                                        logger.info(f"为第 {i+1} 个场景使用温度参数: {scene_temperature}")
-
-                                                        single_data = {
-                                                            "contents": [
-                                                                {
-                                                                    "parts": [
-                                                                        {
-                                                                            "text": final_prompt
-                                                                        }
-                                                                    ]
-                                                                }
-                                                            ],
-                                                            "generation_config": {
-                                                                "response_modalities": ["Text", "Image"],
-                                                                "temperature": scene_temperature,
-                                                                "topP": 0.95,
-                                                                "topK": 64,
-                                                                "seed": int(time.time() * 1000) % 1000000 + i * 1000  # 为每个场景使用不同的随机种子
-                                                            }
-                                                        }
-
-                                                        # 创建代理配置
-                                                        single_proxy = None
-                                                        if self.enable_proxy and self.proxy_url:
-                                                            single_proxy = self.proxy_url
-
-                                                        # 发送请求
-                                                        async with aiohttp.ClientSession() as single_session:
-                                                            async with single_session.post(
-                                                                single_url,
-                                                                headers=single_headers,
-                                                                params=single_params,
-                                                                json=single_data,
-                                                                proxy=single_proxy,
-                                                                timeout=aiohttp.ClientTimeout(total=60)
-                                                            ) as single_response:
-                                                                single_response_text = await single_response.text()
-
-                                                                if single_response.status == 200:
-                                                                    single_result = json.loads(single_response_text)
-
-                                                                    single_candidates = single_result.get("candidates", [])
-
-                                                                    if single_candidates and len(single_candidates) > 0:
-                                                                        single_content = single_candidates[0].get("content", {})
-                                                                        single_parts = single_content.get("parts", [])
-
-                                                                        # 查找图片数据
-                                                                        single_image_data = None
-                                                                        for single_part in single_parts:
-                                                                            if "inlineData" in single_part:
-                                                                                single_inline_data = single_part.get("inlineData", {})
-                                                                                if single_inline_data and "data" in single_inline_data:
-                                                                                    # 解码图片数据
-                                                                                    single_image_data = base64.b64decode(single_inline_data["data"])
-                                                                                    break
-
-                                                                        if single_image_data:
-                                                                            # 生成了图片，添加到结果列表中
-                                                                            parts_list.append({"type": "image", "content": single_image_data})
-                                                                            image_count += 1
-
-                                                                            # 记录详细的成功信息
-                                                                            logger.info(f"为第 {i+1} 个故事内容单独生成图片成功，大小: {len(single_image_data)} 字节")
-
-                                                                            # 保存图片到临时文件进行调试
-                                                                            try:
-                                                                                debug_image_path = os.path.join(self.save_dir, f"debug_scene_{i+1}_{int(time.time())}.png")
-                                                                                with open(debug_image_path, "wb") as f:
-                                                                                    f.write(single_image_data)
-                                                                                logger.info(f"已保存第 {i+1} 个场景的调试图片到: {debug_image_path}")
-                                                                            except Exception as e:
-                                                                                logger.error(f"保存调试图片失败: {e}")
-                                                                        else:
-                                                                            # 生成图片失败，记录详细的错误信息
-                                                                            logger.warning(f"未能为第 {i+1} 个故事内容单独生成图片，API 响应中没有图片数据")
-                                                                            logger.warning(f"尝试为第 {i+1} 个场景生成图片的提示词: {final_prompt[:200]}...")
-                                                                    else:
-                                                                        logger.warning(f"未能为第 {i+1} 个故事内容单独生成图片，API 响应中没有候选结果")
-                                                                else:
-                                                                    logger.error(f"单独生成图片 API 调用失败 (状态码: {single_response.status}): {single_response_text[:200]}...")
-                                                    except Exception as e:
-                                                        logger.error(f"单独生成图片异常: {str(e)}")
-                                                        logger.error(traceback.format_exc())
-                                        else:
-                                            # 如果没有提取到中文提示词，使用常规处理方式
-                                            for part in parts:
-                                                # 处理文本部分
-                                                if "text" in part and part["text"]:
-                                                    parts_list.append({"type": "text", "content": part["text"]})
-
-                                                # 处理图片部分
-                                                if "inlineData" in part:
-                                                    inline_data = part.get("inlineData", {})
-                                                    if inline_data and "data" in inline_data:
-                                                        # 解码图片数据
-                                                        image_data = base64.b64decode(inline_data["data"])
-                                                        parts_list.append({"type": "image", "content": image_data})
-                                                        image_count += 1
+                            # 提取响应
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                # 处理文本和图片响应，保持原始顺序；只遍历并解码一次，分镜处理直接复用其中的图片
+                                response_parts, response_image_count = self._collect_response_parts(parts)
+
+                                # 检查是否是多图文请求
+                                if is_multi_image:
+                                    logger.info(f"检测到多图文请求，开始处理分镜脚本")
+                                    logger.info(f"原始提示词: {prompt[:200]}..." if len(prompt) > 200 else f"原始提示词: {prompt}")
+
+                                    # 从分镜脚本中提取故事内容和中文提示词
+                                    story_contents = self._extract_story_content(prompt)
+                                    chinese_prompts = self._extract_chinese_prompt(prompt)
+
+                                    logger.info(f"从分镜脚本中提取到 {len(story_contents)} 个故事内容和 {len(chinese_prompts)} 个中文提示词")
+
+                                    # 记录每个故事内容的前50个字符，便于调试
+                                    for i, content in enumerate(story_contents):
+                                        logger.info(f"故事内容 {i+1}: {content[:50]}..." if len(content) > 50 else f"故事内容 {i+1}: {content}")
+
+                                    # 如果成功提取到中文提示词，使用这些提示词生成图片
+                                    if chinese_prompts:
+                                        parts_list = []
+                                        image_count = 0
+
+                                        # 首先从 API 响应中取出所有图片
+                                        all_images = [part["content"] for part in response_parts if part["type"] == "image"]
+                                        logger.info(f"从 API 响应中总共提取到 {len(all_images)} 张图片")
+
+                                        # 先添加整体的文本描述
+                                        if len(parts) > 0 and "text" in parts[0] and parts[0]["text"]:
+                                            parts_list.append({"type": "text", "content": parts[0]["text"]})
+
+                                        # 先找出API响应中缺少图片、需要单独生成的场景，各场景请求互不依赖，并发发送
+                                        scene_count = max(len(chinese_prompts), len(story_contents))
+                                        missing_indexes = [i for i in range(len(all_images), scene_count) if i < len(chinese_prompts)]
+
+                                        # 人物描述只取决于第一个场景，提取一次供所有后续场景复用
+                                        character_description = ""
+                                        if any(i > 0 for i in missing_indexes):
+                                            character_description = self._extract_character_description(chinese_prompts[0])
+
+                                        scene_requests = []
+                                        for i in missing_indexes:
+                                            logger.info(f"为第 {i+1} 个故事内容单独生成图片，提示词: {chinese_prompts[i][:50]}...")
+
+                                            # 如果找到了人物描述，将其添加到当前场景的提示词中
+                                            enhanced_prompt = chinese_prompts[i]
+                                            if i > 0 and character_description and character_description not in enhanced_prompt:
+                                                # 在提示词开头添加人物描述
+                                                enhanced_prompt = f"保持与第一个场景相同的人物特征和风格：{character_description}\n\n{enhanced_prompt}"
+                                                logger.info(f"为第 {i+1} 个场景添加了人物描述，确保一致性")
+
+                                            # 为每个场景使用不同的温度参数，增加多样性
+                                            # 场景索引越大，温度越高，生成的图片越多样
+                                            scene_temperature = min(0.7, 0.4 + i * 0.05)
+
+                                            # 添加明确的指示，要求生成与前面场景不同的图片
+                                            scene_instruction = f"为第{i+1}个场景生成一张与前面场景不同的图片。"
+                                            if i > 0:
+                                                scene_instruction += "请确保这张图片与前面的图片有明显区别，但保持人物特征一致。"
+
+                                            # 在提示词中添加场景编号，帮助模型区分不同场景
+                                            final_prompt = f"{scene_instruction}\n\n场景{i+1}：{enhanced_prompt}"
+
+                                            logger.info(f"为第 {i+1} 个场景使用温度参数: {scene_temperature}")
+
+                                            scene_requests.append(self._request_single_image({
+                                                "contents": [{"parts": [{"text": final_prompt}]}],
+                                                "generation_config": {
+                                                    "response_modalities": ["Text", "Image"],
+                                                    "temperature": scene_temperature,
+                                                    "topP": 0.95,
+                                                    "topK": 64,
+                                                    "seed": int(time.time() * 1000) % 1000000 + i * 1000  # 为每个场景使用不同的随机种子
+                                                }
+                                            }))
+
+                                        scene_images = dict(zip(missing_indexes, await asyncio.gather(*scene_requests)))
+
+                                        # 为每个中文提示词/故事内容添加图片
+                                        for i in range(scene_count):
+                                            # 如果有对应的故事内容，添加到parts_list
+                                            if i < len(story_contents):
+                                                parts_list.append({"type": "text", "content": story_contents[i]})
+
+                                            # 如果有对应的图片，使用它
+                                            if i < len(all_images):
+                                                parts_list.append({"type": "image", "content": all_images[i]})
+                                                image_count += 1
+                                                logger.info(f"为第 {i+1} 个故事内容使用 API 响应中的图片")
+                                            elif scene_images.get(i):
+                                                # 没有对应的图片时，使用单独生成的图片
+                                                parts_list.append({"type": "image", "content": scene_images[i]})
+                                                image_count += 1
+                                                logger.info(f"为第 {i+1} 个故事内容单独生成图片成功，大小: {len(scene_images[i])} 字节")
+                                            elif i in scene_images:
+                                                logger.warning(f"未能为第 {i+1} 个故事内容单独生成图片")
                                     else:
-                                        # 常规处理方式
-                                        for part in parts:
-                                            # 处理文本部分
-                                            if "text" in part and part["text"]:
-                                                parts_list.append({"type": "text", "content": part["text"]})
-
-                                            # 处理图片部分
-                                            if "inlineData" in part:
-                                                inline_data = part.get("inlineData", {})
-                                                if inline_data and "data" in inline_data:
-                                                    # 解码图片数据
-                                                    image_data = base64.b64decode(inline_data["data"])
-                                                    parts_list.append({"type": "image", "content": image_data})
-                                                    image_count += 1
-
-                                    if image_count == 0:
-                                        # 记录响应摘要，避免输出大量base64数据
-                                        response_summary = self._get_response_summary(response_text)
-                                        logger.error(f"API响应中没有找到图片数据: {response_summary}")
-                                        return parts_list, 0
-
-                                    return parts_list, image_count
-
-                                # 记录响应摘要，避免输出大量base64数据
-                                response_summary = self._get_response_summary(response_text)
-                                logger.error(f"未找到生成的图片数据: {response_summary}")
-                                return [], 0
-                            except json.JSONDecodeError as je:
-                                logger.error(f"解析JSON响应失败: {je}")
-                                logger.error(f"响应内容: {response_text[:1000]}...")  # 记录部分响应内容
-                                return [], 0
-                        else:
-                            logger.error(f"Gemini API调用失败 (状态码: {response.status}): {response_text}")
+                                        # 如果没有提取到中文提示词，使用常规处理方式
+                                        parts_list, image_count = response_parts, response_image_count
+                                else:
+                                    # 常规处理方式
+                                    parts_list, image_count = response_parts, response_image_count
+
+                                if image_count == 0:
+                                    # 记录响应摘要，避免输出大量base64数据
+                                    response_summary = self._get_response_summary(response_body, result)
+                                    logger.error(f"API响应中没有找到图片数据: {response_summary}")
+                                    return parts_list, 0
+
+                                return parts_list, image_count
+
+                            # 记录响应摘要，避免输出大量base64数据
+                            response_summary = self._get_response_summary(response_body, result)
+                            logger.error(f"未找到生成的图片数据: {response_summary}")
+                            return [], 0
+                        except json.JSONDecodeError as je:
+                            logger.error(f"解析JSON响应失败: {je}")
+                            logger.error(f"响应内容: {response_body[:1000].decode('utf-8', 'replace')}...")  # 记录部分响应内容
                             return [], 0
-                except aiohttp.ClientError as ce:
-                    logger.error(f"API请求客户端错误: {ce}")
-                    return [], 0
+                    else:
+                        logger.error(f"Gemini API调用失败 (状态码: {response.status}): {response_body.decode('utf-8', 'replace')}")
+                        return [], 0
+            except aiohttp.ClientError as ce:
+                logger.error(f"API请求客户端错误: {ce}")
+                return [], 0
         except Exception as e:
             logger.error(f"API调用异常: {str(e)}")
             logger.error(traceback.format_exc())
@@ -5921,32 +5986,41 @@ class GeminiImage(PluginBase):
             Tuple[List[Optional[bytes]], List[Optional[str]]]: 编辑后的图片数据列表和文本响应列表，
             按照API返回的顺序排列，以支持图文混排内容的处理。
         """
-        # 增强编辑提示词，如果启用了提示词增强且不是连续对话模式
+        # 确保image_data_input是列表形式
+        if isinstance(image_data_input, bytes):
+            image_datas = [image_data_input]
+        else:
+            image_datas = image_data_input
+
+        # 验证图片数据，没有图片时不必再增强提示词
+        if not image_datas or len(image_datas) == 0:
+            logger.error("没有提供图片数据")
+            return [], []
+
+        # 第一张图片压缩后转换为Base64编码，待编辑的图片附加在最后一轮用户消息中；
+        # 启用了提示词增强且不是连续对话模式时，同时增强编辑提示词
         if self.enhance_prompt and not is_continuous_dialogue:
-            # 只在新对话中增强提示词，不在连续对话中增强
-            enhanced_prompt = await self._enhance_edit_prompt(prompt)
+            # 只在新对话中增强提示词，不在连续对话中增强；
+            # 增强请求的网络往返与线程池中的图片压缩编码同时进行
+            enhanced_prompt, image_part = await asyncio.gather(
+                self._enhance_cached("edit", prompt, lambda: self._enhance_edit_prompt(prompt)),
+                self._upload_image_part(image_datas[0])
+            )
             logger.info(f"原始编辑提示词: {prompt}")
             logger.info(f"增强后的编辑提示词: {enhanced_prompt}")
             prompt = enhanced_prompt
         else:
             # 在连续对话中，直接使用原始提示词
             logger.info(f"连续对话模式，不增强提示词，直接使用原始提示词: {prompt}")
+            image_part = await self._upload_image_part(image_datas[0])
 
         # 直接使用提示词，不添加额外前缀
         edit_prompt = prompt
 
-        url = f"{self.base_url}/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-        # 检查URL格式是否正确
-        if not url.startswith("http"):
-            logger.warning(f"URL格式可能不正确: {url}")
-            # 尝试修复URL格式
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash-exp-image-generation:generateContent"
-        headers = {
-            "Content-Type": "application/json",
-        }
+        url = self._image_model_url
 
         # 获取会话ID
-        session_id = f"edit_{uuid.uuid4().hex[:8]}"  # 为编辑图片生成一个唯一的会话ID
+        session_id = f"edit_{random.getrandbits(32):08x}"  # 为编辑图片生成一个唯一的会话ID
 
         # 获取API密钥
         api_key = self.get_api_key_for_session(session_id)
@@ -5955,265 +6029,176 @@ class GeminiImage(PluginBase):
             "key": api_key
         }
 
-        # 确保image_data_input是列表形式
-        if isinstance(image_data_input, bytes):
-            image_datas = [image_data_input]
-        else:
-            image_datas = image_data_input
-
-        # 验证图片数据
-        if not image_datas or len(image_datas) == 0:
-            logger.error("没有提供图片数据")
-            return [], []
-
-        # 将图片数据转换为Base64编码
-        image_base64 = base64.b64encode(image_datas[0]).decode("utf-8")  # 使用第一张图片
-
-        # 构建请求数据
-        if conversation_history and len(conversation_history) > 0:
-            # 有会话历史，构建上下文
-            # 需要处理会话历史中的图片格式
-            processed_history = []
-            for msg in conversation_history:
-                # 转换角色名称，确保使用 "user" 或 "model"
-                role = msg["role"]
-                if role == "assistant":
-                    role = "model"
-
-                processed_msg = {"role": role, "parts": []}
-                for part in msg["parts"]:
-                    if "text" in part:
-                        processed_msg["parts"].append({"text": part["text"]})
-                    elif "image_url" in part:
-                        # 需要读取图片并转换为inlineData格式
-                        try:
-                            with open(part["image_url"], "rb") as f:
-                                img_data = f.read()
-                                img_base64 = base64.b64encode(img_data).decode("utf-8")
-                                processed_msg["parts"].append({
-                                    "inlineData": {
-                                        "mimeType": "image/png",
-                                        "data": img_base64
-                                    }
-                                })
-                        except Exception as e:
-                            logger.error(f"处理历史图片失败: {e}")
-                            # 跳过这个图片
-                processed_history.append(processed_msg)
-
-            data = {
-                "contents": processed_history + [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {
-                                "text": edit_prompt
-                            },
-                            {
-                                "inlineData": {
-                                    "mimeType": "image/png",
-                                    "data": image_base64
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "generation_config": {
-                    "response_modalities": ["Text", "Image"],
-                    "max_output_tokens": 8192,  # 增加输出令牌数量限制
-                    "temperature": 0.4  # 降低温度，减少随机性
-                }
-            }
-        else:
-            # 无会话历史，直接使用提示和图片
-            data = {
-                "contents": [
-                    {
-                        "role": "user",
-                        "parts": [
-                            {
-                                "text": edit_prompt
-                            },
-                            {
-                                "inlineData": {
-                                    "mimeType": "image/png",
-                                    "data": image_base64
-                                }
-                            }
-                        ]
-                    }
-                ],
-                "generation_config": {
-                    "response_modalities": ["Text", "Image"]
-                }
+        data = {
+            "contents": await self._build_contents(edit_prompt, conversation_history, image_part),
+            "generation_config": self._image_generation_config
+        }
+        if conversation_history:
+            # 有会话历史时限制随机性并放宽输出长度（复制共享配置，不修改原字典）
+            data["generation_config"] = {
+                **self._image_generation_config,
+                "max_output_tokens": 8192,  # 增加输出令牌数量限制
+                "temperature": 0.4  # 降低温度，减少随机性
             }
 
-        logger.info(f"构建编辑图片请求数据: 提示词长度={len(edit_prompt)}, 图片大小={len(image_base64)}字节")
+        logger.info(f"构建编辑图片请求数据: 提示词长度={len(edit_prompt)}, 图片大小={len(image_part['inlineData']['data'])}字节")
 
         # 记录请求数据的关键部分
         logger.info(f"API请求URL: {url}")
         logger.info(f"API请求参数: {params}")
-        # 记录请求数据的结构，但不记录实际的base64数据
-        request_data_log = copy.deepcopy(data)
-        if "contents" in request_data_log:
-            for content in request_data_log["contents"]:
-                if "parts" in content:
-                    for part in content["parts"]:
-                        if "inlineData" in part and "data" in part["inlineData"]:
-                            part["inlineData"]["data"] = f"[BASE64_DATA_{len(part['inlineData']['data'])}bytes]"  # 替换为长度信息
-        logger.info(f"API请求数据结构: {json.dumps(request_data_log, ensure_ascii=False)[:1000]}...")
+        # 记录请求数据的结构，但不记录实际的base64数据；仅在DEBUG级别输出时才构建
+        logger.opt(lazy=True).debug("API请求数据结构: {}...", lambda: self._request_data_for_log(data)[:1000])
 
         # 创建代理配置
-        proxy = None
-        if self.enable_proxy and self.proxy_url:
-            proxy = self.proxy_url
+        proxy = self._proxy
+        if proxy:
             logger.info(f"使用代理: {self.proxy_url}")
 
         # 初始化重试参数
         max_retries = 3
         retry_count = 0
         retry_delay = 1.0  # 初始重试延迟（秒）
-        retry_status_codes = [429, 500, 502, 503, 504]  # 需要重试的状态码
 
+        payload = self._json_payload(data)  # 请求体只序列化一次，重试时直接复用
         while retry_count <= max_retries:
             try:
-                # 创建客户端会话，设置代理（如果启用）
-                async with aiohttp.ClientSession() as session:
-                    # 使用代理发送请求
-                    logger.info(f"开始调用Gemini API编辑图片 (尝试 {retry_count+1}/{max_retries+1})")
-                    async with session.post(
-                        url,
-                        headers=headers,
-                        params=params,
-                        json=data,
-                        proxy=proxy,
-                        timeout=aiohttp.ClientTimeout(total=300)  # 增加超时时间到300秒
-                    ) as response:
-                        response_text = await response.text()
-                        logger.info(f"Gemini API响应状态码: {response.status}")
+                # 获取共享的客户端会话，代理在请求时设置（如果启用）
+                session = await self._get_http_session()
+                # 使用代理发送请求
+                logger.info(f"开始调用Gemini API编辑图片 (尝试 {retry_count+1}/{max_retries+1})")
+                async with session.post(
+                    url,
+                    params=params,
+                    data=payload,
+                    proxy=proxy,
+                    timeout=self._edit_timeout
+                ) as response:
+                    # 直接读取原始字节，JSON解析不需要先把数MB的响应解码为str
+                    response_body = await response.read()
+                    logger.info(f"Gemini API响应状态码: {response.status}")
+
+                    if response.status == 200:
+                        try:
+                            result = self._json_loads(response_body)
 
-                        if response.status == 200:
-                            try:
-                                result = json.loads(response_text)
-
-                                # 记录响应内容摘要，避免输出大量base64数据
-                                response_summary = self._get_response_summary(response_text)
-                                logger.info(f"Gemini API响应内容摘要: {response_summary}")
-
-                                # 检查是否有内容安全问题
-                                candidates = result.get("candidates", [])
-                                if candidates and len(candidates) > 0:
-                                    finish_reason = candidates[0].get("finishReason", "")
-                                    if finish_reason == "IMAGE_SAFETY":
-                                        logger.warning("Gemini API返回IMAGE_SAFETY，图片内容可能违反安全政策")
-                                        # 提取安全评级信息，构建更友好的错误消息
-                                        safety_message = "图片内容可能违反安全政策，无法处理该请求。"
-                                        try:
-                                            if "safetyRatings" in candidates[0]:
-                                                safety_ratings = candidates[0]["safetyRatings"]
-                                                blocked_categories = []
-                                                for rating in safety_ratings:
-                                                    if rating.get("blocked", False):
-                                                        category = rating.get("category", "未知类别")
-                                                        probability = rating.get("probability", "未知")
-                                                        blocked_categories.append(f"{category}({probability})")
-
-                                                if blocked_categories:
-                                                    safety_message = f"图片内容可能违反安全政策，被拒绝的类别: {', '.join(blocked_categories)}。请修改您的请求。"
-                                        except Exception as e:
-                                            logger.error(f"解析安全评级信息失败: {e}")
-
-                                        return [], [safety_message]  # 返回空图片列表和友好的错误消息
-
-                                    content = candidates[0].get("content", {})
-                                    parts = content.get("parts", [])
-
-                                    # 添加更详细的日志
-                                    logger.info(f"API响应包含 {len(parts)} 个部分")
-
-                                    # 检查是否有其他候选结果
-                                    if len(candidates) > 1:
-                                        logger.info(f"API响应包含多个候选结果: {len(candidates)}")
-
-                                    # 检查是否有完成原因
-                                    finish_reason = candidates[0].get("finishReason", "")
-                                    if finish_reason:
-                                        logger.info(f"API响应的完成原因: {finish_reason}")
-
-                                    # 处理文本和图片响应，以列表形式返回所有部分
-                                    text_responses = []
-                                    image_datas = []
-
-                                    for i, part in enumerate(parts):
-                                        # 处理文本部分
-                                        if "text" in part and part["text"]:
-                                            text_responses.append(part["text"])
-                                            image_datas.append(None)  # 对应位置添加None表示没有图片
-                                            logger.info(f"第 {i+1} 部分是文本，内容长度: {len(part['text'])}")
-
-                                        # 处理图片部分
-                                        elif "inlineData" in part:
-                                            inline_data = part.get("inlineData", {})
-                                            if inline_data and "data" in inline_data:
-                                                # Base64解码图片数据
-                                                img_data = base64.b64decode(inline_data["data"])
-                                                # 添加更多日志
-                                                logger.info(f"图片数据前20字节: {img_data[:20].hex()}")
-                                                # 检查是否是有效的PNG或JPEG文件
-                                                if img_data[:8].hex().startswith('89504e47') or img_data[:3].hex().startswith('ffd8ff'):
-                                                    logger.info(f"图片数据是有效的PNG或JPEG格式")
-                                                else:
-                                                    logger.warning(f"图片数据不是标准的PNG或JPEG格式")
-                                                # 保存原始图片数据以便调试
-                                                debug_path = os.path.join(self.save_dir, f"debug_image_{int(time.time())}_{uuid.uuid4().hex[:8]}.bin")
-                                                with open(debug_path, "wb") as f:
-                                                    f.write(img_data)
-                                                logger.info(f"已保存原始图片数据到: {debug_path}")
-                                                image_datas.append(img_data)
-                                                text_responses.append(None)  # 对应位置添加None表示没有文本
-                                                logger.info(f"第 {i+1} 部分是图片，数据大小: {len(img_data)} 字节")
+                            # 响应内容摘要需要遍历并序列化整个响应，只在DEBUG级别输出或出错时才构建
+                            logger.opt(lazy=True).debug(
+                                "Gemini API响应内容摘要: {}", lambda: self._get_response_summary(response_body, result)
+                            )
+
+                            # 检查是否有内容安全问题
+                            candidates = result.get("candidates", [])
+                            if candidates and len(candidates) > 0:
+                                finish_reason = candidates[0].get("finishReason", "")
+                                if finish_reason == "IMAGE_SAFETY":
+                                    logger.warning("Gemini API返回IMAGE_SAFETY，图片内容可能违反安全政策")
+                                    # 提取安全评级信息，构建更友好的错误消息
+                                    safety_message = "图片内容可能违反安全政策，无法处理该请求。"
+                                    try:
+                                        if "safetyRatings" in candidates[0]:
+                                            safety_ratings = candidates[0]["safetyRatings"]
+                                            blocked_categories = []
+                                            for rating in safety_ratings:
+                                                if rating.get("blocked", False):
+                                                    category = rating.get("category", "未知类别")
+                                                    probability = rating.get("probability", "未知")
+                                                    blocked_categories.append(f"{category}({probability})")
+
+                                            if blocked_categories:
+                                                safety_message = f"图片内容可能违反安全政策，被拒绝的类别: {', '.join(blocked_categories)}。请修改您的请求。"
+                                    except Exception as e:
+                                        logger.error(f"解析安全评级信息失败: {e}")
+
+                                    return [], [safety_message]  # 返回空图片列表和友好的错误消息
+
+                                content = candidates[0].get("content", {})
+                                parts = content.get("parts", [])
+
+                                # 添加更详细的日志
+                                logger.info(f"API响应包含 {len(parts)} 个部分")
+
+                                # 检查是否有其他候选结果
+                                if len(candidates) > 1:
+                                    logger.info(f"API响应包含多个候选结果: {len(candidates)}")
+
+                                # 检查是否有完成原因
+                                finish_reason = candidates[0].get("finishReason", "")
+                                if finish_reason:
+                                    logger.info(f"API响应的完成原因: {finish_reason}")
+
+                                # 处理文本和图片响应，以列表形式返回所有部分
+                                text_responses = []
+                                image_datas = []
+
+                                for i, part in enumerate(parts):
+                                    # 处理文本部分
+                                    if "text" in part and part["text"]:
+                                        text_responses.append(part["text"])
+                                        image_datas.append(None)  # 对应位置添加None表示没有图片
+                                        logger.info(f"第 {i+1} 部分是文本，内容长度: {len(part['text'])}")
+
+                                    # 处理图片部分
+                                    elif "inlineData" in part:
+                                        inline_data = part.get("inlineData", {})
+                                        if inline_data and "data" in inline_data:
+                                            # Base64解码图片数据
+                                            img_data = self._b64decode(inline_data["data"])
+                                            # 添加更多日志
+                                            logger.info(f"图片数据前20字节: {img_data[:20].hex()}")
+                                            # 按文件头魔数检查是否是有效的图片文件，直接比较字节，不再转换为十六进制字符串
+                                            if self._looks_like_image(img_data):
+                                                logger.info(f"图片数据是有效的图片格式")
                                             else:
-                                                logger.warning(f"第 {i+1} 部分是图片，但数据为空")
+                                                logger.warning(f"图片数据不是标准的图片格式")
+                                            # 保存原始图片数据以便调试，放到IO线程池中写入，不阻塞事件循环
+                                            debug_path = self._new_file_path("debug_image", ext=".bin")
+                                            self._run_io(self._write_image_file, debug_path, img_data)
+                                            logger.info(f"已提交保存原始图片数据到: {debug_path}")
+                                            image_datas.append(img_data)
+                                            text_responses.append(None)  # 对应位置添加None表示没有文本
+                                            logger.info(f"第 {i+1} 部分是图片，数据大小: {len(img_data)} 字节")
                                         else:
-                                            logger.warning(f"第 {i+1} 部分格式未知: {part.keys()}")
-
-                                    valid_images_count = len([img for img in image_datas if img])
-                                    valid_texts_count = len([txt for txt in text_responses if txt])
-                                    logger.info(f"处理后得到 {valid_images_count} 个有效图片和 {valid_texts_count} 段有效文本")
-
-                                    # 检查是否有可能的截断情况
-                                    if len(parts) >= 13 and (valid_images_count + valid_texts_count) >= 13:
-                                        logger.warning(f"响应包含 {len(parts)} 个部分，接近API限制，可能存在内容被截断的情况")
-
-                                    if not image_datas or all(img is None for img in image_datas):
-                                        logger.error(f"API响应中没有找到图片数据: {result}")
-                                        # 检查是否有文本响应，仅返回文本数据
-                                        if text_responses and any(text is not None for text in text_responses):
-                                            # 获取第一个有效的文本响应
-                                            valid_text = next((t for t in text_responses if t), None)
-                                            return [], [valid_text]  # 返回空列表表示没有图片, 和包含第一个有效文本的列表
-                                        return [], []
-
-                                    # 获取第一个有效的图片和文本
-                                    first_valid_image = next((img for img in image_datas if img), None)
-                                    first_valid_text = next((text for text in text_responses if text), None)
-
-                                    return [first_valid_image], [first_valid_text]
-
-                                logger.error(f"未找到编辑后的图片数据: {result}")
-                                return [], []
-                            except json.JSONDecodeError as je:
-                                logger.error(f"解析JSON响应失败: {je}")
-                                logger.error(f"响应内容: {response_text[:1000]}...")  # 记录部分响应内容
-                                # 继续重试
-                        elif response.status in retry_status_codes:
-                            # 对于需要重试的状态码，记录并继续循环
-                            logger.warning(f"Gemini API返回错误 (状态码: {response.status})，将进行重试")
-                            # 继续重试
-                        else:
-                            # 对于其他错误，记录并返回
-                            logger.error(f"Gemini API调用失败 (状态码: {response.status}): {response_text}")
+                                            logger.warning(f"第 {i+1} 部分是图片，但数据为空")
+                                    else:
+                                        logger.warning(f"第 {i+1} 部分格式未知: {part.keys()}")
+
+                                valid_images_count = len([img for img in image_datas if img])
+                                valid_texts_count = len([txt for txt in text_responses if txt])
+                                logger.info(f"处理后得到 {valid_images_count} 个有效图片和 {valid_texts_count} 段有效文本")
+
+                                # 检查是否有可能的截断情况
+                                if len(parts) >= 13 and (valid_images_count + valid_texts_count) >= 13:
+                                    logger.warning(f"响应包含 {len(parts)} 个部分，接近API限制，可能存在内容被截断的情况")
+
+                                if not image_datas or all(img is None for img in image_datas):
+                                    logger.error(f"API响应中没有找到图片数据: {self._get_response_summary(response_body, result)}")
+                                    # 检查是否有文本响应，仅返回文本数据
+                                    if text_responses and any(text is not None for text in text_responses):
+                                        # 获取第一个有效的文本响应
+                                        valid_text = next((t for t in text_responses if t), None)
+                                        return [], [valid_text]  # 返回空列表表示没有图片, 和包含第一个有效文本的列表
+                                    return [], []
+
+                                # 获取第一个有效的图片和文本
+                                first_valid_image = next((img for img in image_datas if img), None)
+                                first_valid_text = next((text for text in text_responses if text), None)
+
+                                return [first_valid_image], [first_valid_text]
+
+                            logger.error(f"未找到编辑后的图片数据: {self._get_response_summary(response_body, result)}")
                             return [], []
+                        except json.JSONDecodeError as je:
+                            logger.error(f"解析JSON响应失败: {je}")
+                            logger.error(f"响应内容: {response_body[:1000].decode('utf-8', 'replace')}...")  # 记录部分响应内容
+                            # 继续重试
+                    elif response.status in self._retry_status_codes:
+                        # 对于需要重试的状态码，记录并继续循环
+                        logger.warning(f"Gemini API返回错误 (状态码: {response.status})，将进行重试")
+                        # 继续重试
+                    else:
+                        # 对于其他错误，记录并返回
+                        logger.error(f"Gemini API调用失败 (状态码: {response.status}): {response_body.decode('utf-8', 'replace')}")
+                        return [], []
             except aiohttp.ClientError as ce:
                 logger.error(f"API请求客户端错误: {ce}")
                 # 继续重试
@@ -6233,18 +6218,41 @@ class GeminiImage(PluginBase):
         logger.error(f"编辑图片失败，已重试 {max_retries} 次")
         return [], []
 
-    def _get_response_summary(self, response_text: str) -> str:
+    def _collect_response_parts(self, parts: List[dict]) -> Tuple[List[dict], int]:
+        """按原始顺序把API响应的parts转换为图文列表，每个part只查找、解码一次
+
+        Args:
+            parts: API响应中的parts
+
+        Returns:
+            Tuple[List[dict], int]: [{"type": "text"/"image", "content": ...}]列表和其中的图片数量
+        """
+        parts_list = []
+        image_count = 0
+        for part in parts:
+            text = part.get("text")
+            if text:
+                parts_list.append({"type": "text", "content": text})
+            inline_data = part.get("inlineData")
+            if inline_data and inline_data.get("data"):
+                parts_list.append({"type": "image", "content": self._b64decode(inline_data["data"])})
+                image_count += 1
+        return parts_list, image_count
+
+    def _get_response_summary(self, response_text: Union[str, bytes], data: dict = None) -> str:
         """获取API响应的摘要，移除base64编码的部分
 
         Args:
-            response_text: API响应的完整文本
+            response_text: API响应的完整文本或原始字节
+            data: 已解析的响应数据，提供时不再重复解析response_text
 
         Returns:
             str: 响应摘要，移除了base64编码的部分
         """
         try:
             # 尝试解析JSON
-            data = json.loads(response_text)
+            if data is None:
+                data = self._json_loads(response_text)
 
             # 创建一个新的对象来存储摘要
             summary = {}
@@ -6320,51 +6328,82 @@ class GeminiImage(PluginBase):
             return result
         except Exception as e:
             # 如果解析失败，返回前300个字符，避免输出过多内容
+            if isinstance(response_text, bytes):
+                response_text = response_text[:301].decode("utf-8", "replace")
             truncated_text = response_text[:300] + "... [RESPONSE TRUNCATED]" if len(response_text) > 300 else response_text
             return f"[无法解析完整响应: {str(e)}] 响应开头: {truncated_text}"
 
     def _is_likely_base64(self, text: str) -> bool:
         """检查文本是否可能是base64编码的数据"""
-        import string
-
-        # 检查是否只包含base64字符
-        if not all(c in string.ascii_letters + string.digits + '+/=' for c in text):
+        # 检查是否只包含base64字符：删除所有base64字符后应为空串
+        if text.translate(self._base64_delete_table):
             return False
 
         # 检查长度是否是4的倍数（可能有填充）
         if len(text) % 4 != 0:
             return False
 
-        # 检查是否有足够的变化（随机性）
-        char_counts = {}
-        for c in text:
-            char_counts[c] = char_counts.get(c, 0) + 1
-
-        # 如果字符种类太少，可能不是base64
-        if len(char_counts) < 10:
+        # 检查是否有足够的变化（随机性），如果字符种类太少，可能不是base64
+        if len(set(text)) < 10:
             return False
 
         return True
 
-    def _translate_gemini_message(self, text: str) -> str:
-        """将Gemini API的英文消息翻译成中文"""
-        # 常见的内容审核拒绝消息翻译
-        if "I'm unable to create this image" in text:
-            if "sexually suggestive" in text:
-                return "抱歉，我无法创建这张图片。我不能生成带有性暗示或促进有害刻板印象的内容。请提供其他描述。"
-            elif "harmful" in text or "dangerous" in text:
-                return "抱歉，我无法创建这张图片。我不能生成可能有害或危险的内容。请提供其他描述。"
-            elif "violent" in text:
-                return "抱歉，我无法创建这张图片。我不能生成暴力或血腥的内容。请提供其他描述。"
-            else:
-                return "抱歉，我无法创建这张图片。请尝试修改您的描述，提供其他内容。"
-
+    # 常见图片格式Base64编码后的开头（PNG、JPEG、GIF、WEBP、XML、BMP、TIFF），用于在消息内容中定位图片数据
+    _base64_image_markers = ("iVBOR", "/9j/", "R0lGOD", "UklGR", "PD94bWw", "Qk0", "SUkqAA")
+
+    # 拒绝消息中的关键短语，合并为一个正则，一次扫描找出所有出现的短语
+    _rejection_marker_regex = re.compile(
+        "I'm unable to create this image|sexually suggestive|harmful|dangerous|violent"
+        "|cannot generate|can't generate|against our content policy"
+    )
+
+    # 常见的内容审核拒绝消息翻译，按优先级排列：(需同时出现的短语, 中文提示)
+    _rejection_translations = (
+        (("I'm unable to create this image", "sexually suggestive"),
+         "抱歉，我无法创建这张图片。我不能生成带有性暗示或促进有害刻板印象的内容。请提供其他描述。"),
+        (("I'm unable to create this image", "harmful"),
+         "抱歉，我无法创建这张图片。我不能生成可能有害或危险的内容。请提供其他描述。"),
+        (("I'm unable to create this image", "dangerous"),
+         "抱歉，我无法创建这张图片。我不能生成可能有害或危险的内容。请提供其他描述。"),
+        (("I'm unable to create this image", "violent"),
+         "抱歉，我无法创建这张图片。我不能生成暴力或血腥的内容。请提供其他描述。"),
+        (("I'm unable to create this image",),
+         "抱歉，我无法创建这张图片。请尝试修改您的描述，提供其他内容。"),
         # 其他常见拒绝消息
-        if "cannot generate" in text or "can't generate" in text:
-            return "抱歉，我无法生成符合您描述的图片。请尝试其他描述。"
+        (("cannot generate",), "抱歉，我无法生成符合您描述的图片。请尝试其他描述。"),
+        (("can't generate",), "抱歉，我无法生成符合您描述的图片。请尝试其他描述。"),
+        (("against our content policy",), "抱歉，您的请求违反了内容政策，无法生成相关图片。请提供其他描述。"),
+    )
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _system_instruction(prompt: str) -> dict:
+        """构建systemInstruction请求片段
+
+        系统提示词都是模块常量，按提示词缓存，各次请求共用同一个只读字典，不再每次重新构建
+
+        Args:
+            prompt: 系统提示词
 
-        if "against our content policy" in text:
-            return "抱歉，您的请求违反了内容政策，无法生成相关图片。请提供其他描述。"
+        Returns:
+            dict: systemInstruction请求片段
+        """
+        return {"role": "system", "parts": [{"text": prompt}]}
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _translate_gemini_message(text: str) -> str:
+        """将Gemini API的英文消息翻译成中文
+
+        拒绝消息的种类有限，结果按原文缓存，重复出现时直接命中；
+        未命中缓存时只对原文做一次正则扫描，再按优先级查表，而不是逐个短语查找
+        """
+        markers = set(GeminiImage._rejection_marker_regex.findall(text))
+        if markers:
+            for required, translation in GeminiImage._rejection_translations:
+                if markers.issuperset(required):
+                    return translation
 
         # 默认情况，原样返回
         return text
@@ -6388,14 +6427,14 @@ class GeminiImage(PluginBase):
             # 检查该密钥是否仍然在可用列表中
             if api_key in self.api_keys:
                 # 更新最后使用时间
-                self.key_last_used[api_key] = time.time()
+                self.key_last_used[api_key] = time.monotonic()
                 return api_key
 
         # 为会话分配新的API密钥（轮询方式）
         api_key = self.rotate_api_key()
         self.session_key_mapping[session_id] = api_key
         # 更新最后使用时间
-        self.key_last_used[api_key] = time.time()
+        self.key_last_used[api_key] = time.monotonic()
         logger.info(f"为会话 {session_id} 分配新的API密钥")
         return api_key
 
@@ -6447,7 +6486,7 @@ class GeminiImage(PluginBase):
             # 更新会话映射
             self.session_key_mapping[session_id] = new_api_key
             # 更新最后使用时间
-            self.key_last_used[new_api_key] = time.time()
+            self.key_last_used[new_api_key] = time.monotonic()
             logger.info(f"为会话 {session_id} 重新分配API密钥")
             return new_api_key
 
@@ -6459,7 +6498,7 @@ class GeminiImage(PluginBase):
         Args:
             expiry_seconds: 过期时间（秒），默认1小时
         """
-        current_time = time.time()
+        current_time = time.monotonic()
         expired_sessions = []
 
         # 查找过期的会话
@@ -6485,23 +6524,84 @@ class GeminiImage(PluginBase):
         if force_clear:
             # 强制清空所有图片缓存
             self.image_cache.clear()
+            self._image_cache_index.clear()
+            self._image_cache_expiry.clear()
             logger.info(f"已强制清空所有图片缓存")
             return
 
-        current_time = time.time()
+        deadline = time.monotonic() - self.image_cache_timeout
         expired_keys = []
 
-        for key, cache_data in self.image_cache.items():
-            if current_time - cache_data["timestamp"] > self.image_cache_timeout:
+        # 过期队列按写入时间排列，遇到第一个未过期的记录即可停止
+        while self._image_cache_expiry and self._image_cache_expiry[0][0] < deadline:
+            timestamp, key = self._image_cache_expiry.popleft()
+            cache_data = self.image_cache.get(key)
+            # 条目可能已被淘汰、删除或重新写入，只删除时间戳仍匹配的条目
+            if cache_data is not None and cache_data["timestamp"] == timestamp:
                 expired_keys.append(key)
-                logger.info(f"图片缓存过期，将删除键: {key}")
+                logger.info("图片缓存过期，将删除键: {}", key)
 
         for key in expired_keys:
-            del self.image_cache[key]
+            self._image_cache_remove(key)
 
         # 记录当前缓存状态
         if expired_keys:
-            logger.info(f"清理后图片缓存包含 {len(self.image_cache)} 个条目")
+            logger.info("清理后图片缓存包含 {} 个条目", len(self.image_cache))
+
+    def _image_cache_put(self, key, entry: dict):
+        """写入图片缓存，超过最大条目数时淘汰最久未使用的条目
+
+        Args:
+            key: 缓存键
+            entry: 缓存内容，包含content和timestamp
+        """
+        self.image_cache[key] = entry
+        self.image_cache.move_to_end(key)
+        self._image_cache_expiry.append((entry["timestamp"], key))
+        for part in self._image_cache_key_parts(key):
+            self._image_cache_index[part].add(key)
+        while len(self.image_cache) > self.image_cache_max_entries:
+            evicted_key = next(iter(self.image_cache))
+            self._image_cache_remove(evicted_key)
+            logger.info("图片缓存已满，淘汰最久未使用的条目: {}", evicted_key)
+
+    @staticmethod
+    def _image_cache_key_parts(key) -> tuple:
+        """返回缓存键中用于索引的ID，(聊天ID, 用户ID)元组键按两个ID索引，其他键按自身索引"""
+        return key if isinstance(key, tuple) else (key,)
+
+    def _image_cache_remove(self, key):
+        """删除图片缓存条目，并同步更新ID索引
+
+        Args:
+            key: 缓存键
+        """
+        self.image_cache.pop(key, None)
+        for part in self._image_cache_key_parts(key):
+            keys = self._image_cache_index.get(part)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._image_cache_index[part]
+
+    def _image_cache_get(self, key) -> Optional[bytes]:
+        """读取未过期的图片缓存，命中时标记为最近使用
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            Optional[bytes]: 图片数据，未命中或已过期时返回None
+        """
+        cache_data = self.image_cache.get(key)
+        if not cache_data:
+            return None
+        if time.monotonic() - cache_data["timestamp"] > self.image_cache_timeout:
+            # 读取时顺带删除过期条目，不必等待定期清理
+            self._image_cache_remove(key)
+            return None
+        self.image_cache.move_to_end(key)
+        return cache_data["content"]
 
     def _save_image_to_cache(self, chat_id: str, user_id: str, image_data: bytes, file_path: str = None):
         """保存图片数据到缓存
@@ -6518,25 +6618,24 @@ class GeminiImage(PluginBase):
         # 如果提供了文件路径，直接使用
         if file_path and os.path.exists(file_path):
             self.last_images[conversation_key] = file_path
-            logger.info(f"直接使用系统缓存的图片路径: {file_path}")
+            logger.info("直接使用系统缓存的图片路径: {}", file_path)
             return
 
         # 如果没有提供文件路径但有图片数据，保存到本地
         if image_data:
             # 保存到最后一次生成的图片路径
-            image_path = os.path.join(self.save_dir, f"cache_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
+            image_path = self._new_file_path("cache")
             try:
-                with open(image_path, "wb") as f:
-                    f.write(image_data)
+                self._atomic_write(image_path, image_data)
                 self.last_images[conversation_key] = image_path
-                logger.info(f"保存图片到文件: {image_path}")
+                logger.info("保存图片到文件: {}", image_path)
             except Exception as e:
-                logger.error(f"保存图片到文件失败: {e}")
+                logger.error("保存图片到文件失败: {}", e)
         else:
             logger.warning("尝试保存空图片数据到缓存")
 
         # 更新会话时间戳
-        self.conversation_timestamps[conversation_key] = time.time()
+        self._touch_conversation(conversation_key)
 
     async def _get_recent_image(self, chat_id: str, user_id: str) -> tuple:
         """获取最近的图片数据，区分群聊中的不同用户
@@ -6547,45 +6646,46 @@ class GeminiImage(PluginBase):
                    如果只有数据，则返回 (None, image_data)
                    如果都没有，则返回 (None, None)
         """
-        logger.info(f"尝试获取图片缓存，chat_id: {chat_id}, user_id: {user_id}")
+        logger.debug("尝试获取图片缓存，chat_id: {}, user_id: {}", chat_id, user_id)
 
         # 构建会话标识
         conversation_key = f"{chat_id}_{user_id}"
 
         # 记录当前缓存状态
-        logger.info(f"当前插件图片缓存包含 {len(self.image_cache)} 个条目")
+        logger.debug("当前插件图片缓存包含 {} 个条目", len(self.image_cache))
 
         # 1. 优先检查所有可能的系统缓存图片路径
 
         # 1.1 检查conversation_key对应的图片路径
         last_image_path = self.last_images.get(conversation_key)
-        if last_image_path and os.path.exists(last_image_path):
+        if last_image_path and self._image_available(last_image_path):
             if "/app/files/" in last_image_path:
-                logger.info(f"找到系统缓存的图片路径(conversation_key): {last_image_path}")
+                logger.info("找到系统缓存的图片路径(conversation_key): {}", last_image_path)
                 return (last_image_path, None)  # 返回路径，不返回数据
 
         # 1.2 检查所有包含chat_id或user_id的键对应的图片路径
         for key, value in self.last_images.items():
-            if (chat_id in key or user_id in key) and os.path.exists(value):
+            if (chat_id in key or user_id in key) and self._image_available(value):
                 if "/app/files/" in value:
-                    logger.info(f"找到系统缓存的图片路径(key): {value}")
+                    logger.info("找到系统缓存的图片路径(key): {}", value)
                     return (value, None)  # 返回路径，不返回数据
 
         # 1.3 尝试在/app/files/目录下查找最近的图片
         try:
             app_files_dir = "/app/files/"
             if os.path.exists(app_files_dir):
-                # 获取目录中的所有文件
-                files = os.listdir(app_files_dir)
-                # 按修改时间排序，最新的在前面
-                files.sort(key=lambda x: os.path.getmtime(os.path.join(app_files_dir, x)), reverse=True)
-                # 考虑jpeg和png文件
-                image_files = [f for f in files if f.endswith(('.jpeg', '.png', '.jpg'))]
-
-                if image_files:
+                # 只需要最新的一张图片：先按扩展名过滤，再取修改时间最大的一项，无需对整个目录排序
+                with os.scandir(app_files_dir) as entries:
+                    latest_entry = max(
+                        (entry for entry in entries if entry.name.endswith(('.jpeg', '.png', '.jpg'))),
+                        key=lambda entry: entry.stat().st_mtime,
+                        default=None,
+                    )
+
+                if latest_entry is not None:
                     # 获取最新的图片文件
-                    latest_file = os.path.join(app_files_dir, image_files[0])
-                    logger.info(f"找到最新的系统缓存图片: {latest_file}")
+                    latest_file = latest_entry.path
+                    logger.info("找到最新的系统缓存图片: {}", latest_file)
 
                     # 保存图片路径到最后一次生成的图片路径
                     self.last_images[conversation_key] = latest_file
@@ -6593,71 +6693,44 @@ class GeminiImage(PluginBase):
                     # 直接返回图片路径，不读取图片数据
                     return (latest_file, None)  # 返回路径，不返回数据
         except Exception as e:
-            logger.error(f"尝试获取系统缓存的最新图片失败: {e}")
+            logger.error("尝试获取系统缓存的最新图片失败: {}", e)
 
         # 2. 如果没有找到系统缓存的图片路径，尝试从图片数据缓存中获取
 
-        # 2.1 尝试从用户专属缓存获取 - 使用元组键
-        cache_key = (chat_id, user_id)
-        if cache_key in self.image_cache:
-            cache_data = self.image_cache[cache_key]
-            if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                logger.info(f"找到用户 {user_id} 在聊天 {chat_id} 中的图片缓存，使用元组键")
-                return (None, cache_data["content"])  # 返回数据，不返回路径
-
-        # 尝试使用字符串格式的键 "chat_id_user_id"
-        str_cache_key = f"{chat_id}_{user_id}"
-        if str_cache_key in self.image_cache:
-            cache_data = self.image_cache[str_cache_key]
-            if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                logger.info(f"找到用户 {user_id} 在聊天 {chat_id} 中的图片缓存，使用字符串键")
-                return (None, cache_data["content"])  # 返回数据，不返回路径
-
-        # 如果是私聊且没找到，尝试使用旧格式的键
+        # 2.1 尝试从用户专属缓存获取 - 先使用元组键，再使用字符串格式的键 "chat_id_user_id"
+        for cache_key in ((chat_id, user_id), f"{chat_id}_{user_id}"):
+            image_data = self._image_cache_get(cache_key)
+            if image_data:
+                logger.info("找到用户 {} 在聊天 {} 中的图片缓存，键: {}", user_id, chat_id, cache_key)
+                return (None, image_data)  # 返回数据，不返回路径
+
+        # 如果是私聊且没找到，尝试使用旧格式的键（chat_id 或 user_id）
         if chat_id == user_id:
-            # 尝试直接使用chat_id作为键
-            if chat_id in self.image_cache:
-                cache_data = self.image_cache[chat_id]
-                if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                    logger.info(f"找到旧格式的图片缓存，键: {chat_id}")
-                    return (None, cache_data["content"])  # 返回数据，不返回路径
-
-            # 尝试使用user_id作为键
-            if user_id in self.image_cache:
-                cache_data = self.image_cache[user_id]
-                if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                    logger.info(f"找到旧格式的图片缓存，键: {user_id}")
-                    return (None, cache_data["content"])  # 返回数据，不返回路径
-
-        # 尝试查找任何包含chat_id或user_id的键
-        for key in list(self.image_cache.keys()):
-            if isinstance(key, tuple) and len(key) == 2:
-                # 检查元组中是否包含chat_id或user_id
-                if chat_id in key or user_id in key:
-                    cache_data = self.image_cache[key]
-                    if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                        logger.info(f"找到相关的图片缓存，键: {key}")
-                        return (None, cache_data["content"])  # 返回数据，不返回路径
-            elif isinstance(key, str):
-                # 检查字符串键中是否包含chat_id或user_id
-                if chat_id in key or user_id in key:
-                    cache_data = self.image_cache[key]
-                    if time.time() - cache_data["timestamp"] <= self.image_cache_timeout:
-                        logger.info(f"找到相关的图片缓存，键: {key}")
-                        return (None, cache_data["content"])  # 返回数据，不返回路径
+            image_data = self._image_cache_get(chat_id)
+            if image_data:
+                logger.info("找到旧格式的图片缓存，键: {}", chat_id)
+                return (None, image_data)  # 返回数据，不返回路径
+
+        # 通过ID索引查找任何包含chat_id或user_id的键，无需遍历整个缓存
+        for part in (chat_id, user_id):
+            for key in list(self._image_cache_index.get(part, ())):
+                image_data = self._image_cache_get(key)
+                if image_data:
+                    logger.info("找到相关的图片缓存，键: {}", key)
+                    return (None, image_data)  # 返回数据，不返回路径
 
         # 3. 如果所有尝试都失败，检查最后一次生成的图片（非系统缓存）
         last_image_path = self.last_images.get(conversation_key)
-        if last_image_path and os.path.exists(last_image_path):
+        if last_image_path and self._image_available(last_image_path):
             try:
                 # 普通图片路径（非系统缓存）
                 if "/app/files/" not in last_image_path:
-                    logger.info(f"找到普通图片路径: {last_image_path}")
+                    logger.info("找到普通图片路径: {}", last_image_path)
                     return (last_image_path, None)  # 返回路径，不返回数据
             except Exception as e:
-                logger.error(f"处理图片路径失败: {e}")
+                logger.error("处理图片路径失败: {}", e)
 
-        logger.warning(f"未找到任何可用的图片缓存，chat_id: {chat_id}, user_id: {user_id}")
+        logger.warning("未找到任何可用的图片缓存，chat_id: {}, user_id: {}", chat_id, user_id)
         return (None, None)  # 都没有找到，返回(None, None)
 
     async def _handle_analyze_image(self, bot: WechatAPIClient, message: dict, image_data: bytes):
@@ -6679,10 +6752,10 @@ class GeminiImage(PluginBase):
             # 发送提示消息
             # 尝试使用from_wxid而不是chat_id
             if from_wxid:
-                await bot.send_text_message(from_wxid, "正在分析图片，请稍候...")
+                self._send_notice(bot.send_text_message(from_wxid, "正在分析图片，请稍候..."))
                 logger.info(f"使用from_wxid发送图片分析提示消息")
             else:
-                await bot.send_text_message(chat_id, "正在分析图片，请稍候...")
+                self._send_notice(bot.send_text_message(chat_id, "正在分析图片，请稍候..."))
                 logger.info(f"使用chat_id发送图片分析提示消息")
 
             # 创建消息信息字典，传递给_analyze_image方法
@@ -6709,12 +6782,11 @@ class GeminiImage(PluginBase):
 
                     # 保存图片到会话历史，以便后续对话
                     # 保存图片到本地
-                    image_path = os.path.join(self.save_dir, f"analysis_{int(time.time())}_{uuid.uuid4().hex[:8]}.png")
-                    with open(image_path, "wb") as f:
-                        f.write(image_data)
+                    image_path = self._new_file_path("analysis")
+                    self._atomic_write(image_path, image_data)
 
                     # 更新会话历史
-                    conversation_history = self.conversations.get(conversation_key, [])
+                    conversation_history = self.conversations.get(conversation_key) or deque(maxlen=self.conversation_max_length)
 
                     # 添加用户消息（包含图片）
                     user_message = {
@@ -6739,7 +6811,7 @@ class GeminiImage(PluginBase):
                     self.conversations[conversation_key] = conversation_history
 
                     # 更新会话时间戳
-                    self.conversation_timestamps[conversation_key] = time.time()
+                    self._touch_conversation(conversation_key)
 
                     # 保存最后生成的图片路径
                     self.last_images[conversation_key] = image_path